@@ -1,6 +1,10 @@
+import os
+import time
 import streamlit as st
-from src.logic import initialize_qa_chain, run_heuristic_checks, analyze_code_with_ai
+from src.logic import get_index_path, initialize_qa_chain, run_heuristic_checks, stream_analysis_with_ai
+from src.jobs import JobStore, WorkerPool, COMPLETED
 from src.logger_config import logger
+from src.tracing import metrics_snapshot
 import streamlit.components.v1 as components
 
 # --- Theme and Configuration ---
@@ -285,6 +289,55 @@ st.markdown("""
     </div>
 """, unsafe_allow_html=True)
 
+@st.cache_resource
+def start_audit_workers(_qa_chain):
+    """
+    Starts the background worker pool once per server process.
+    Jobs live in SQLite, so they survive reruns, reloads and restarts.
+    """
+    job_store = JobStore(os.getenv("AUDIT_JOBS_DB", "audit_jobs.db"))
+    WorkerPool(job_store, _qa_chain, workers=int(os.getenv("AUDIT_WORKERS", "2"))).start()
+    return job_store
+
+def render_diagnostics():
+    """Shows where audit time, tokens and cost went, per stage and per function of the last audit."""
+    snapshot = metrics_snapshot()
+    totals = snapshot["totals"]
+    col1, col2, col3, col4, col5 = st.columns(5)
+    col1.metric("Audits", snapshot["spans"].get("audit", {}).get("count", 0))
+    col2.metric("Tokens in / out", f"{totals.get('tokens_in', 0):,} / {totals.get('tokens_out', 0):,}")
+    col3.metric("Estimated cost", f"${totals['cost_usd']:.4f}")
+    col4.metric("Fallbacks", totals.get("code_fix_fallbacks", 0) + totals.get("retrieval_fallbacks", 0)
+                + totals.get("parse_fallbacks", 0))
+    col5.metric("Fingerprint cache hits / misses",
+                f"{totals.get('fingerprint_cache_hits', 0):,} / {totals.get('fingerprint_cache_misses', 0):,}")
+
+    st.markdown("**Stages**")
+    st.dataframe([
+        {"stage": name, "count": stats["count"], "errors": stats["errors"], "p50 (ms)": round(stats["p50"] * 1000, 1),
+         "p95 (ms)": round(stats["p95"] * 1000, 1), "max (ms)": round(stats["max"] * 1000, 1),
+         "tokens in": stats["counters"].get("tokens_in", 0), "tokens out": stats["counters"].get("tokens_out", 0)}
+        for name, stats in sorted(snapshot["spans"].items())
+    ], use_container_width=True, hide_index=True)
+
+    audits = [trace for trace in snapshot["recent"] if trace["name"] == "audit"]
+    if audits:
+        last_audit = audits[-1]
+        source = f"job {last_audit['job_id']}" if last_audit.get("job_id") else last_audit.get("mode", "interactive")
+        counters = last_audit["counters"]
+        # Job audits match known patterns at submit time, outside the audit span
+        cache = ""
+        if counters.get("fingerprint_cache_hits") or counters.get("fingerprint_cache_misses"):
+            cache = ", fingerprint cache " + ("hit" if counters.get("fingerprint_cache_hits") else "miss")
+        st.markdown(f"**Last audit** ({source}) — {last_audit['duration']:.2f}s, est. ${last_audit['cost_usd']:.4f}{cache}")
+        st.dataframe([
+            {"function": child.get("function"), "time (s)": round(child["duration"], 3),
+             "llm (s)": round(sum(c["duration"] for c in child.get("children", []) if c["name"].startswith("llm.")), 3),
+             "tokens in": child["counters"].get("tokens_in", 0), "tokens out": child["counters"].get("tokens_out", 0),
+             "fallbacks": child["counters"].get("code_fix_fallbacks", 0), "cost ($)": round(child["cost_usd"], 5)}
+            for child in last_audit.get("children", []) if child["name"] == "audit.function"
+        ], use_container_width=True, hide_index=True)
+
 # Initialize the QA chain
 qa_chain = initialize_qa_chain()
 
@@ -346,6 +399,11 @@ if qa_chain:
             
             st.markdown("<br>", unsafe_allow_html=True)
             
+            run_in_background = st.checkbox(
+                "Run as background job",
+                help="Recommended for large contracts: the audit keeps running and can be resumed after a page reload."
+            )
+            
             col1, col2, col3 = st.columns([3,1,1])
             with col1:
                 submitted = st.form_submit_button("🔍 Analyze Contract", type="primary", use_container_width=True)
@@ -375,18 +433,49 @@ if qa_chain:
             st.markdown("---")
             
             st.markdown("### 🤖 Deep AI Analysis")
-            with st.spinner(" AI is performing comprehensive analysis..."):
+            if run_in_background:
+                # The job id in the URL lets the progress panel below survive reloads
+                st.query_params["job"] = start_audit_workers(qa_chain).submit(user_input, get_index_path(qa_chain))
+            else:
+                analysis_placeholder = st.empty()
                 try:
-                    analysis_result = analyze_code_with_ai(qa_chain, user_input)
-                    st.markdown(f"""
+                    # Render findings as they are produced instead of waiting for the full report,
+                    # then swap the raw stream for the styled card once the analysis is complete
+                    with analysis_placeholder.container():
+                        analysis_result = st.write_stream(stream_analysis_with_ai(qa_chain, user_input))
+                    analysis_placeholder.markdown(f"""
                         <div class="custom-card">
                             {analysis_result}
                         </div>
                     """, unsafe_allow_html=True)
-                    
+                
                 except Exception as e:
                     logger.critical(f"An unhandled exception occurred in the main analysis block: {e}", exc_info=True)
                     st.error("⚠️ A critical error occurred during analysis. The incident has been logged. Please check `auditor.log` for details.")
+        
+        with st.expander("🩺 Diagnostics", expanded=False):
+            render_diagnostics()
+
+        if "job" in st.query_params:
+            job = start_audit_workers(qa_chain).get_job(st.query_params["job"])
+            if job is None:
+                st.warning("⚠️ The requested background job could not be found.")
+            else:
+                st.markdown(f"### 🗂️ Background Audit `{job['id'][:8]}`")
+                st.progress(
+                    job["completed_functions"] / max(job["total_functions"], 1),
+                    text=f"{job['completed_functions']}/{job['total_functions']} functions analyzed"
+                )
+                if job["report"]:
+                    st.markdown(f"""
+                        <div class="custom-card">
+                            {job["report"]}
+                        </div>
+                    """, unsafe_allow_html=True)
+                if job["status"] != COMPLETED:
+                    # Poll the job store until every function is done
+                    time.sleep(2)
+                    st.rerun()
     
     # with tab2:
     #     st.markdown("### 📚 Security Knowledge Base")
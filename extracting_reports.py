@@ -1,31 +1,331 @@
+import argparse
+import hashlib
+import json
 import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # GitHub API endpoint for the folder
 API_URL = "https://api.github.com/repos/pashov/audits/contents/team/md"
 
-# Output directory
-OUTPUT_DIR = "downloaded_md_files"
-os.makedirs(OUTPUT_DIR, exist_ok=True)
-
-# Step 1: Fetch folder contents from GitHub API
-response = requests.get(API_URL)
-if response.status_code != 200:
-    raise Exception(f"Failed to fetch {API_URL}: {response.status_code}")
-
-files = response.json()
-
-# Step 2: Filter for .md files and download
-count = 0
-for file in files:
-    if file["name"].endswith(".md"):
-        print(f"Downloading {file['name']}...")
-        content = requests.get(file["download_url"])
-        if content.status_code == 200:
-            with open(os.path.join(OUTPUT_DIR, file["name"]), "wb") as f:
-                f.write(content.content)
-            count += 1
+# Output directory: the audit reports folder of the knowledge base
+KNOWLEDGE_DIR = "knowledge_base"
+OUTPUT_DIR = os.path.join(KNOWLEDGE_DIR, "downloaded_md_files")
+
+# Local record of what was last downloaded (listing page ETags, blob SHAs and file ETags)
+MANIFEST_FILE = ".manifest.json"
+
+# Parallel downloads; the connection pool is sized to match
+MAX_WORKERS = 8
+PAGE_SIZE = 100
+
+
+def create_session(workers=MAX_WORKERS, token=None):
+    """
+    Creates a pooled session shared by all requests, retrying throttled and failed
+    GETs with backoff (honouring Retry-After). A GitHub token raises the API rate limit.
+    """
+    session = requests.Session()
+    retry = Retry(total=5, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=("GET",), respect_retry_after_header=True)
+    adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers, max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    token = token or os.getenv("GITHUB_TOKEN")
+    if token:
+        session.headers["Authorization"] = f"Bearer {token}"
+    return session
+
+
+def git_blob_sha(content):
+    """The SHA-1 GitHub reports for a file: sha1("blob <size>\\0" + content)."""
+    return hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+
+
+def atomic_write(path, content):
+    """Writes ``content`` to a temporary file next to ``path`` and renames it into place."""
+    directory = os.path.dirname(path) or "."
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def load_manifest(output_dir):
+    path = os.path.join(output_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {"listing_pages": None, "files": {}}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(output_dir, manifest):
+    atomic_write(os.path.join(output_dir, MANIFEST_FILE), json.dumps(manifest, indent=2, sort_keys=True).encode("utf-8"))
+
+
+def list_markdown_files(session, api_url, pages=None):
+    """
+    Lists the Markdown files of the folder, following ``Link: rel="next"`` pagination.
+
+    ``pages`` holds the [url, etag] of every page of the previous listing. The listing
+    counts as unchanged only if each of those pages answers 304; otherwise it is
+    fetched again from the first page.
+
+    Returns:
+        tuple: (files, pages). ``files`` is None when the listing is unchanged; otherwise
+               a list of {"name", "sha", "download_url"}, and ``pages`` the new page ETags.
+    """
+    headers = {"Accept": "application/vnd.github+json"}
+    if pages and all(etag for _, etag in pages):
+        for url, etag in pages:
+            response = session.get(url, headers={**headers, "If-None-Match": etag}, timeout=30)
+            if response.status_code != 304:
+                break
         else:
-            print(f"❌ Failed to download {file['name']}")
+            return None, pages
+
+    files, pages = [], []
+    url, params = api_url, {"per_page": PAGE_SIZE}
+    while url:
+        response = session.get(url, params=params, headers=headers, timeout=30)
+        if response.status_code != 200:
+            raise Exception(f"Failed to fetch {url}: {response.status_code}")
+        pages.append([response.url, response.headers.get("ETag")])
+        files.extend(
+            {"name": entry["name"], "sha": entry.get("sha"), "download_url": entry["download_url"]}
+            for entry in response.json() if entry["name"].endswith(".md")
+        )
+        url, params = response.links.get("next", {}).get("url"), None
+    return files, pages
+
+
+def download_file(session, entry, known, output_dir):
+    """
+    Downloads one file unless the server reports it unchanged.
+
+    Returns:
+        tuple: (status, manifest entry), status being "added", "updated" or "unchanged".
+    """
+    path = os.path.join(output_dir, entry["name"])
+    headers = {}
+    if known.get("etag") and os.path.exists(path):
+        headers["If-None-Match"] = known["etag"]
+    response = session.get(entry["download_url"], headers=headers, timeout=60)
+    if response.status_code == 304:
+        return "unchanged", {**known, "sha": entry["sha"]}
+    response.raise_for_status()
+
+    content = response.content
+    if entry["sha"] and git_blob_sha(content) != entry["sha"]:
+        raise ValueError(f"Checksum mismatch for {entry['name']}; the file was not written.")
+    atomic_write(path, content)
+    return ("updated" if known else "added"), {"sha": entry["sha"] or git_blob_sha(content),
+                                               "etag": response.headers.get("ETag"),
+                                               "download_url": entry["download_url"]}
+
+
+def sync_reports(api_url=API_URL, output_dir=OUTPUT_DIR, workers=MAX_WORKERS, session=None, prune=False):
+    """
+    Brings ``output_dir`` in line with the remote folder, transferring only what changed.
+
+    A file whose listed blob SHA matches the manifest and exists locally is skipped
+    without a request; otherwise it is fetched conditionally with its stored ETag.
+    Downloads run ``workers`` at a time over one pooled session.
+
+    Returns:
+        dict: Lists of file names under "added", "updated", "unchanged", "removed"
+              (gone upstream; deleted locally only with ``prune``) and "failed".
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    session = session or create_session(workers)
+    manifest = load_manifest(output_dir)
+    result = {"added": [], "updated": [], "unchanged": [], "removed": [], "failed": []}
+
+    files, listing_pages = list_markdown_files(session, api_url, manifest.get("listing_pages"))
+    if files is None:
+        print("Listing unchanged since the last sync.")
+        files = [{"name": name, "sha": known["sha"], "download_url": known["download_url"]}
+                 for name, known in manifest["files"].items() if not known.get("removed")]
+
+    to_fetch = []
+    for entry in files:
+        known = manifest["files"].get(entry["name"], {})
+        if known.get("sha") == entry["sha"] and entry["sha"] and os.path.exists(os.path.join(output_dir, entry["name"])):
+            result["unchanged"].append(entry["name"])
+        else:
+            to_fetch.append((entry, known))
+
+    print(f"{len(files)} Markdown files listed, {len(to_fetch)} to fetch with {workers} workers...")
+    lock = threading.Lock()
+
+    def fetch(item):
+        entry, known = item
+        try:
+            status, new_entry = download_file(session, entry, known, output_dir)
+        except Exception as e:
+            print(f"❌ Failed to download {entry['name']}: {e}")
+            status, new_entry = "failed", known or None
+        with lock:
+            result[status].append(entry["name"])
+            if new_entry:
+                manifest["files"][entry["name"]] = new_entry
+        if status in ("added", "updated"):
+            print(f"  -> {status.capitalize()}: {entry['name']}")
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(fetch, to_fetch))
+
+    listed = {entry["name"] for entry in files}
+    for name in listed & set(manifest["files"]):
+        manifest["files"][name].pop("removed", None)
+    for name in sorted(set(manifest["files"]) - listed):
+        result["removed"].append(name)
+        if prune:
+            manifest["files"].pop(name)
+            path = os.path.join(output_dir, name)
+            if os.path.exists(path):
+                os.remove(path)
+        else:
+            # Kept locally, but no longer part of the listing an unchanged listing stands for
+            manifest["files"][name]["removed"] = True
+
+    # A failed download leaves the listing ETags unset so the next run lists again
+    manifest.pop("listing_etag", None)
+    manifest["listing_pages"] = None if result["failed"] else listing_pages
+    save_manifest(output_dir, manifest)
+    return result
+
+
+def is_within(directory, parent):
+    """True if ``directory`` is ``parent`` or one of its subdirectories."""
+    directory, parent = os.path.abspath(directory), os.path.abspath(parent)
+    return os.path.commonpath([directory, parent]) == parent
+
+
+def update_index(result, output_dir=OUTPUT_DIR, knowledge_dir=KNOWLEDGE_DIR, index_path="faiss_index", pruned=False):
+    """
+    Feeds the changed files of a sync into an incremental index update, falling back
+    to a full build when there is no index yet. The fingerprint index is rebuilt.
+
+    Sources are named relative to ``knowledge_dir`` as in ``load_knowledge_from_directory``,
+    so ``output_dir`` must lie inside it.
+    """
+    if not is_within(output_dir, knowledge_dir):
+        raise ValueError(f"Output directory '{output_dir}' is not inside the knowledge directory '{knowledge_dir}'; "
+                         "a full build would not index its files.")
+
+    from src.fingerprints import build_fingerprint_index
+    from src.knowledge_loader import load_knowledge_from_directory
+    from src.rag_core import build_and_save_vector_store, update_vector_store
+
+    changed = result["added"] + result["updated"]
+    removed = result["removed"] if pruned else []
+    if not changed and not removed:
+        print("Knowledge base unchanged; the index is up to date.")
+        return
+
+    docs = []
+    for name in changed:
+        with open(os.path.join(output_dir, name), "r", encoding="utf-8") as f:
+            docs.append((os.path.relpath(os.path.join(output_dir, name), knowledge_dir), f.read()))
+    removed_sources = [os.path.relpath(os.path.join(output_dir, name), knowledge_dir) for name in removed]
+
+    if not update_vector_store(docs, removed_sources, index_path=index_path):
+        print("No existing index; running a full build.")
+        build_and_save_vector_store(load_knowledge_from_directory(knowledge_dir) or [], index_path=index_path)
+    build_fingerprint_index(output_dir, index_path)
+
+
+def run_fake_github_server(directory, port=8766, page_size=PAGE_SIZE):
+    """
+    Serves ``directory`` like the GitHub contents API (paginated listing with ETags
+    and blob SHAs) plus raw downloads with ETags, for testing the sync offline.
+
+    Returns:
+        tuple: (server, api_url). Call ``server.shutdown()`` to stop it.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import parse_qs, urlparse
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status, body=b"", headers=None):
+            self.send_response(status)
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            names = sorted(name for name in os.listdir(directory) if not name.startswith("."))
+            if url.path == "/contents":
+                entries = []
+                for name in names:
+                    with open(os.path.join(directory, name), "rb") as f:
+                        sha = git_blob_sha(f.read())
+                    entries.append({"name": name, "sha": sha, "download_url": f"http://127.0.0.1:{port}/raw/{name}"})
+                page = int(parse_qs(url.query).get("page", ["1"])[0])
+                headers = {"Content-Type": "application/json"}
+                if page * page_size < len(entries):
+                    headers["Link"] = f'<http://127.0.0.1:{port}/contents?page={page + 1}>; rel="next"'
+                body = json.dumps(entries[(page - 1) * page_size:page * page_size]).encode("utf-8")
+                # Each page has its own ETag, covering its entries and its next link
+                etag = '"%s"' % hashlib.sha1(body + headers.get("Link", "").encode("utf-8")).hexdigest()
+                headers["ETag"] = etag
+                if self.headers.get("If-None-Match") == etag:
+                    return self._send(304, headers={"ETag": etag})
+                return self._send(200, body, headers)
+            if url.path.startswith("/raw/") and url.path[5:] in names:
+                with open(os.path.join(directory, url.path[5:]), "rb") as f:
+                    content = f.read()
+                etag = '"%s"' % git_blob_sha(content)
+                if self.headers.get("If-None-Match") == etag:
+                    return self._send(304, headers={"ETag": etag})
+                return self._send(200, content, {"ETag": etag, "Content-Type": "text/markdown"})
+            self._send(404)
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    # Port 0 picks a free port; the handler builds its URLs from the bound one
+    port = server.server_address[1]
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{port}/contents"
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Sync the audit reports and update the index incrementally.")
+    arg_parser.add_argument("--api-url", default=API_URL)
+    arg_parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    arg_parser.add_argument("--knowledge-dir", default=KNOWLEDGE_DIR)
+    arg_parser.add_argument("--index-path", default="faiss_index")
+    arg_parser.add_argument("--workers", type=int, default=MAX_WORKERS)
+    arg_parser.add_argument("--prune", action="store_true", help="Delete local files that were removed upstream.")
+    arg_parser.add_argument("--no-index", action="store_true", help="Only sync the files; do not update the index.")
+    arg_parser.add_argument("--stand-in", metavar="DIR", help="Sync from a local stand-in server serving DIR.")
+    args = arg_parser.parse_args()
+    if not args.no_index and not is_within(args.output_dir, args.knowledge_dir):
+        arg_parser.error("--output-dir must be inside --knowledge-dir to update the index (or pass --no-index).")
+
+    api_url = args.api_url
+    if args.stand_in:
+        _, api_url = run_fake_github_server(args.stand_in)
 
-print(f"\n✅ Downloaded {count} Markdown files into '{OUTPUT_DIR}' folder.")
+    sync_result = sync_reports(api_url, args.output_dir, workers=args.workers, prune=args.prune)
+    print(f"\n✅ {len(sync_result['added'])} added, {len(sync_result['updated'])} updated, "
+          f"{len(sync_result['unchanged'])} unchanged, {len(sync_result['removed'])} removed upstream, "
+          f"{len(sync_result['failed'])} failed in '{args.output_dir}'.")
+    if not args.no_index:
+        update_index(sync_result, args.output_dir, args.knowledge_dir, args.index_path, pruned=args.prune)
@@ -1,9 +1,13 @@
 import os
 import sys
+import time
 from dotenv import load_dotenv
-from langchain_openai import OpenAIEmbeddings, OpenAI
 from langchain_community.vectorstores import FAISS
 from langchain.chains import RetrievalQA
+from src.embeddings import get_index_embeddings
+from src.openai_client import create_llm
+from src.lexical_index import BM25Index, HybridRetriever
+from src.logic import stream_qa_chain
 
 # Load environment variables from the .env file
 load_dotenv()
@@ -26,16 +30,16 @@ def initialize_qa_chain(index_path="faiss_index"):
     print("Loading the knowledge base (this might take a moment)...")
     try:
         api_key = get_openai_api_key()
-        embeddings = OpenAIEmbeddings(openai_api_key=api_key)
+        embeddings = get_index_embeddings(index_path)
         
         # Load the vector store from the local disk
         vector_store = FAISS.load_local(index_path, embeddings, allow_dangerous_deserialization=True)
         
         # Create the Question-Answering chain
         qa_chain = RetrievalQA.from_chain_type(
-            llm=OpenAI(temperature=0, openai_api_key=api_key),
+            llm=create_llm(api_key),
             chain_type="stuff",
-            retriever=vector_store.as_retriever(),
+            retriever=HybridRetriever(vector_store=vector_store, lexical_index=BM25Index.load(index_path), k=4),
             return_source_documents=True
         )
         print("Auditor is ready. You can start asking questions.")
@@ -45,13 +49,33 @@ def initialize_qa_chain(index_path="faiss_index"):
         return None
 
 
-def query_auditor(qa_chain, query):
+def stream_auditor(qa_chain, query):
     """
-    Queries the Auditor's knowledge base using the initialized chain.
+    Queries the Auditor's knowledge base and prints the answer as it is generated.
+
+    Returns:
+        dict: The answer ("result"), the retrieved "source_documents" and the measured
+              "time_to_first_token" and "total_time" in seconds.
     """
-    print("\nThinking...")
-    result = qa_chain.invoke({"query": query})
-    return result
+    start_time = time.perf_counter()
+    first_token_time = None
+    source_documents = []
+
+    print("\n--- Auditor's Response ---")
+    answer = ""
+    for token in stream_qa_chain(qa_chain, query, source_documents=source_documents):
+        if first_token_time is None and token:
+            first_token_time = time.perf_counter() - start_time
+        answer += token
+        print(token, end="", flush=True)
+    print()
+
+    return {
+        "result": answer,
+        "source_documents": source_documents,
+        "time_to_first_token": first_token_time,
+        "total_time": time.perf_counter() - start_time,
+    }
 
 if __name__ == "__main__":
     qa_chain = initialize_qa_chain()
@@ -70,10 +94,7 @@ if __name__ == "__main__":
                 print("Please enter a valid question.")
                 continue
 
-            response = query_auditor(qa_chain, user_query)
-            
-            print("\n--- Auditor's Response ---")
-            print(response["result"])
+            response = stream_auditor(qa_chain, user_query)
             
             print("\n--- Sources Used ---")
             for doc in response["source_documents"]:
@@ -81,3 +102,6 @@ if __name__ == "__main__":
                 source_file = os.path.basename(doc.metadata.get('source', 'Unknown'))
                 print(f"-> {source_file}")
 
+            first_token_time = response["time_to_first_token"]
+            first_token_text = f"{first_token_time:.2f}s" if first_token_time is not None else "n/a"
+            print(f"\n(time to first finding: {first_token_text}, total time: {response['total_time']:.2f}s)")
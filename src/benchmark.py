@@ -0,0 +1,371 @@
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+import numpy as np
+from langchain_community.vectorstores import FAISS
+import src.openai_client as openai_client
+from src.embeddings import SAMPLE_QUERIES, get_index_embeddings
+from src.fingerprints import FingerprintIndex, build_fingerprint_index
+from src.knowledge_loader import load_knowledge_from_directory
+from src.lexical_index import BM25Index, HybridRetriever
+from src.logger_config import logger
+from src.logic import analyze_code_with_ai, build_qa_chain, run_heuristic_checks
+from src.parser import parse_solidity_code
+from src.rag_core import build_and_save_vector_store, split_into_chunks
+
+CONTRACT_SIZES = (1, 10, 50, 200)
+
+# Function templates for the synthetic contracts; "{i}" makes every name unique.
+# The syntax stays within what the bundled Solidity parser accepts.
+FUNCTION_TEMPLATES = [
+    """    function withdraw{i}(uint256 amount) public {{
+        require(balances[msg.sender] >= amount, "Insufficient balance");
+        (bool ok, ) = msg.sender.call.value(amount)("");
+        require(ok, "Transfer failed");
+        balances[msg.sender] -= amount;
+    }}""",
+    """    function setOwner{i}(address newOwner) public {{
+        require(tx.origin == owner, "Not owner");
+        owner = newOwner;
+    }}""",
+    """    function forward{i}(address target, bytes memory data) public {{
+        target.call(data);
+        emit Forwarded(target, data.length);
+    }}""",
+    """    function deposit{i}() public payable {{
+        balances[msg.sender] += msg.value;
+        totalDeposits += msg.value;
+        emit Deposited(msg.sender, msg.value);
+    }}""",
+    """    function distribute{i}(uint256 reward) public {{
+        for (uint256 j = 0; j < users.length; j++) {{
+            balances[users[j]] += reward / users.length;
+        }}
+    }}""",
+    """    function price{i}(uint256 amount) public view returns (uint256) {{
+        return amount * reserveB / reserveA;
+    }}""",
+    """    function close{i}() public {{
+        require(msg.sender == owner, "Not owner");
+        selfdestruct(payable(owner));
+    }}""",
+    """    function lucky{i}() public view returns (bool) {{
+        return block.timestamp % 7 == 0;
+    }}""",
+]
+
+FINDING_TITLES = [
+    ("H", "Reentrancy in withdrawal allows draining the vault"),
+    ("H", "Authorization through tx.origin can be bypassed"),
+    ("M", "Unchecked return value of low-level call"),
+    ("M", "Unbounded loop over users can exceed the block gas limit"),
+    ("M", "Spot price from reserves can be manipulated with a flash loan"),
+    ("L", "Block timestamp used as a source of randomness"),
+]
+
+PROSE_WORDS = (
+    "the contract attacker user vault token balance reward share price oracle call external state "
+    "update before after transfer amount owner admin function modifier check access control loop gas "
+    "limit reentrancy overflow rounding fee liquidity pool deposit withdraw signature nonce replay"
+).split()
+
+
+def use_synthetic_provider(latency=0.0, latency_sigma=0.0):
+    """
+    Serves every model call of this process from the synthetic provider, so
+    benchmarks and load tests never call the real API. Must run before the first
+    model call, which creates the shared transport with these settings.
+
+    Args:
+        latency (float): Median seconds per synthetic completion call.
+        latency_sigma (float): Lognormal spread of that latency (0 = uniform jitter).
+    """
+    os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+    openai_client.OPENAI_PROVIDER_MODE = "synthetic"
+    openai_client.OPENAI_SYNTHETIC_LATENCY = latency
+    openai_client.OPENAI_SYNTHETIC_LATENCY_SIGMA = latency_sigma
+
+
+def generate_contract(n_functions, seed=0):
+    """
+    Generates a syntactically valid Solidity contract with ``n_functions`` functions,
+    mixing vulnerable and benign templates deterministically from ``seed``.
+    """
+    rng = random.Random(seed)
+    functions = [rng.choice(FUNCTION_TEMPLATES).format(i=i) for i in range(n_functions)]
+    return (
+        "pragma solidity ^0.6.12;\n\n"
+        f"contract Synthetic{n_functions} {{\n"
+        "    address public owner;\n"
+        "    address[] public users;\n"
+        "    uint256 public totalDeposits;\n"
+        "    uint256 public reserveA;\n"
+        "    uint256 public reserveB;\n"
+        "    mapping(address => uint256) public balances;\n"
+        "    event Deposited(address indexed user, uint256 amount);\n"
+        "    event Forwarded(address indexed target, uint256 size);\n\n"
+        + "\n\n".join(functions)
+        + "\n}\n"
+    )
+
+
+def _prose(rng, n_words):
+    return " ".join(rng.choice(PROSE_WORDS) for _ in range(n_words)).capitalize() + "."
+
+
+def generate_corpus(directory, n_reports=50, findings_per_report=6, seed=0):
+    """
+    Writes a synthetic knowledge base shaped like the shipped one: audit reports with
+    "# [H-01] Title" findings, quoted vulnerable code and a recommended fix.
+
+    Returns:
+        str: ``directory``, ready for ``load_knowledge_from_directory``.
+    """
+    rng = random.Random(seed)
+    reports_directory = os.path.join(directory, "downloaded_md_files")
+    os.makedirs(reports_directory, exist_ok=True)
+    for report in range(n_reports):
+        sections = [f"# Synthetic Audit Report {report}\n\n{_prose(rng, 120)}\n"]
+        counters = {}
+        for _ in range(findings_per_report):
+            severity, title = rng.choice(FINDING_TITLES)
+            counters[severity] = counters.get(severity, 0) + 1
+            code = rng.choice(FUNCTION_TEMPLATES).format(i=rng.randrange(1000))
+            sections.append(
+                f"# [{severity}-{counters[severity]:02d}] {title}\n\n"
+                f"## Description\n\n{_prose(rng, rng.randint(60, 200))}\n\n```solidity\n{code}\n```\n\n"
+                f"## Recommendations\n\n{_prose(rng, rng.randint(20, 60))}\n"
+            )
+        with open(os.path.join(reports_directory, f"report_{report:04d}.md"), "w", encoding="utf-8") as f:
+            f.write("\n".join(sections))
+    return directory
+
+
+def summarize(durations, peak_memory):
+    """Reduces the durations (seconds) of a stage to percentiles plus its peak traced memory."""
+    durations = np.asarray(durations)
+    return {
+        "runs": len(durations),
+        "mean": float(durations.mean()),
+        "min": float(durations.min()),
+        "max": float(durations.max()),
+        "p50": float(np.percentile(durations, 50)),
+        "p95": float(np.percentile(durations, 95)),
+        "p99": float(np.percentile(durations, 99)),
+        "peak_memory_mb": peak_memory / 2 ** 20,
+    }
+
+
+def measure(fn, repeats=5, warmup=1):
+    """
+    Times ``fn`` over ``repeats`` runs after ``warmup`` runs, then measures its peak
+    memory in one extra run under tracemalloc so tracing does not skew the timings.
+    """
+    for _ in range(warmup):
+        fn()
+    durations = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - start_time)
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return summarize(durations, peak_memory)
+
+
+def measure_each(fn, items, warmup=1):
+    """Like ``measure``, but each item is one sample (e.g. one retrieval query)."""
+    for item in items[:warmup]:
+        fn(item)
+    durations = []
+    for item in items:
+        start_time = time.perf_counter()
+        fn(item)
+        durations.append(time.perf_counter() - start_time)
+    tracemalloc.start()
+    try:
+        for item in items:
+            fn(item)
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return summarize(durations, peak_memory)
+
+
+def _load_quietly(directory):
+    # The loader prints one line per file, which would dominate the timing of large corpora
+    with contextlib.redirect_stdout(io.StringIO()):
+        return load_knowledge_from_directory(directory)
+
+
+def run_benchmarks(corpus_directory, work_directory, sizes=CONTRACT_SIZES, repeats=5, provider="local", k=5):
+    """
+    Times every pipeline stage with stubbed model backends.
+
+    Returns:
+        dict: Stage name to its summary (see ``summarize``).
+    """
+    stages = {}
+    index_path = os.path.join(work_directory, "faiss_index")
+
+    def stage(name, result):
+        stages[name] = result
+        print(f"  {name:<40} p50 {result['p50'] * 1000:>10.2f} ms   p95 {result['p95'] * 1000:>10.2f} ms   "
+              f"peak {result['peak_memory_mb']:>8.1f} MB", file=sys.stderr)
+
+    docs = _load_quietly(corpus_directory) or []
+    stage("load_knowledge", measure(lambda: _load_quietly(corpus_directory), repeats))
+    stage("chunking", measure(lambda: split_into_chunks(docs), repeats))
+    stage("index_build", measure(lambda: build_and_save_vector_store(docs, index_path=index_path, provider=provider),
+                                 repeats, warmup=0))
+    reports_directory = os.path.join(corpus_directory, "downloaded_md_files")
+    if os.path.isdir(reports_directory):
+        stage("fingerprint_index_build",
+              measure(lambda: build_fingerprint_index(reports_directory, index_path), repeats, warmup=0))
+
+    def load_indexes():
+        embeddings = get_index_embeddings(index_path, provider)
+        return FAISS.load_local(index_path, embeddings, allow_dangerous_deserialization=True), BM25Index.load(index_path)
+
+    stage("index_load", measure(load_indexes, repeats))
+    vector_store, lexical_index = load_indexes()
+    retriever = HybridRetriever(vector_store=vector_store, lexical_index=lexical_index, k=k)
+    stage("retrieval", measure_each(lambda query: retriever.search(query, k=k), list(SAMPLE_QUERIES) * repeats))
+    stage("retrieval_batch", measure(lambda: retriever.batch_search(list(SAMPLE_QUERIES), k=k), repeats))
+
+    fingerprint_index = FingerprintIndex.load(index_path)
+    qa_chain = build_qa_chain(vector_store, openai_client.create_llm(os.environ["OPENAI_API_KEY"]), lexical_index=lexical_index,
+                              index_path=index_path)
+    for size in sizes:
+        code = generate_contract(size, seed=size)
+        functions = parse_solidity_code(code)
+        if len(functions) != size:
+            logger.warning(f"Synthetic contract with {size} functions parsed into {len(functions)} function(s).")
+        stage(f"parse_solidity_code[n={size}]", measure(lambda: parse_solidity_code(code), repeats))
+        stage(f"run_heuristic_checks[n={size}]", measure(lambda: run_heuristic_checks(code), repeats))
+        if fingerprint_index is not None:
+            stage(f"fingerprint_match[n={size}]",
+                  measure(lambda: [fingerprint_index.match(func.get("body") or func["code"]) for func in functions], repeats))
+        stage(f"analyze_code_with_ai[n={size}]", measure(lambda: analyze_code_with_ai(qa_chain, code), repeats))
+    return stages
+
+
+def compare_results(current, baseline, threshold=0.2, min_delta=0.001, memory_min_delta=1.0):
+    """
+    Compares two benchmark results stage by stage.
+
+    A stage regresses when its p50 or p95 grows by more than ``threshold`` (relative)
+    and ``min_delta`` seconds, or its peak memory by more than ``threshold`` and
+    ``memory_min_delta`` MB; the absolute floors keep timer noise on tiny stages out.
+
+    Returns:
+        tuple: (rows, regressions), where each row is
+               (stage, metric, baseline value, current value, relative change, regressed).
+    """
+    rows, regressions = [], []
+    for name, stats in current["stages"].items():
+        base = baseline["stages"].get(name)
+        if base is None:
+            continue
+        for metric, floor in (("p50", min_delta), ("p95", min_delta), ("peak_memory_mb", memory_min_delta)):
+            before, after = base[metric], stats[metric]
+            change = (after - before) / before if before else 0.0
+            regressed = change > threshold and after - before > floor
+            rows.append((name, metric, before, after, change, regressed))
+            if regressed:
+                regressions.append(f"{name} {metric}")
+    return rows, regressions
+
+
+def print_comparison(rows):
+    for name, metric, before, after, change, regressed in rows:
+        unit, scale = ("MB", 1) if metric == "peak_memory_mb" else ("ms", 1000)
+        print(f"{'REGRESSION' if regressed else '':<11}{name:<40} {metric:<15} "
+              f"{before * scale:>10.2f} -> {after * scale:>10.2f} {unit}  ({change:+.0%})")
+
+
+def _compare_files(current, baseline_path, threshold):
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    rows, regressions = compare_results(current, baseline, threshold=threshold)
+    print_comparison(rows)
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) against '{baseline_path}': {', '.join(regressions)}")
+        return 1
+    print(f"\nNo regressions against '{baseline_path}' (threshold {threshold:.0%}).")
+    return 0
+
+
+if __name__ == "__main__":
+    import argparse
+
+    arg_parser = argparse.ArgumentParser(description="Benchmark every stage of the audit pipeline.")
+    subparsers = arg_parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Run the benchmarks and write the results as JSON.")
+    run_parser.add_argument("--output", default="benchmark_results.json")
+    run_parser.add_argument("--corpus", help="Knowledge directory to use instead of a synthetic corpus.")
+    run_parser.add_argument("--corpus-reports", type=int, default=50, help="Reports in the synthetic corpus.")
+    run_parser.add_argument("--sizes", default=",".join(map(str, CONTRACT_SIZES)),
+                            help="Comma-separated function counts of the synthetic contracts (1-200).")
+    run_parser.add_argument("--repeats", type=int, default=5)
+    run_parser.add_argument("--embeddings", default="local", choices=["local", "openai"],
+                            help="Embeddings backend; 'openai' uses the synthetic provider.")
+    run_parser.add_argument("--latency", type=float, default=0.0, help="Mean synthetic model latency in seconds.")
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--baseline", help="Compare against this results file after the run.")
+    run_parser.add_argument("--threshold", type=float, default=0.2, help="Relative slowdown flagged as a regression.")
+
+    compare_parser = subparsers.add_parser("compare", help="Compare a results file against a baseline.")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("--threshold", type=float, default=0.2)
+    args = arg_parser.parse_args()
+
+    if args.command == "compare":
+        with open(args.current, "r", encoding="utf-8") as f:
+            sys.exit(_compare_files(json.load(f), args.baseline, args.threshold))
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    if not all(1 <= size <= 200 for size in sizes):
+        arg_parser.error("Contract sizes must be between 1 and 200 functions.")
+    use_synthetic_provider(args.latency)
+    logger.setLevel("WARNING")
+
+    with tempfile.TemporaryDirectory() as work_directory:
+        corpus_directory = args.corpus or generate_corpus(
+            os.path.join(work_directory, "knowledge_base"), n_reports=args.corpus_reports, seed=args.seed
+        )
+        print(f"Benchmarking with corpus '{corpus_directory}'...", file=sys.stderr)
+        stages = run_benchmarks(corpus_directory, work_directory, sizes=sizes, repeats=args.repeats,
+                                provider=args.embeddings)
+
+    results = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "corpus": args.corpus or f"synthetic ({args.corpus_reports} reports, seed {args.seed})",
+            "embeddings": args.embeddings,
+            "synthetic_latency": args.latency,
+            "repeats": args.repeats,
+        },
+        "stages": stages,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to '{args.output}'.", file=sys.stderr)
+    if args.baseline:
+        sys.exit(_compare_files(results, args.baseline, args.threshold))
@@ -0,0 +1,229 @@
+import hashlib
+import json
+import math
+import os
+import random
+import threading
+import time
+import httpx
+from src.logger_config import logger
+
+# Deterministic answers used in synthetic mode. Each one carries a valid code
+# suggestion so the ChatGPT fallback is only exercised by recorded traffic.
+SYNTHETIC_FINDINGS = [
+    ("Reentrancy", "High", "External call is made before the state update, so the callee can re-enter.",
+     "function withdraw(uint256 amount) external nonReentrant {\n    balances[msg.sender] -= amount;\n    (bool ok, ) = msg.sender.call{value: amount}(\"\");\n    require(ok, \"Transfer failed\");\n}"),
+    ("Authorization Through tx.origin", "High", "tx.origin can be spoofed by an intermediate contract.",
+     "modifier onlyOwner() {\n    require(msg.sender == owner, \"Not owner\");\n    _;\n}"),
+    ("Unchecked Call Return Value", "Medium", "The return value of the low-level call is ignored.",
+     "(bool success, ) = target.call(data);\nrequire(success, \"Call failed\");"),
+    ("Missing Access Control", "Medium", "Anyone can call a privileged function.",
+     "function setFee(uint256 newFee) external onlyOwner {\n    require(newFee <= MAX_FEE, \"Fee too high\");\n    fee = newFee;\n}"),
+]
+
+
+class CassetteMissError(httpx.TransportError):
+    """Raised in replay mode for a request that is not in the cassette."""
+
+
+def request_key(request):
+    """Identifies a request by method, endpoint and canonical JSON body."""
+    try:
+        body = json.dumps(json.loads(request.content or b"{}"), sort_keys=True)
+    except ValueError:
+        body = request.content.decode("utf-8", errors="replace")
+    endpoint = request.url.path.rsplit("/v1", 1)[-1]
+    return hashlib.sha256(f"{request.method} {endpoint} {body}".encode("utf-8")).hexdigest()
+
+
+def _seed(text):
+    return int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+
+
+def synthetic_completion_text(prompt):
+    """A deterministic, well-formed audit answer chosen by hashing the prompt."""
+    name, severity, description, code = SYNTHETIC_FINDINGS[_seed(prompt) % len(SYNTHETIC_FINDINGS)]
+    return (
+        f"### Vulnerability: {name}\n- **Severity:** {severity}\n- **Description:** {description}\n"
+        f"- **Recommendation:** Apply the suggested change.\n- **Suggested Code:**\n```solidity\n{code}\n```"
+    )
+
+
+def synthetic_embedding(text, size=1536):
+    """A deterministic unit vector derived from the text."""
+    rng = random.Random(_seed(text))
+    vector = [rng.gauss(0, 1) for _ in range(size)]
+    norm = sum(v * v for v in vector) ** 0.5 or 1.0
+    return [v / norm for v in vector]
+
+
+def _usage(prompt, completion=""):
+    prompt_tokens, completion_tokens = len(prompt) // 4, len(completion) // 4
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens}
+
+
+def synthetic_payload(endpoint, body, embedding_size=1536):
+    """
+    Builds an OpenAI-shaped JSON response for ``endpoint`` ("/completions",
+    "/chat/completions" or "/embeddings") from the request body.
+    """
+    created = 0
+    model = body.get("model")
+    if endpoint == "/embeddings":
+        inputs = body.get("input") if isinstance(body.get("input"), list) else [body.get("input")]
+        data = [{"object": "embedding", "index": i, "embedding": synthetic_embedding(str(item), embedding_size)}
+                for i, item in enumerate(inputs)]
+        return {"object": "list", "data": data, "model": model, "usage": _usage(json.dumps(inputs))}
+    if endpoint == "/chat/completions":
+        prompt = "".join(str(m.get("content", "")) for m in body.get("messages", []))
+        text = synthetic_completion_text(prompt)
+        return {"id": "chatcmpl-synthetic", "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                "usage": _usage(prompt, text)}
+    prompt = body.get("prompt") if isinstance(body.get("prompt"), str) else "".join(map(str, body.get("prompt") or []))
+    text = synthetic_completion_text(prompt)
+    return {"id": "cmpl-synthetic", "object": "text_completion", "created": created, "model": model,
+            "choices": [{"text": text, "index": 0, "logprobs": None, "finish_reason": "stop"}],
+            "usage": _usage(prompt, text)}
+
+
+def as_event_stream(endpoint, payload):
+    """Re-encodes a completion payload as the server-sent events of a streamed response."""
+    choice = payload["choices"][0]
+    text = choice["message"]["content"] if endpoint == "/chat/completions" else choice["text"]
+    events = []
+    for word in text.split(" "):
+        token = word if not events else " " + word
+        delta = {"index": 0, "delta": {"content": token}} if endpoint == "/chat/completions" else {"index": 0, "text": token}
+        events.append({**{k: payload[k] for k in ("id", "created", "model")},
+                       "object": payload["object"] + (".chunk" if endpoint == "/chat/completions" else ""),
+                       "choices": [{**delta, "finish_reason": None, "logprobs": None}]})
+    lines = [f"data: {json.dumps(event)}\n\n" for event in events] + ["data: [DONE]\n\n"]
+    return "".join(lines).encode("utf-8")
+
+
+class CassetteTransport(httpx.BaseTransport):
+    """
+    httpx transport that records, replays or synthesizes OpenAI exchanges.
+
+    Modes:
+        "record":    forwards to ``inner`` and appends each exchange to the cassette file.
+        "replay":    answers from the cassette; an unrecorded request raises an error.
+        "synthetic": answers with deterministic OpenAI-shaped payloads after ``latency`` seconds.
+                     With ``latency_sigma`` the delay is lognormal around that median
+                     (the long-tailed shape of real LLM latency); embedding calls take
+                     a fifth of the completion latency.
+
+    Cassettes are JSON lines keyed by ``request_key``, so concurrent audits can be
+    replayed in any order.
+    """
+
+    def __init__(self, mode, path=None, inner=None, latency=0.0, embedding_size=1536, latency_sigma=0.0):
+        if mode not in ("record", "replay", "synthetic"):
+            raise ValueError(f"Unknown cassette mode '{mode}'. Use record, replay or synthetic.")
+        if mode != "synthetic" and not path:
+            raise ValueError(f"A cassette path is required in {mode} mode.")
+        self.mode = mode
+        self.path = path
+        self.inner = inner or (httpx.HTTPTransport() if mode == "record" else None)
+        self.latency = latency
+        self.latency_sigma = latency_sigma
+        self.embedding_size = embedding_size
+        self.lock = threading.Lock()
+        self.exchanges = {}
+        self.calls = 0
+        self.misses = 0
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        exchange = json.loads(line)
+                        self.exchanges[exchange["key"]] = exchange
+            logger.info(f"Loaded {len(self.exchanges)} exchange(s) from cassette '{path}'.")
+
+    def handle_request(self, request):
+        key = request_key(request)
+        endpoint = request.url.path.rsplit("/v1", 1)[-1]
+        with self.lock:
+            self.calls += 1
+
+        if self.mode == "record":
+            response = self.inner.handle_request(request)
+            content = response.read()
+            exchange = {
+                "key": key, "endpoint": endpoint, "status": response.status_code,
+                "content_type": response.headers.get("content-type", "application/json"),
+                "body": content.decode("utf-8"),
+            }
+            # Only successful exchanges are kept, so replays never reproduce transient errors
+            if response.status_code < 400:
+                with self.lock:
+                    self.exchanges[key] = exchange
+                    with open(self.path, "a", encoding="utf-8") as f:
+                        f.write(json.dumps(exchange) + "\n")
+            return httpx.Response(response.status_code, headers={"content-type": exchange["content_type"]},
+                                  content=content, request=request)
+
+        if self.mode == "replay":
+            exchange = self.exchanges.get(key)
+            if exchange is None:
+                with self.lock:
+                    self.misses += 1
+                raise CassetteMissError(f"No recorded exchange for {endpoint} in cassette '{self.path}'.", request=request)
+            return httpx.Response(exchange["status"], headers={"content-type": exchange["content_type"]},
+                                  content=exchange["body"].encode("utf-8"), request=request)
+
+        # Synthetic: the latency is jittered but seeded by the request, so runs are reproducible
+        if self.latency:
+            rng = random.Random(key)
+            latency = self.latency / 5 if endpoint == "/embeddings" else self.latency
+            if self.latency_sigma:
+                time.sleep(rng.lognormvariate(math.log(latency), self.latency_sigma))
+            else:
+                time.sleep(rng.uniform(0.5, 1.5) * latency)
+        body = json.loads(request.content or b"{}")
+        payload = synthetic_payload(endpoint, body, self.embedding_size)
+        if body.get("stream"):
+            return httpx.Response(200, headers={"content-type": "text/event-stream"},
+                                  content=as_event_stream(endpoint, payload), request=request)
+        return httpx.Response(200, json=payload, request=request)
+
+    def close(self):
+        if self.inner is not None:
+            self.inner.close()
+
+
+if __name__ == "__main__":
+    # Runs a full audit offline and separates pipeline time from (simulated) provider time.
+    import argparse
+    from langchain_community.vectorstores import FAISS
+    from src.openai_client import get_transport
+
+    arg_parser = argparse.ArgumentParser(description="Run a reproducible offline audit through the provider shim.")
+    arg_parser.add_argument("path", help="Solidity file to audit.")
+    arg_parser.add_argument("--index-path", default="faiss_index")
+    args = arg_parser.parse_args()
+
+    from src.embeddings import get_index_embeddings
+    from src.lexical_index import BM25Index
+    from src.logic import analyze_code_with_ai, build_qa_chain, get_openai_api_key
+    from src.openai_client import create_llm
+
+    with open(args.path, "r", encoding="utf-8") as f:
+        code = f.read()
+    vector_store = FAISS.load_local(args.index_path, get_index_embeddings(args.index_path),
+                                    allow_dangerous_deserialization=True)
+    qa_chain = build_qa_chain(vector_store, create_llm(get_openai_api_key()), lexical_index=BM25Index.load(args.index_path),
+                              index_path=args.index_path)
+
+    start_time = time.perf_counter()
+    report = analyze_code_with_ai(qa_chain, code)
+    total_time = time.perf_counter() - start_time
+
+    stats = get_transport().stats.snapshot()
+    provider_time = sum(endpoint["latency_total"] for endpoint in stats.values())
+    print(report)
+    print(f"Total audit time: {total_time:.3f}s, provider time: {provider_time:.3f}s, "
+          f"pipeline overhead: {total_time - provider_time:.3f}s")
+    print(f"Report SHA-256: {hashlib.sha256(report.encode('utf-8')).hexdigest()}")
@@ -0,0 +1,257 @@
+import os
+import re
+import time
+import zlib
+import numpy as np
+from dotenv import load_dotenv
+from langchain_core.embeddings import Embeddings
+from src.logger_config import logger
+
+# Load environment variables from the .env file
+load_dotenv()
+
+# Selects the embeddings backend an index is built with: "openai" or "local". Loading
+# uses the backend recorded with the index, and fails if this is set to another one.
+CONFIGURED_PROVIDER = os.getenv("EMBEDDINGS_PROVIDER")
+EMBEDDINGS_PROVIDER = CONFIGURED_PROVIDER or "openai"
+
+# File written next to the FAISS index holding the fitted state of the local backend
+LOCAL_STATE_FILE = "local_embeddings.npz"
+# File written next to the FAISS index naming the backend that built it
+PROVIDER_FILE = "embeddings_provider.txt"
+
+# Identifiers such as tx.origin, SWC-107 or abi.encodePacked are kept as single tokens
+TOKEN_PATTERN = re.compile(r"[a-z_][a-z0-9_]*(?:[.\-][a-z0-9_]+)*|\d+")
+
+# Odd 64-bit multipliers used to derive independent bucket/sign hashes from one feature id
+_MIXERS = np.array(
+    [0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9, 0xD6E8FEB86659FD93],
+    dtype=np.uint64,
+)
+
+
+class HashedTfidfEmbeddings(Embeddings):
+    """
+    Local, network-free embeddings: hashed TF-IDF features reduced to a dense
+    vector by a sparse random projection.
+
+    Tokens are hashed into ``n_features`` buckets, weighted by sublinear term
+    frequency and inverse document frequency, and each feature is added with a
+    random sign to ``n_projections`` of the ``size`` output dimensions. Vectors
+    are L2-normalized, so FAISS L2 ranking matches cosine similarity.
+    """
+
+    def __init__(self, size=512, n_features=2 ** 20, n_projections=4):
+        self.size = size
+        self.n_features = n_features
+        self.n_projections = n_projections
+        # Unfitted IDF is uniform, which reduces to plain hashed TF
+        self.idf = np.ones(n_features, dtype=np.float32)
+
+    def _tokenize(self, text):
+        """Returns the hashed feature ids of a text's unigrams and bigrams."""
+        tokens = TOKEN_PATTERN.findall(text.lower())
+        features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+        # crc32 is cheap, so features are hashed every time instead of memoised in a cache
+        # that would grow with every text a long-running process embeds
+        hashes = np.fromiter((zlib.crc32(feature.encode("utf-8")) for feature in features),
+                             dtype=np.int64, count=len(features))
+        return hashes % self.n_features
+
+    def fit(self, texts):
+        """
+        Computes the IDF weights from a corpus (normally the index chunks).
+
+        Returns:
+            HashedTfidfEmbeddings: self, for chaining.
+        """
+        document_frequency = np.zeros(self.n_features, dtype=np.float64)
+        for text in texts:
+            document_frequency[np.unique(self._tokenize(text))] += 1
+        self.idf = np.log((1 + len(texts)) / (1 + document_frequency)).astype(np.float32) + 1
+        logger.info(f"Fitted local embeddings IDF on {len(texts)} documents.")
+        return self
+
+    def save(self, index_path):
+        """Saves the fitted state next to the FAISS index at ``index_path``."""
+        os.makedirs(index_path, exist_ok=True)
+        np.savez_compressed(
+            os.path.join(index_path, LOCAL_STATE_FILE),
+            idf=self.idf,
+            params=np.array([self.size, self.n_features, self.n_projections]),
+        )
+
+    @classmethod
+    def load(cls, index_path):
+        """Loads the state saved by ``save``; an unfitted instance is returned if there is none."""
+        state_path = os.path.join(index_path, LOCAL_STATE_FILE)
+        if not os.path.exists(state_path):
+            logger.warning(f"No local embeddings state found at '{state_path}'. Using unfitted embeddings.")
+            return cls()
+        with np.load(state_path) as state:
+            size, n_features, n_projections = (int(v) for v in state["params"])
+            embeddings = cls(size=size, n_features=n_features, n_projections=n_projections)
+            embeddings.idf = state["idf"]
+        return embeddings
+
+    def embed_batch(self, texts):
+        """
+        Embeds a batch of texts in one vectorized pass.
+
+        Returns:
+            np.ndarray: A float32 matrix of shape (len(texts), size).
+        """
+        token_ids = [self._tokenize(text) for text in texts]
+        doc_ids = np.repeat(np.arange(len(texts)), [len(ids) for ids in token_ids])
+        if not len(doc_ids):
+            return np.zeros((len(texts), self.size), dtype=np.float32)
+        feature_ids = np.concatenate(token_ids)
+
+        # Term frequency per (document, feature) pair
+        pairs, counts = np.unique(doc_ids * self.n_features + feature_ids, return_counts=True)
+        pair_docs = pairs // self.n_features
+        pair_features = pairs % self.n_features
+        weights = (1 + np.log(counts)) * self.idf[pair_features]
+
+        # Sparse random projection: each feature lands in n_projections signed buckets
+        hashes = pair_features.astype(np.uint64)[:, None] * _MIXERS[None, :self.n_projections]
+        buckets = ((hashes >> np.uint64(33)) % np.uint64(self.size)).astype(np.int64)
+        signs = np.where((hashes >> np.uint64(63)) == 1, -1.0, 1.0)
+        flat_index = (pair_docs[:, None] * self.size + buckets).ravel()
+        vectors = np.bincount(
+            flat_index, weights=(signs * weights[:, None]).ravel(), minlength=len(texts) * self.size
+        ).reshape(len(texts), self.size)
+
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return (vectors / np.where(norms == 0, 1, norms)).astype(np.float32)
+
+    def embed_documents(self, texts):
+        return self.embed_batch(texts).tolist()
+
+    def embed_query(self, text):
+        return self.embed_batch([text])[0].tolist()
+
+
+def get_embeddings(provider=None, index_path="faiss_index"):
+    """
+    Returns the embeddings backend selected by ``provider`` or ``EMBEDDINGS_PROVIDER``.
+
+    Args:
+        provider (str, optional): "openai" or "local". Defaults to the configured provider.
+        index_path (str): Where the local backend's fitted state is loaded from.
+    """
+    provider = (provider or EMBEDDINGS_PROVIDER).lower()
+    if provider == "local":
+        return HashedTfidfEmbeddings.load(index_path)
+    if provider == "openai":
+        from src.openai_client import create_embeddings
+
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            logger.error("OPENAI_API_KEY not found in .env file or environment variables.")
+            raise ValueError("OPENAI_API_KEY not found.")
+        return create_embeddings(api_key)
+    raise ValueError(f"Unknown embeddings provider '{provider}'. Use 'openai' or 'local'.")
+
+
+def save_index_provider(index_path, provider=None):
+    """Records the backend an index was built with next to the FAISS index."""
+    with open(os.path.join(index_path, PROVIDER_FILE), "w", encoding="utf-8") as f:
+        f.write((provider or EMBEDDINGS_PROVIDER).lower())
+
+
+def get_index_provider(index_path):
+    """
+    Returns the backend the index at ``index_path`` was built with.
+
+    Indexes built before the backend was recorded are "local" if they have the
+    local backend's fitted state and "openai" otherwise.
+    """
+    path = os.path.join(index_path, PROVIDER_FILE)
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read().strip()
+    return "local" if os.path.exists(os.path.join(index_path, LOCAL_STATE_FILE)) else "openai"
+
+
+def get_index_embeddings(index_path="faiss_index", provider=None):
+    """
+    Returns the embeddings backend that queries the index at ``index_path``.
+
+    Vectors of different backends have different sizes and are not comparable, so
+    the backend recorded with the index is used. Asking for another one, through
+    ``provider`` or ``EMBEDDINGS_PROVIDER``, raises instead of failing inside FAISS.
+    """
+    index_provider = get_index_provider(index_path)
+    requested = (provider or CONFIGURED_PROVIDER or index_provider).lower()
+    if requested != index_provider:
+        raise ValueError(f"The index at '{index_path}' was built with '{index_provider}' embeddings but '{requested}' "
+                         f"was requested. Rebuild the index or set EMBEDDINGS_PROVIDER={index_provider}.")
+    return get_embeddings(index_provider, index_path)
+
+
+# Representative auditor queries used to compare the backends
+SAMPLE_QUERIES = [
+    "reentrancy attack on withdraw function",
+    "tx.origin used for authorization",
+    "unchecked return value of low-level call",
+    "integer overflow and underflow",
+    "unprotected selfdestruct",
+    "front-running and transaction order dependence",
+    "oracle price manipulation with flash loans",
+    "denial of service with unbounded loop",
+    "delegatecall to untrusted contract",
+    "signature replay with ecrecover",
+    "timestamp dependence block.timestamp",
+    "missing access control on initializer",
+    "ERC4626 vault share inflation attack",
+    "rounding error in fee calculation",
+    "SWC-107",
+]
+
+
+def _timed_search(vector_store, queries, k):
+    results, latencies = [], []
+    for query in queries:
+        start_time = time.perf_counter()
+        docs = vector_store.similarity_search(query, k=k)
+        latencies.append(time.perf_counter() - start_time)
+        results.append({(doc.metadata.get("source"), doc.page_content) for doc in docs})
+    return results, latencies
+
+
+if __name__ == "__main__":
+    # Reports retrieval latency of the local backend on the shipped knowledge base and,
+    # when an OpenAI key is available, its recall@k against OpenAI embeddings.
+    from langchain_community.vectorstores import FAISS
+    from src.knowledge_loader import load_knowledge_from_directory
+    from src.rag_core import split_into_chunks
+
+    k = 5
+    chunks = split_into_chunks(load_knowledge_from_directory() or [])
+    texts = [chunk.page_content for chunk in chunks]
+
+    local_embeddings = HashedTfidfEmbeddings()
+    start_time = time.perf_counter()
+    local_embeddings.fit(texts)
+    local_store = FAISS.from_documents(chunks, local_embeddings)
+    print(f"\nLocal index build: {len(chunks)} chunks in {time.perf_counter() - start_time:.2f}s")
+
+    local_results, local_latencies = _timed_search(local_store, SAMPLE_QUERIES, k)
+    print(f"Local retrieval latency: p50 {np.percentile(local_latencies, 50) * 1000:.2f} ms, "
+          f"p95 {np.percentile(local_latencies, 95) * 1000:.2f} ms")
+
+    if not os.getenv("OPENAI_API_KEY"):
+        print("OPENAI_API_KEY not set; skipping the comparison with OpenAI embeddings.")
+    else:
+        start_time = time.perf_counter()
+        openai_store = FAISS.from_documents(chunks, get_embeddings("openai"))
+        print(f"OpenAI index build: {time.perf_counter() - start_time:.2f}s")
+        openai_results, openai_latencies = _timed_search(openai_store, SAMPLE_QUERIES, k)
+        print(f"OpenAI retrieval latency: p50 {np.percentile(openai_latencies, 50) * 1000:.2f} ms, "
+              f"p95 {np.percentile(openai_latencies, 95) * 1000:.2f} ms")
+
+        recalls = [len(local & reference) / max(len(reference), 1) for local, reference in zip(local_results, openai_results)]
+        for query, recall in zip(SAMPLE_QUERIES, recalls):
+            print(f"  recall@{k} {recall:.2f}  {query}")
+        print(f"Mean recall@{k} of local vs. OpenAI embeddings: {np.mean(recalls):.2f}")
@@ -0,0 +1,339 @@
+import json
+import os
+import re
+import threading
+import time
+import zlib
+import numpy as np
+from src.logger_config import logger
+from src.tracing import record, traced
+
+# Where the audit reports live and where the fingerprint index is saved
+REPORTS_DIRECTORY = os.path.join("knowledge_base", "downloaded_md_files")
+FINGERPRINT_INDEX_FILE = "fingerprints.npz"
+
+SEVERITIES = {"C": "Critical", "H": "High", "M": "Medium", "L": "Low", "I": "Informational"}
+
+FINDING_HEADER = re.compile(r"^#\s*\[([A-Z])-(\d+)\]\s*(.+?)\s*$", re.MULTILINE)
+RECOMMENDATION_HEADER = re.compile(r"^#+\s*Recommendation", re.MULTILINE | re.IGNORECASE)
+SOLIDITY_BLOCK = re.compile(r"```(?:solidity|sol)\s*\n(.*?)```", re.DOTALL | re.IGNORECASE)
+# Reports quote code with "490:"-style line numbers and "..." for elided lines
+LINE_NUMBER = re.compile(r"^[ \t]*\d+:[ \t]?", re.MULTILINE)
+ELIDED_LINE = re.compile(r"^[ \t]*\.\.\.[ \t]*(?:\n|$)", re.MULTILINE)
+
+COMMENT = re.compile(r"//[^\n]*|/\*.*?\*/", re.DOTALL)
+SOLIDITY_TOKEN = re.compile(
+    r"\"(?:\\.|[^\"\\])*\"|'(?:\\.|[^'\\])*'"        # string literals
+    r"|0x[0-9a-fA-F]+|\d[\d_]*(?:\.\d+)?(?:e\d+)?"     # numbers
+    r"|[A-Za-z_$][A-Za-z0-9_$]*"                       # identifiers and keywords
+    r"|==|!=|<=|>=|&&|\|\||\+\+|--|\+=|-=|\*=|/=|<<|>>|=>|\*\*"
+    r"|[^\s\w]"
+)
+ELEMENTARY_TYPE = re.compile(r"^(?:u?int\d*|bytes\d*|address|bool|string|fixed|ufixed)$")
+
+# Keywords and security-relevant builtins are kept verbatim; every other identifier
+# becomes "ID" so renamed variables and functions still match.
+KEPT_IDENTIFIERS = {
+    "function", "modifier", "returns", "return", "if", "else", "for", "while", "do", "break", "continue",
+    "public", "external", "internal", "private", "view", "pure", "payable", "virtual", "override",
+    "memory", "storage", "calldata", "mapping", "struct", "enum", "event", "emit", "new", "delete",
+    "unchecked", "assembly", "require", "assert", "revert", "try", "catch", "true", "false",
+    "msg", "sender", "value", "data", "sig", "tx", "origin", "gasprice", "block", "timestamp", "number",
+    "chainid", "basefee", "coinbase", "prevrandao", "difficulty", "blockhash", "gasleft", "this", "super",
+    "call", "delegatecall", "staticcall", "transfer", "transferFrom", "send", "approve", "balanceOf",
+    "totalSupply", "safeTransfer", "safeTransferFrom", "selfdestruct", "ecrecover", "keccak256",
+    "sha256", "abi", "encode", "encodePacked", "encodeWithSelector", "decode", "length", "push", "pop",
+    "balance", "code", "codehash", "type", "max", "min",
+}
+
+# Shingle length (in normalized tokens) and winnowing window
+SHINGLE_SIZE = 8
+WINNOW_WINDOW = 4
+# Snippets shorter than this many normalized tokens are too generic to fingerprint
+MIN_SNIPPET_TOKENS = 20
+# Fingerprints shared by more snippets than this are boilerplate and are dropped
+MAX_SNIPPETS_PER_FINGERPRINT = 15
+
+_TOKEN_IDS = {}
+
+# Loaded fingerprint indexes by index path, with the modification time they were loaded at
+_LOADED_INDEXES = {}
+_LOADED_INDEXES_LOCK = threading.Lock()
+# Index paths already reported as missing, so an audit without an index does not warn every time
+_MISSING_INDEXES = set()
+
+
+def normalize_tokens(code):
+    """
+    Lexes Solidity into a renaming-insensitive token stream: comments are removed,
+    literals become STR/NUM, and identifiers other than keywords, types and
+    security-relevant builtins become ID.
+    """
+    tokens = []
+    for token in SOLIDITY_TOKEN.findall(COMMENT.sub(" ", code)):
+        if token[0] in "\"'":
+            tokens.append("STR")
+        elif token[0].isdigit():
+            tokens.append("NUM")
+        elif token[0].isalpha() or token[0] in "_$":
+            tokens.append(token if token in KEPT_IDENTIFIERS or ELEMENTARY_TYPE.match(token) else "ID")
+        else:
+            tokens.append(token)
+    return tokens
+
+
+def fingerprint(code):
+    """
+    Returns the winnowed shingle hashes of a code snippet.
+
+    Every run of SHINGLE_SIZE normalized tokens is hashed with a polynomial hash,
+    and the minimum hash of each WINNOW_WINDOW consecutive shingles is kept.
+
+    Returns:
+        np.ndarray: The unique uint64 fingerprints (empty for very short code).
+    """
+    tokens = normalize_tokens(code)
+    if len(tokens) < SHINGLE_SIZE:
+        return np.zeros(0, dtype=np.uint64)
+    token_ids = np.fromiter(
+        (_TOKEN_IDS.setdefault(t, zlib.crc32(t.encode("utf-8"))) for t in tokens), dtype=np.uint64, count=len(tokens)
+    )
+    # Polynomial hash of every shingle at once; uint64 arithmetic wraps modulo 2**64
+    powers = np.uint64(1099511628211) ** np.arange(SHINGLE_SIZE - 1, -1, -1, dtype=np.uint64)
+    windows = np.lib.stride_tricks.sliding_window_view(token_ids, SHINGLE_SIZE)
+    shingles = (windows * powers).sum(axis=1, dtype=np.uint64)
+    if len(shingles) <= WINNOW_WINDOW:
+        return np.unique(shingles)
+    return np.unique(np.lib.stride_tricks.sliding_window_view(shingles, WINNOW_WINDOW).min(axis=1))
+
+
+def strip_report_markup(code):
+    """Removes the line numbers and elision lines a report adds to quoted code."""
+    return ELIDED_LINE.sub("", LINE_NUMBER.sub("", code))
+
+
+def extract_vulnerable_snippets(directory=REPORTS_DIRECTORY):
+    """
+    Extracts the Solidity snippets quoted in each finding of the audit reports.
+
+    Only code before a finding's "Recommendations" heading is taken, since the code
+    after it is the suggested fix rather than the vulnerable code. Line numbers and
+    "..." lines are stripped so the snippets fingerprint like submitted code.
+
+    Returns:
+        list of dicts: report, finding ("M-01"), title, severity and code of each snippet.
+    """
+    snippets = []
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith(".md"):
+            continue
+        with open(os.path.join(directory, filename), "r", encoding="utf-8") as f:
+            content = f.read()
+        headers = list(FINDING_HEADER.finditer(content))
+        for header, next_header in zip(headers, headers[1:] + [None]):
+            section = content[header.end():next_header.start() if next_header else len(content)]
+            recommendation = RECOMMENDATION_HEADER.search(section)
+            if recommendation:
+                section = section[:recommendation.start()]
+            for block in SOLIDITY_BLOCK.finditer(section):
+                snippets.append({
+                    "report": filename,
+                    "finding": f"{header.group(1)}-{header.group(2)}",
+                    "title": header.group(3),
+                    "severity": SEVERITIES.get(header.group(1), "Unknown"),
+                    "code": strip_report_markup(block.group(1)),
+                })
+    return snippets
+
+
+class FingerprintIndex:
+    """
+    Lookup index from code fingerprints to known-vulnerable report snippets.
+
+    ``keys`` is the sorted array of fingerprints and ``snippet_ids`` the snippet
+    each one came from; ``sizes`` holds each snippet's fingerprint count.
+    """
+
+    def __init__(self, keys, snippet_ids, sizes, snippets):
+        self.keys = keys
+        self.snippet_ids = snippet_ids
+        self.sizes = sizes
+        self.snippets = snippets
+
+    @classmethod
+    def build(cls, snippets):
+        """Fingerprints the snippets and drops fingerprints that are common boilerplate."""
+        kept, keys, snippet_ids = [], [], []
+        for snippet in snippets:
+            if len(normalize_tokens(snippet["code"])) < MIN_SNIPPET_TOKENS:
+                continue
+            hashes = fingerprint(snippet["code"])
+            keys.append(hashes)
+            snippet_ids.append(np.full(len(hashes), len(kept), dtype=np.int32))
+            kept.append({key: snippet[key] for key in ("report", "finding", "title", "severity")})
+        keys = np.concatenate(keys) if keys else np.zeros(0, dtype=np.uint64)
+        snippet_ids = np.concatenate(snippet_ids) if snippet_ids else np.zeros(0, dtype=np.int32)
+
+        unique_keys, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+        common = counts[inverse] > MAX_SNIPPETS_PER_FINGERPRINT
+        keys, snippet_ids = keys[~common], snippet_ids[~common]
+        order = np.argsort(keys, kind="stable")
+        keys, snippet_ids = keys[order], snippet_ids[order]
+        sizes = np.bincount(snippet_ids, minlength=len(kept)).astype(np.int32)
+        logger.info(f"Built fingerprint index: {len(kept)} snippets, {len(keys)} fingerprints "
+                    f"({int(common.sum())} boilerplate fingerprints dropped).")
+        return cls(keys, snippet_ids, sizes, kept)
+
+    def save(self, index_path):
+        """
+        Saves the index next to the FAISS index at ``index_path``.
+
+        The fingerprints and the snippet metadata go into one file that is replaced
+        atomically, so a running process reloading it always reads a matching pair.
+        """
+        os.makedirs(index_path, exist_ok=True)
+        index_file = os.path.join(index_path, FINGERPRINT_INDEX_FILE)
+        with open(index_file + ".tmp", "wb") as f:
+            np.savez_compressed(f, keys=self.keys, snippet_ids=self.snippet_ids, sizes=self.sizes,
+                                snippets=np.array(json.dumps(self.snippets)))
+        os.replace(index_file + ".tmp", index_file)
+
+    @classmethod
+    def load(cls, index_path):
+        """Loads the index saved by ``save``, or returns None if there is none."""
+        path = os.path.join(index_path, FINGERPRINT_INDEX_FILE)
+        if not os.path.exists(path):
+            logger.warning(f"No fingerprint index found at '{path}'. Known-pattern matching is disabled.")
+            return None
+        with np.load(path) as data:
+            if "snippets" not in data:
+                raise ValueError(f"The fingerprint index at '{path}' has no snippets; rebuild it.")
+            return cls(data["keys"], data["snippet_ids"], data["sizes"], json.loads(str(data["snippets"])))
+
+    def match(self, code, min_containment=0.5, min_matches=3, limit=3):
+        """
+        Finds report snippets whose fingerprints are contained in ``code``.
+
+        Returns:
+            list of dicts: The snippet metadata plus "similarity" (the share of the
+                           snippet's fingerprints found in the code), best first.
+        """
+        query = fingerprint(code)
+        if not len(query) or not len(self.keys):
+            return []
+        start = np.searchsorted(self.keys, query, side="left")
+        end = np.searchsorted(self.keys, query, side="right")
+        hits = np.concatenate([self.snippet_ids[s:e] for s, e in zip(start, end) if e > s] or [np.zeros(0, dtype=np.int32)])
+        if not len(hits):
+            return []
+        counts = np.bincount(hits, minlength=len(self.sizes))
+        candidates = np.flatnonzero(counts >= min_matches)
+        similarity = counts[candidates] / self.sizes[candidates]
+        order = np.argsort(-similarity)
+        return [
+            {**self.snippets[candidates[i]], "similarity": float(similarity[i])}
+            for i in order[:limit] if similarity[i] >= min_containment
+        ]
+
+
+def get_fingerprint_index(index_path="faiss_index"):
+    """
+    Returns the fingerprint index saved at ``index_path``, or None if it was never built.
+
+    A loaded index is reused until its file changes, so an index built or rebuilt
+    after startup (e.g. by ``extracting_reports.py``) is picked up by a running app
+    or service. A missing index is not remembered. Reuses and loads are recorded
+    as fingerprint cache hits and misses.
+    """
+    path = os.path.join(index_path, FINGERPRINT_INDEX_FILE)
+    try:
+        modified = os.stat(path).st_mtime_ns
+    except OSError:
+        with _LOADED_INDEXES_LOCK:
+            _LOADED_INDEXES.pop(index_path, None)
+            reported = index_path in _MISSING_INDEXES
+            _MISSING_INDEXES.add(index_path)
+        if not reported:
+            logger.warning(f"No fingerprint index found at '{path}'. Known-pattern matching is disabled.")
+        return None
+    with _LOADED_INDEXES_LOCK:
+        _MISSING_INDEXES.discard(index_path)
+        loaded = _LOADED_INDEXES.get(index_path)
+    if loaded is not None and loaded[0] == modified:
+        record(fingerprint_cache_hits=1)
+        return loaded[1]
+    record(fingerprint_cache_misses=1)
+    index = FingerprintIndex.load(index_path)
+    if index is not None:
+        with _LOADED_INDEXES_LOCK:
+            _LOADED_INDEXES[index_path] = (modified, index)
+    return index
+
+
+def clear_fingerprint_cache(index_path=None):
+    """Forgets the loaded index of ``index_path`` (or of every path)."""
+    with _LOADED_INDEXES_LOCK:
+        if index_path is None:
+            _LOADED_INDEXES.clear()
+        else:
+            _LOADED_INDEXES.pop(index_path, None)
+
+
+@traced("fingerprint.match")
+def find_known_vulnerabilities(functions, index_path="faiss_index"):
+    """
+    Matches each parsed function against the known-vulnerable snippet index.
+
+    Matching is a best-effort shortcut, so an unreadable index is logged and
+    yields no findings instead of failing the audit.
+
+    Returns:
+        list of Markdown strings: One instant finding per match, citing the report.
+    """
+    start_time = time.perf_counter()
+    findings = []
+    try:
+        index = get_fingerprint_index(index_path)
+        if index is None:
+            return []
+        for func in functions:
+            for match in index.match(func.get("body") or func["code"]):
+                findings.append(
+                    f"⚡ **Known Pattern Match:** `{func['name']}` resembles **[{match['finding']}] {match['title']}** "
+                    f"({match['severity']}) from `{match['report']}` — {match['similarity']:.0%} of the reported snippet matched."
+                )
+    except Exception as e:
+        logger.error(f"Known-pattern matching failed for index '{index_path}': {e}", exc_info=True)
+        return []
+    record(known_patterns=len(findings))
+    logger.info(f"Fingerprint matching found {len(findings)} known pattern(s) in {(time.perf_counter() - start_time) * 1000:.1f} ms.")
+    return findings
+
+
+def format_known_patterns(functions, index_path="faiss_index"):
+    """
+    Matches the functions against the known-vulnerable fingerprint index.
+
+    Returns:
+        str: A Markdown section with the instant findings, or "" if nothing matched.
+    """
+    findings = find_known_vulnerabilities(functions, index_path)
+    if not findings:
+        return ""
+    return "## ⚡ Known Vulnerable Patterns\n\n" + "\n\n".join(findings) + "\n\n---\n\n"
+
+
+def build_fingerprint_index(directory=REPORTS_DIRECTORY, index_path="faiss_index"):
+    """Extracts the report snippets, fingerprints them and saves the index."""
+    snippets = extract_vulnerable_snippets(directory)
+    logger.info(f"Extracted {len(snippets)} vulnerable snippets from '{directory}'.")
+    index = FingerprintIndex.build(snippets)
+    index.save(index_path)
+    clear_fingerprint_cache(index_path)
+    logger.info(f"Fingerprint index saved to '{index_path}'.")
+    return index
+
+
+if __name__ == "__main__":
+    # Builds the fingerprint index on its own (it is also built by 'python -m src.rag_core').
+    build_fingerprint_index()
@@ -0,0 +1,395 @@
+import argparse
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from src.parser import parse_solidity_code
+from src.fingerprints import format_known_patterns
+from src.logger_config import logger
+from src.tracing import Span, finish_span, use_span
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    code TEXT NOT NULL,
+    total_functions INTEGER NOT NULL,
+    known_patterns TEXT NOT NULL DEFAULT '',
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS job_functions (
+    job_id TEXT NOT NULL REFERENCES jobs(id),
+    func_index INTEGER NOT NULL,
+    func_name TEXT NOT NULL,
+    code TEXT NOT NULL,
+    status TEXT NOT NULL,
+    result TEXT,
+    claimed_by TEXT,
+    claimed_at REAL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (job_id, func_index)
+);
+CREATE INDEX IF NOT EXISTS idx_job_functions_status ON job_functions(status);
+"""
+
+# Job and function task states
+PENDING = "pending"
+RUNNING = "running"
+COMPLETED = "completed"
+
+# Seconds a claimed task stays leased to its worker without a heartbeat; an expired
+# lease (a crashed or killed worker) returns the task to the queue
+LEASE_TIMEOUT = 60.0
+
+
+class JobStore:
+    """
+    Persistent SQLite store for audit jobs.
+
+    Each job is split into one task per parsed function. Tasks are claimed and
+    completed individually, so partial results survive a crash and a restarted
+    worker pool resumes from the last completed function.
+
+    A claimed task is leased to its worker, which renews the lease while it works.
+    Tasks whose lease has expired are claimable again, so several worker pools
+    (e.g. the Streamlit app and ``python -m src.jobs worker``) can share one store
+    without requeueing each other's in-flight functions.
+    """
+
+    def __init__(self, db_path="audit_jobs.db", lease_timeout=LEASE_TIMEOUT):
+        self.db_path = db_path
+        self.lease_timeout = lease_timeout
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            # Stores created by earlier versions lack the newer columns
+            for table, column, column_type in (("job_functions", "claimed_by", "TEXT"),
+                                               ("job_functions", "claimed_at", "REAL"),
+                                               ("jobs", "known_patterns", "TEXT NOT NULL DEFAULT ''")):
+                columns = {row["name"] for row in conn.execute(f"PRAGMA table_info({table})")}
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+
+    @contextmanager
+    def _connect(self):
+        # One short-lived connection per operation keeps the store safe to share between threads
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def submit(self, code, index_path="faiss_index"):
+        """
+        Parses the code and records a new job with one pending task per function.
+
+        The functions are matched against the known-vulnerable fingerprint index at
+        ``index_path`` right away, so those findings head the job report before any
+        function has been analyzed.
+
+        Returns:
+            str: The new job id.
+        """
+        functions = parse_solidity_code(code)
+        known_patterns = format_known_patterns(functions, index_path)
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                """INSERT INTO jobs (id, status, code, total_functions, known_patterns, created_at, updated_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                (job_id, PENDING, code, len(functions), known_patterns, now, now),
+            )
+            conn.executemany(
+                "INSERT INTO job_functions (job_id, func_index, func_name, code, status, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                [(job_id, i, func["name"], func["code"], PENDING, now) for i, func in enumerate(functions)],
+            )
+            conn.execute("COMMIT")
+        logger.info(f"Submitted audit job {job_id} with {len(functions)} function(s).")
+        return job_id
+
+    def claim_next(self, worker_id):
+        """
+        Atomically leases the oldest pending function task, or a running one whose
+        lease has expired, to ``worker_id``.
+
+        Returns:
+            dict or None: The claimed task (job_id, func_index, name, code), or None if the queue is empty.
+        """
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            row = conn.execute(
+                """SELECT f.job_id, f.func_index, f.func_name, f.code, f.status, f.claimed_by FROM job_functions f
+                   JOIN jobs j ON j.id = f.job_id
+                   WHERE f.status = ? OR (f.status = ? AND (f.claimed_at IS NULL OR f.claimed_at < ?))
+                   ORDER BY j.created_at, f.func_index LIMIT 1""",
+                (PENDING, RUNNING, now - self.lease_timeout),
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                """UPDATE job_functions SET status = ?, claimed_by = ?, claimed_at = ?, updated_at = ?
+                   WHERE job_id = ? AND func_index = ?""",
+                (RUNNING, worker_id, now, now, row["job_id"], row["func_index"]),
+            )
+            conn.execute("UPDATE jobs SET status = ?, updated_at = ? WHERE id = ?", (RUNNING, now, row["job_id"]))
+            conn.execute("COMMIT")
+        if row["status"] == RUNNING:
+            logger.warning(f"Job {row['job_id']}: reclaimed function {row['func_index'] + 1} "
+                           f"after the lease of {row['claimed_by']} expired.")
+        return {"job_id": row["job_id"], "func_index": row["func_index"], "name": row["func_name"], "code": row["code"]}
+
+    def renew_leases(self, worker_id, tasks):
+        """Extends the leases ``worker_id`` holds on ``tasks`` ((job_id, func_index) pairs)."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                "UPDATE job_functions SET claimed_at = ? WHERE job_id = ? AND func_index = ? AND claimed_by = ? AND status = ?",
+                [(now, job_id, func_index, worker_id, RUNNING) for job_id, func_index in tasks],
+            )
+
+    def complete(self, job_id, func_index, result, worker_id):
+        """
+        Stores a function's result and marks the job completed once every function is done.
+
+        The result is only stored while ``worker_id`` still holds the task's lease; a
+        worker whose lease expired and was reclaimed by another one is ignored.
+
+        Returns:
+            bool: True if this was the job's last function.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            updated = conn.execute(
+                """UPDATE job_functions SET status = ?, result = ?, updated_at = ?
+                   WHERE job_id = ? AND func_index = ? AND claimed_by = ? AND status = ?""",
+                (COMPLETED, result, now, job_id, func_index, worker_id, RUNNING),
+            ).rowcount
+            if not updated:
+                conn.execute("COMMIT")
+                logger.warning(f"Job {job_id}: dropped the result of function {func_index + 1} from {worker_id}, "
+                               f"whose lease was taken over.")
+                return False
+            remaining = conn.execute(
+                "SELECT COUNT(*) FROM job_functions WHERE job_id = ? AND status != ?", (job_id, COMPLETED)
+            ).fetchone()[0]
+            status = COMPLETED if remaining == 0 else RUNNING
+            conn.execute("UPDATE jobs SET status = ?, updated_at = ? WHERE id = ?", (status, now, job_id))
+            conn.execute("COMMIT")
+        if remaining == 0:
+            logger.info(f"Audit job {job_id} completed.")
+        return remaining == 0
+
+    def get_results(self, job_id):
+        """Returns the Markdown sections of the job's completed functions, in function order."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT result FROM job_functions WHERE job_id = ? AND status = ? ORDER BY func_index",
+                (job_id, COMPLETED),
+            ).fetchall()
+        return [row["result"] for row in rows]
+
+    def get_job(self, job_id):
+        """
+        Returns the job's status, progress and the results completed so far.
+
+        Returns:
+            dict or None: None if the job does not exist.
+        """
+        with self._connect() as conn:
+            job = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if job is None:
+                return None
+            functions = conn.execute(
+                "SELECT func_index, func_name, status, result FROM job_functions WHERE job_id = ? ORDER BY func_index",
+                (job_id,),
+            ).fetchall()
+        results = [row["result"] for row in functions if row["status"] == COMPLETED]
+        return {
+            "id": job["id"],
+            "status": job["status"],
+            "total_functions": job["total_functions"],
+            "completed_functions": len(results),
+            "functions": [{"name": row["func_name"], "status": row["status"]} for row in functions],
+            "known_patterns": job["known_patterns"],
+            "report": job["known_patterns"] + "".join(results),
+            "created_at": job["created_at"],
+            "updated_at": job["updated_at"],
+        }
+
+
+class WorkerPool:
+    """
+    A pool of threads that drain function tasks from a JobStore.
+
+    Workers pull tasks across all jobs, so both many small audits and one large
+    audit are spread over every worker. A heartbeat thread renews the leases of
+    the tasks in progress; tasks of a crashed pool are picked up once their
+    leases expire.
+
+    The function spans of a job are grouped under one "audit" span per pool, tagged
+    with the job id and finished when the job completes.
+    """
+
+    def __init__(self, store, qa_chain, workers=2, poll_interval=0.5):
+        self.store = store
+        self.qa_chain = qa_chain
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._stop = threading.Event()
+        self._threads = []
+        self._active = set()
+        self._job_spans = {}
+        self._active_lock = threading.Lock()
+
+    def start(self):
+        """Starts the worker threads and the lease heartbeat."""
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"audit-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        heartbeat = threading.Thread(target=self._heartbeat, name="audit-heartbeat", daemon=True)
+        heartbeat.start()
+        self._threads.append(heartbeat)
+        logger.info(f"Started audit worker pool {self.worker_id} with {self.workers} worker(s).")
+        return self
+
+    def stop(self, timeout=None):
+        """Signals the workers to stop after their current task and waits for them."""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        for job_id in list(self._job_spans):
+            self._finish_job_span(job_id)
+
+    def _run(self):
+        # Imported here so the store can be used without loading the LangChain stack
+        from src.logic import analyze_function
+
+        while not self._stop.is_set():
+            try:
+                task = self.store.claim_next(self.worker_id)
+            except sqlite3.Error as e:
+                logger.error(f"Failed to claim an audit task: {e}", exc_info=True)
+                task = None
+            if task is None:
+                self._stop.wait(self.poll_interval)
+                continue
+
+            key = (task["job_id"], task["func_index"])
+            with self._active_lock:
+                self._active.add(key)
+                job_span = self._job_spans.get(task["job_id"])
+                if job_span is None:
+                    job_span = Span("audit", attributes={"mode": "job", "job_id": task["job_id"]})
+                    self._job_spans[task["job_id"]] = job_span
+            try:
+                logger.info(f"Job {task['job_id']}: analyzing function {task['func_index'] + 1}: {task['name']}")
+                with use_span(job_span):
+                    result = analyze_function(self.qa_chain, task)
+                if self.store.complete(task["job_id"], task["func_index"], result, self.worker_id):
+                    self._finish_job_span(task["job_id"])
+            except sqlite3.Error as e:
+                # The lease is no longer renewed, so the task is retried once it expires
+                logger.error(f"Failed to store the result of job {task['job_id']} function {task['func_index'] + 1}: {e}",
+                             exc_info=True)
+            finally:
+                with self._active_lock:
+                    self._active.discard(key)
+
+    def _finish_job_span(self, job_id):
+        with self._active_lock:
+            job_span = self._job_spans.pop(job_id, None)
+        if job_span is not None:
+            finish_span(job_span)
+
+    def _heartbeat(self):
+        while not self._stop.wait(self.store.lease_timeout / 3):
+            with self._active_lock:
+                tasks = list(self._active)
+                idle_jobs = set(self._job_spans) - {job_id for job_id, _ in tasks}
+            try:
+                if tasks:
+                    self.store.renew_leases(self.worker_id, tasks)
+                # Jobs whose last function was completed by another pool
+                for job_id in idle_jobs:
+                    job = self.store.get_job(job_id)
+                    if job is None or job["status"] == COMPLETED:
+                        self._finish_job_span(job_id)
+            except sqlite3.Error as e:
+                logger.error(f"Failed to renew audit task leases: {e}", exc_info=True)
+
+
+def watch_job(store, job_id, poll_interval=1.0):
+    """Prints the known-pattern findings, then each function's result as it completes until the job is finished."""
+    job = store.get_job(job_id)
+    if job is None:
+        print(f"Error: job '{job_id}' not found.", file=sys.stderr)
+        return
+    if job["known_patterns"]:
+        print(job["known_patterns"], flush=True)
+    printed = 0
+    while True:
+        results = store.get_results(job_id)
+        for result in results[printed:]:
+            print(result, flush=True)
+        printed = len(results)
+        if job["status"] == COMPLETED:
+            print(f"Job {job_id} completed ({job['completed_functions']}/{job['total_functions']} functions).")
+            return
+        time.sleep(poll_interval)
+        job = store.get_job(job_id)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Background audit jobs.")
+    arg_parser.add_argument("--db", default="audit_jobs.db", help="Path to the SQLite job store.")
+    arg_parser.add_argument("--index-path", default="faiss_index", help="Index used for matching and analysis.")
+    commands = arg_parser.add_subparsers(dest="command", required=True)
+    submit_cmd = commands.add_parser("submit", help="Submit a Solidity file as an audit job.")
+    submit_cmd.add_argument("path")
+    status_cmd = commands.add_parser("status", help="Show a job's progress.")
+    status_cmd.add_argument("job_id")
+    watch_cmd = commands.add_parser("watch", help="Print results as functions complete.")
+    watch_cmd.add_argument("job_id")
+    worker_cmd = commands.add_parser("worker", help="Run a worker pool until interrupted.")
+    worker_cmd.add_argument("--workers", type=int, default=2)
+    args = arg_parser.parse_args()
+
+    job_store = JobStore(args.db)
+    if args.command == "submit":
+        with open(args.path, "r", encoding="utf-8") as f:
+            print(job_store.submit(f.read(), index_path=args.index_path))
+    elif args.command == "status":
+        job = job_store.get_job(args.job_id)
+        if job is None:
+            sys.exit(f"Error: job '{args.job_id}' not found.")
+        print(f"Job {job['id']}: {job['status']} ({job['completed_functions']}/{job['total_functions']} functions)")
+        for func in job["functions"]:
+            print(f"  - {func['name']}: {func['status']}")
+    elif args.command == "watch":
+        watch_job(job_store, args.job_id)
+    elif args.command == "worker":
+        from src.logic import initialize_qa_chain
+
+        qa_chain = initialize_qa_chain(args.index_path)
+        if qa_chain is None:
+            sys.exit("Error: the QA chain could not be initialized. See auditor.log for details.")
+        pool = WorkerPool(job_store, qa_chain, workers=args.workers).start()
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            print("Stopping workers after their current function...")
+            pool.stop()
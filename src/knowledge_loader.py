@@ -1,5 +1,7 @@
 import os
+from src.tracing import record, traced
 
+@traced("knowledge.load")
 def load_knowledge_from_directory(directory_path="knowledge_base"):
     """
     Loads all text-based documents (.txt, .md) from a specified directory
@@ -42,6 +44,7 @@ def load_knowledge_from_directory(directory_path="knowledge_base"):
                     print(f"  -> Error loading {filename}: {e}")
     
     print(f"\nFinished loading. Found {len(knowledge_base)} documents.")
+    record(documents=len(knowledge_base))
     return knowledge_base
 
 if __name__ == "__main__":
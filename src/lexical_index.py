@@ -0,0 +1,342 @@
+import os
+import time
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+from pydantic import ConfigDict
+from src.embeddings import TOKEN_PATTERN
+from src.logger_config import logger
+from src.tracing import span
+
+# File written next to the FAISS index holding the BM25 postings
+LEXICAL_INDEX_FILE = "bm25_index.npz"
+
+# Constant of Reciprocal Rank Fusion; 60 is the usual value from the RRF paper
+RRF_K = 60
+
+# Terms that, on their own, make a query worth answering lexically
+SECURITY_IDENTIFIERS = {
+    "tx.origin", "msg.sender", "msg.value", "delegatecall", "selfdestruct", "suicide", "ecrecover",
+    "unchecked", "call.value", "block.timestamp", "block.number", "blockhash", "extcodesize",
+    "abi.encodepacked", "transferfrom", "safetransfer", "approve", "permit", "assembly", "create2",
+    "staticcall", "onlyowner", "initializer", "nonreentrant", "receive", "fallback",
+}
+
+
+def tokenize(text):
+    """Splits text into lowercase terms, keeping identifiers like tx.origin or SWC-107 whole."""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def is_identifier_query(query, max_terms=12):
+    """
+    Returns True for short queries made mostly of code identifiers or SWC ids,
+    which BM25 answers well without an embedding call.
+    """
+    terms = tokenize(query)
+    if not terms or len(terms) > max_terms:
+        return False
+    identifiers = [
+        term for term in terms
+        if term in SECURITY_IDENTIFIERS or "." in term or "_" in term or term.startswith("swc-")
+    ]
+    return len(identifiers) * 2 >= len(terms)
+
+
+class BM25Index:
+    """
+    Okapi BM25 inverted index over the same chunks as the FAISS index.
+
+    Postings are stored in CSR form: the postings of term ``t`` are
+    ``doc_ids[offsets[t]:offsets[t + 1]]`` with matching ``term_freqs``. Document
+    ids are chunk positions, which match the FAISS ``index_to_docstore_id`` order.
+    """
+
+    def __init__(self, terms, offsets, doc_ids, term_freqs, doc_lengths, k1=1.5, b=0.75):
+        self.terms = terms
+        self.term_ids = {term: i for i, term in enumerate(terms)}
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.term_freqs = term_freqs
+        self.doc_lengths = doc_lengths
+        self.k1 = k1
+        self.b = b
+        n_docs = len(doc_lengths)
+        document_frequency = np.diff(offsets)
+        self.idf = np.log(1 + (n_docs - document_frequency + 0.5) / (document_frequency + 0.5)).astype(np.float32)
+        # Per-document length normalization is query independent, so it is computed once
+        self.length_norm = (k1 * (1 - b + b * doc_lengths / max(doc_lengths.mean(), 1))).astype(np.float32)
+
+    @classmethod
+    def build(cls, texts):
+        """Builds the index from chunk texts, in the same order as the FAISS index."""
+        vocabulary = {}
+        term_ids, doc_ids = [], []
+        doc_lengths = np.zeros(len(texts), dtype=np.int32)
+        for doc_id, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_lengths[doc_id] = len(tokens)
+            term_ids.append(np.fromiter((vocabulary.setdefault(t, len(vocabulary)) for t in tokens), dtype=np.int64, count=len(tokens)))
+            doc_ids.append(np.full(len(tokens), doc_id, dtype=np.int64))
+        term_ids = np.concatenate(term_ids) if term_ids else np.zeros(0, dtype=np.int64)
+        doc_ids = np.concatenate(doc_ids) if doc_ids else np.zeros(0, dtype=np.int64)
+
+        # Sorting the (term, doc) pairs yields the postings lists already grouped by term
+        pairs, counts = np.unique(term_ids * max(len(texts), 1) + doc_ids, return_counts=True)
+        pair_terms = pairs // max(len(texts), 1)
+        offsets = np.searchsorted(pair_terms, np.arange(len(vocabulary) + 1)).astype(np.int64)
+
+        terms = np.array(sorted(vocabulary, key=vocabulary.get))
+        logger.info(f"Built BM25 index with {len(terms)} terms and {len(pairs)} postings over {len(texts)} chunks.")
+        return cls(
+            terms,
+            offsets,
+            (pairs % max(len(texts), 1)).astype(np.int32),
+            np.minimum(counts, np.iinfo(np.uint16).max).astype(np.uint16),
+            doc_lengths,
+        )
+
+    def save(self, index_path):
+        """Saves the index next to the FAISS index at ``index_path``."""
+        os.makedirs(index_path, exist_ok=True)
+        np.savez_compressed(
+            os.path.join(index_path, LEXICAL_INDEX_FILE),
+            terms=self.terms,
+            offsets=self.offsets,
+            doc_ids=self.doc_ids,
+            term_freqs=self.term_freqs,
+            doc_lengths=self.doc_lengths,
+        )
+
+    @classmethod
+    def load(cls, index_path):
+        """Loads the index saved by ``save``, or returns None if the index has none."""
+        path = os.path.join(index_path, LEXICAL_INDEX_FILE)
+        if not os.path.exists(path):
+            logger.warning(f"No BM25 index found at '{path}'. Falling back to vector-only retrieval.")
+            return None
+        with np.load(path) as data:
+            return cls(data["terms"], data["offsets"], data["doc_ids"], data["term_freqs"], data["doc_lengths"])
+
+    def search(self, query, k=5):
+        """
+        Scores every chunk containing a query term.
+
+        Returns:
+            list of tuples: (doc_id, score) for the top ``k`` chunks, best first.
+        """
+        query_terms = {self.term_ids[t] for t in tokenize(query) if t in self.term_ids}
+        if not query_terms:
+            return []
+        slices = [slice(self.offsets[t], self.offsets[t + 1]) for t in query_terms]
+        doc_ids = np.concatenate([self.doc_ids[s] for s in slices])
+        term_freqs = np.concatenate([self.term_freqs[s] for s in slices]).astype(np.float32)
+        idf = np.concatenate([np.full(s.stop - s.start, self.idf[t], dtype=np.float32) for s, t in zip(slices, query_terms)])
+
+        contributions = idf * term_freqs * (self.k1 + 1) / (term_freqs + self.length_norm[doc_ids])
+        scores = np.bincount(doc_ids, weights=contributions, minlength=len(self.doc_lengths))
+        candidates = np.flatnonzero(scores)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k)[:k]]
+        best = candidates[np.argsort(-scores[candidates])]
+        return [(int(doc_id), float(scores[doc_id])) for doc_id in best]
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Retriever that fuses FAISS and BM25 results with Reciprocal Rank Fusion.
+
+    Modes:
+        "hybrid":  vector and lexical results fused with RRF.
+        "vector":  FAISS only (the previous behaviour).
+        "lexical": BM25 only, no embedding call.
+        "auto":    "lexical" for identifier-heavy queries, "hybrid" otherwise.
+    Without a lexical index every mode falls back to "vector".
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    vector_store: object
+    lexical_index: object = None
+    k: int = 5
+    fetch_k: int = 20
+    mode: str = "auto"
+
+    def resolve_mode(self, query, mode=None):
+        """Returns the concrete mode ("vector", "lexical" or "hybrid") used for ``query``."""
+        mode = mode or self.mode
+        if self.lexical_index is None:
+            return "vector"
+        if mode == "auto":
+            return "lexical" if is_identifier_query(query) else "hybrid"
+        return mode
+
+    def _document(self, doc_id):
+        docstore_id = self.vector_store.index_to_docstore_id[doc_id]
+        return self.vector_store.docstore.search(docstore_id)
+
+    def search(self, query, k=None, mode=None):
+        """Returns the top ``k`` documents for ``query`` using ``mode`` (defaults to the retriever's)."""
+        k = k or self.k
+        mode = self.resolve_mode(query, mode)
+        with span("retrieval.search", mode=mode):
+            if mode == "vector":
+                return self.vector_store.similarity_search(query, k=k)
+            if mode == "lexical":
+                return [self._document(doc_id) for doc_id, _ in self.lexical_index.search(query, k)]
+
+            return [self._document(doc_id) for doc_id in self._fuse(self._vector_search([query])[0], query, k)]
+
+    def batch_search(self, queries, k=None, mode=None):
+        """
+        Retrieves documents for many queries with one embedding call and one FAISS search.
+
+        Identical queries are searched once; queries answered lexically are not embedded.
+
+        Returns:
+            list: One list of documents per query, in the order of ``queries``.
+        """
+        with span("retrieval.batch", queries=len(queries)):
+            return self._batch_search(queries, k or self.k, mode)
+
+    def _batch_search(self, queries, k, mode):
+        unique_queries = list(dict.fromkeys(queries))
+        modes = {query: self.resolve_mode(query, mode) for query in unique_queries}
+        embedded_queries = [query for query in unique_queries if modes[query] != "lexical"]
+        vector_results = dict(zip(embedded_queries, self._vector_search(embedded_queries, max(k, self.fetch_k))))
+        logger.info(f"Batched retrieval: {len(queries)} queries, {len(unique_queries)} unique, {len(embedded_queries)} embedded.")
+
+        documents = {}
+        for query in unique_queries:
+            if modes[query] == "vector":
+                doc_ids = [doc_id for doc_id, _ in vector_results[query][:k]]
+            elif modes[query] == "lexical":
+                doc_ids = [doc_id for doc_id, _ in self.lexical_index.search(query, k)]
+            else:
+                doc_ids = self._fuse(vector_results[query], query, k)
+            documents[query] = [self._document(doc_id) for doc_id in doc_ids]
+        return [documents[query] for query in queries]
+
+    def _fuse(self, vector_results, query, k):
+        """Reciprocal Rank Fusion of vector and BM25 rankings over the shared chunk positions."""
+        fused = {}
+        for results in (vector_results[:self.fetch_k], self.lexical_index.search(query, self.fetch_k)):
+            for rank, (doc_id, _) in enumerate(results):
+                fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (RRF_K + rank + 1)
+        return sorted(fused, key=fused.get, reverse=True)[:k]
+
+    def _vector_search(self, queries, k=None):
+        """
+        Embeds all queries in one batched call and searches FAISS with the whole query
+        matrix, so results come back as chunk positions.
+        """
+        if not queries:
+            return []
+        with span("retrieval.embed", queries=len(queries)):
+            matrix = np.asarray(self.vector_store.embeddings.embed_documents(queries), dtype=np.float32)
+        with span("retrieval.vector_search"):
+            distances, positions = self.vector_store.index.search(matrix, k or self.fetch_k)
+        return [
+            [(int(p), float(d)) for p, d in zip(row_positions, row_distances) if p != -1]
+            for row_positions, row_distances in zip(positions, distances)
+        ]
+
+    def _get_relevant_documents(self, query, *, run_manager: CallbackManagerForRetrieverRun):
+        return self.search(query)
+
+
+# Identifier-heavy and conceptual queries used by the benchmark
+BENCHMARK_QUERIES = [
+    "tx.origin", "delegatecall", "selfdestruct", "SWC-107", "ecrecover", "unchecked",
+    "abi.encodePacked collision", "block.timestamp", "extcodesize", "msg.value in loop",
+    "reentrancy attack on withdraw function", "oracle price manipulation",
+    "denial of service with unbounded loop", "front-running of approve",
+]
+
+
+if __name__ == "__main__":
+    # Compares latency and hit quality of vector, lexical and hybrid retrieval on the
+    # shipped knowledge base. A hit is a top-k chunk containing every query identifier.
+    import argparse
+    from langchain_community.vectorstores import FAISS
+    from src.embeddings import HashedTfidfEmbeddings, get_embeddings
+    from src.knowledge_loader import load_knowledge_from_directory
+    from src.rag_core import split_into_chunks
+
+    arg_parser = argparse.ArgumentParser(description="Benchmark hybrid retrieval against the vector retriever.")
+    arg_parser.add_argument("--provider", default=None, help="Embeddings backend for the vector side (openai or local).")
+    arg_parser.add_argument("-k", type=int, default=5)
+    arg_parser.add_argument("--audit-functions", type=int, default=20, help="Functions in the simulated audit.")
+    args = arg_parser.parse_args()
+
+    chunks = split_into_chunks(load_knowledge_from_directory() or [])
+    texts = [chunk.page_content for chunk in chunks]
+    embeddings = get_embeddings(args.provider)
+    if isinstance(embeddings, HashedTfidfEmbeddings):
+        embeddings.fit(texts)
+
+    class CountingEmbeddings(Embeddings):
+        """Counts embedding calls and embedded texts made through the wrapped backend."""
+
+        def __init__(self, inner):
+            self.inner = inner
+            self.calls = 0
+            self.texts = 0
+
+        def embed_documents(self, texts):
+            self.calls += 1
+            self.texts += len(texts)
+            return self.inner.embed_documents(texts)
+
+        def embed_query(self, text):
+            self.calls += 1
+            self.texts += 1
+            return self.inner.embed_query(text)
+
+    start_time = time.perf_counter()
+    lexical_index = BM25Index.build(texts)
+    print(f"\nBM25 build: {time.perf_counter() - start_time:.2f}s, "
+          f"{lexical_index.doc_ids.nbytes + lexical_index.term_freqs.nbytes + lexical_index.offsets.nbytes} bytes of postings")
+    counting_embeddings = CountingEmbeddings(embeddings)
+    vector_store = FAISS.from_documents(chunks, counting_embeddings)
+    retriever = HybridRetriever(vector_store=vector_store, lexical_index=lexical_index, k=args.k)
+
+    print(f"{'mode':<8} {'p50 ms':>8} {'p95 ms':>8} {'hit@' + str(args.k):>7}")
+    for mode in ("vector", "lexical", "hybrid", "auto"):
+        latencies, hits = [], []
+        for query in BENCHMARK_QUERIES:
+            start_time = time.perf_counter()
+            docs = retriever.search(query, mode=mode)
+            latencies.append(time.perf_counter() - start_time)
+            required = [t for t in tokenize(query) if t in SECURITY_IDENTIFIERS or "." in t or t.startswith("swc-")] or tokenize(query)[:1]
+            hits.append(any(all(t in tokenize(doc.page_content) for t in required) for doc in docs))
+        print(f"{mode:<8} {np.percentile(latencies, 50) * 1000:>8.2f} {np.percentile(latencies, 95) * 1000:>8.2f} {np.mean(hits):>7.2f}")
+
+    # Per-audit retrieval: one query per function, as built by analyze_code_with_ai. The
+    # parser sends the full contract for every function, so the queries are identical;
+    # the "distinct" row simulates per-function snippets instead.
+    from src.logic import build_analysis_query
+
+    contract = "contract Audit {\n" + "\n".join(
+        f"    function f{i}(uint256 a) external {{ balances[msg.sender] -= a; }}" for i in range(args.audit_functions)
+    ) + "\n}"
+    audits = {
+        "identical": [build_analysis_query({"name": f"f{i}", "code": contract}) for i in range(args.audit_functions)],
+        "distinct": [
+            build_analysis_query({"name": f"f{i}", "code": f"function f{i}(uint256 a) external {{ balances[msg.sender] -= a; }}"})
+            for i in range(args.audit_functions)
+        ],
+    }
+    print(f"\nPer-audit retrieval ({args.audit_functions} functions, mode=hybrid)")
+    print(f"{'queries':<10} {'strategy':<10} {'embed calls':>11} {'texts':>6} {'time ms':>8}")
+    for name, queries in audits.items():
+        for strategy in ("per-query", "batched"):
+            counting_embeddings.calls = counting_embeddings.texts = 0
+            start_time = time.perf_counter()
+            if strategy == "per-query":
+                results = [retriever.search(query, mode="hybrid") for query in queries]
+            else:
+                results = retriever.batch_search(queries, mode="hybrid")
+            elapsed = (time.perf_counter() - start_time) * 1000
+            print(f"{name:<10} {strategy:<10} {counting_embeddings.calls:>11} {counting_embeddings.texts:>6} {elapsed:>8.2f}")
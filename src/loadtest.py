@@ -0,0 +1,276 @@
+import argparse
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from langchain_community.vectorstores import FAISS
+import src.openai_client as openai_client
+from src.benchmark import generate_contract, generate_corpus, use_synthetic_provider
+from src.embeddings import SAMPLE_QUERIES, get_index_embeddings
+from src.lexical_index import BM25Index
+from src.logger_config import logger
+from src.logic import analyze_code_with_ai, build_qa_chain, run_heuristic_checks, stream_analysis_with_ai
+from src.rag_core import build_and_save_vector_store
+from src.knowledge_loader import load_knowledge_from_directory
+from src.tracing import span
+
+# Realistic defaults for the stubbed model: median completion latency and lognormal spread
+DEFAULT_LATENCY = 0.8
+DEFAULT_SIGMA = 0.6
+CONTRACT_SIZES = (1, 10, 50)
+
+
+def build_workload(n_requests, question_share=0.3, sizes=CONTRACT_SIZES, seed=0):
+    """
+    Returns a deterministic mix of ``n_requests`` submissions as (kind, text) pairs:
+    security questions and synthetic contracts of the given function counts.
+    """
+    rng = random.Random(seed)
+    workload = []
+    for i in range(n_requests):
+        if rng.random() < question_share:
+            workload.append(("question", f"What is {rng.choice(SAMPLE_QUERIES)} and how can I prevent it?"))
+        else:
+            size = rng.choice(sizes)
+            workload.append((f"contract[n={size}]", generate_contract(size, seed=seed * 1000 + i)))
+    return workload
+
+
+def rss_mb():
+    """Current resident set size of the process in MB."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError):
+        # No procfs: fall back to the peak RSS (KB on Linux, bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2 ** 20 if sys.platform == "darwin" else peak / 1024
+
+
+class MemorySampler:
+    """Samples the process RSS in the background to report start, peak and end memory."""
+
+    def __init__(self, interval=0.2):
+        self.interval = interval
+        self.samples = []
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self.stopped.is_set():
+            self.samples.append(rss_mb())
+            self.stopped.wait(self.interval)
+
+    def __enter__(self):
+        self.samples.append(rss_mb())
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+        self.samples.append(rss_mb())
+
+    def summary(self):
+        return {"start_mb": self.samples[0], "peak_mb": max(self.samples), "end_mb": self.samples[-1],
+                "growth_mb": self.samples[-1] - self.samples[0]}
+
+
+def app_target(qa_chain):
+    """What one Streamlit submission runs: the heuristic scan, then the streamed analysis drained to the end."""
+    def submit(text):
+        run_heuristic_checks(text)
+        for _ in stream_analysis_with_ai(qa_chain, text):
+            pass
+    return submit
+
+
+def analyze_target(qa_chain):
+    """The batch entry point used by the service and the job workers."""
+    return lambda text: analyze_code_with_ai(qa_chain, text)
+
+
+def http_target(base_url):
+    """POSTs each submission to a running analysis service (``python -m src.service``)."""
+    import requests
+
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=64)
+    session.mount("http://", adapter)
+
+    def submit(text):
+        session.post(f"{base_url.rstrip('/')}/analyze", json={"code": text}, timeout=600).raise_for_status()
+    return submit
+
+
+def run_load(submit, workload, concurrency, rate=None, seed=0):
+    """
+    Replays ``workload`` with ``concurrency`` workers.
+
+    Without ``rate`` the run is closed-loop: each worker submits its next request as
+    soon as the previous one finishes. With ``rate`` (requests/second) arrivals follow
+    a Poisson process, and requests wait for a free worker; that wait is the
+    queueing delay.
+
+    Returns:
+        list of dicts: kind, queue delay, service latency, in-process provider wait
+                       and error (if any) of every request.
+    """
+    results = []
+    lock = threading.Lock()
+
+    def execute(kind, text, arrival):
+        started = time.perf_counter()
+        error = None
+        with span("loadtest.request", kind=kind) as request_span:
+            try:
+                submit(text)
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+        finished = time.perf_counter()
+        with lock:
+            results.append({
+                "kind": kind, "queue_delay": started - arrival, "latency": finished - started,
+                "provider_wait": request_span.counters.get("provider_wait_seconds", 0.0), "error": error,
+            })
+
+    if rate is None:
+        items = iter(workload)
+
+        def worker():
+            while True:
+                with lock:
+                    item = next(items, None)
+                if item is None:
+                    return
+                execute(*item, time.perf_counter())
+
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    rng = random.Random(seed)
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        arrival = time.perf_counter()
+        for kind, text in workload:
+            arrival += rng.expovariate(rate)
+            time.sleep(max(0.0, arrival - time.perf_counter()))
+            pool.submit(execute, kind, text, arrival)
+    return results
+
+
+def _percentiles(values):
+    values = np.asarray(values) if len(values) else np.zeros(1)
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"mean": float(values.mean()), "p50": float(p50), "p95": float(p95), "p99": float(p99)}
+
+
+def summarize(results, elapsed, memory):
+    """Throughput, latency and queueing percentiles (seconds), errors and memory of one run."""
+    ok = [r for r in results if r["error"] is None]
+    summary = {
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        "elapsed": elapsed,
+        "throughput_rps": len(ok) / elapsed if elapsed else 0.0,
+        "latency": _percentiles([r["latency"] for r in ok]),
+        "response_time": _percentiles([r["queue_delay"] + r["latency"] for r in ok]),
+        "queue_delay": _percentiles([r["queue_delay"] for r in results]),
+        "provider_wait": _percentiles([r["provider_wait"] for r in results]),
+        "memory": memory,
+        "by_kind": {},
+    }
+    for kind in sorted({r["kind"] for r in ok}):
+        summary["by_kind"][kind] = _percentiles([r["latency"] for r in ok if r["kind"] == kind])
+    return summary
+
+
+def load_chain(index_path=None, work_directory=None):
+    """Loads the shared chain from ``index_path``, or builds a synthetic index in ``work_directory``."""
+    if index_path is None:
+        corpus_directory = generate_corpus(os.path.join(work_directory, "knowledge_base"))
+        index_path = os.path.join(work_directory, "faiss_index")
+        build_and_save_vector_store(load_knowledge_from_directory(corpus_directory), index_path=index_path, provider="local")
+        embeddings = get_index_embeddings(index_path, "local")
+    else:
+        embeddings = get_index_embeddings(index_path)
+    vector_store = FAISS.load_local(index_path, embeddings, allow_dangerous_deserialization=True)
+    llm = openai_client.create_llm(os.environ["OPENAI_API_KEY"])
+    return build_qa_chain(vector_store, llm, lexical_index=BM25Index.load(index_path), index_path=index_path)
+
+
+def print_summary(concurrency, summary):
+    print(f"{concurrency:>5} {summary['throughput_rps']:>8.2f} "
+          f"{summary['response_time']['p50']:>8.2f} {summary['response_time']['p95']:>8.2f} {summary['response_time']['p99']:>8.2f} "
+          f"{summary['queue_delay']['p95']:>8.2f} {summary['provider_wait']['p95']:>8.2f} "
+          f"{summary['memory']['peak_mb']:>8.0f} {summary['memory']['growth_mb']:>+8.1f} {summary['errors']:>6}")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Load-test the analysis entry points with stubbed model backends.")
+    arg_parser.add_argument("--target", default="app", choices=["app", "analyze", "http"],
+                            help="app: heuristics + streamed analysis per submission; analyze: analyze_code_with_ai; "
+                                 "http: POST /analyze on --url.")
+    arg_parser.add_argument("--url", default="http://127.0.0.1:8080", help="Service URL for the http target.")
+    arg_parser.add_argument("--concurrency", default="1,2,4,8",
+                            help="Comma-separated numbers of concurrent users to sweep.")
+    arg_parser.add_argument("--requests", type=int, default=40, help="Requests per concurrency level (at least 2 per user).")
+    arg_parser.add_argument("--rate", type=float, help="Open-loop arrival rate in requests/s (default: closed loop).")
+    arg_parser.add_argument("--question-share", type=float, default=0.3)
+    arg_parser.add_argument("--sizes", default=",".join(map(str, CONTRACT_SIZES)), help="Contract sizes in functions.")
+    arg_parser.add_argument("--latency", type=float, default=DEFAULT_LATENCY, help="Median stub completion latency (s).")
+    arg_parser.add_argument("--sigma", type=float, default=DEFAULT_SIGMA, help="Lognormal spread of the stub latency.")
+    arg_parser.add_argument("--index-path", help="Existing index to load (default: a synthetic one).")
+    arg_parser.add_argument("--slo", type=float, help="p95 response time (s) a concurrency level must meet.")
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("--output", help="Write the per-level summaries as JSON.")
+    args = arg_parser.parse_args()
+
+    use_synthetic_provider(args.latency, args.sigma)
+    logger.setLevel("WARNING")
+    levels = [int(level) for level in args.concurrency.split(",")]
+    sizes = [int(size) for size in args.sizes.split(",")]
+
+    with tempfile.TemporaryDirectory() as work_directory:
+        if args.target == "http":
+            submit = http_target(args.url)
+        else:
+            print("Preparing the shared chain...", file=sys.stderr)
+            qa_chain = load_chain(args.index_path, work_directory)
+            submit = (app_target if args.target == "app" else analyze_target)(qa_chain)
+        # One warm-up request so imports and lazy initialization are not measured
+        submit(generate_contract(1))
+
+        print(f"\n{'users':>5} {'req/s':>8} {'p50 s':>8} {'p95 s':>8} {'p99 s':>8} {'queue95':>8} {'wait95':>8} "
+              f"{'peak MB':>8} {'growth':>8} {'errors':>6}")
+        summaries = {}
+        for concurrency in levels:
+            workload = build_workload(max(args.requests, concurrency * 2), args.question_share, sizes, args.seed)
+            with MemorySampler() as memory:
+                start_time = time.perf_counter()
+                results = run_load(submit, workload, concurrency, rate=args.rate, seed=args.seed)
+                elapsed = time.perf_counter() - start_time
+            summaries[concurrency] = summarize(results, elapsed, memory.summary())
+            print_summary(concurrency, summaries[concurrency])
+
+    print("\nresponse time = queueing delay + service latency; queue95 = p95 wait for a free worker "
+          "(open loop only); wait95 = p95 time a request spent behind the OpenAI client's rate limits.")
+    if args.slo is not None:
+        sustained = [c for c, s in summaries.items() if s["response_time"]["p95"] <= args.slo and not s["errors"]]
+        if sustained:
+            print(f"One process sustains {max(sustained)} concurrent user(s) within a p95 of {args.slo:.1f}s.")
+        else:
+            print(f"No tested concurrency level met a p95 of {args.slo:.1f}s.")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "levels": summaries}, f, indent=2)
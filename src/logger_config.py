@@ -1,9 +1,64 @@
+import atexit
+import json
 import logging
+import os
+import queue
 import sys
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# Log file rotation and level, configurable per deployment
+LOG_FILE = os.getenv("LOG_FILE", "auditor.log")
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats records as one JSON object per line. Tracing spans attached with
+    ``extra={"span": ...}`` are included as structured fields.
+    """
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        span = getattr(record, "span", None)
+        if span is not None:
+            entry["span"] = span
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class _StructuredQueueHandler(QueueHandler):
+    """
+    QueueHandler that keeps the exception on the queued record, so the JSON file
+    gets it as its own field rather than appended to the message.
+    """
+
+    def prepare(self, record):
+        record.message = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg, record.args, record.exc_info = record.message, None, None
+        return record
+
 
 def setup_logger():
     """
     Sets up a centralized logger for the application.
+
+    Records are put on a queue by the calling thread and written by a background
+    listener, so logging never blocks an audit on file or console I/O. The file
+    holds rotated JSON lines; the console keeps the human-readable format.
     """
     # Prevents interference with Streamlit's default logger and duplicate handlers
     if logging.getLogger("auditor_logger").handlers:
@@ -11,26 +66,32 @@ def setup_logger():
 
     # Create a new logger with a specific name
     logger = logging.getLogger("auditor_logger")
-    logger.setLevel(logging.INFO)  # Set the minimum log level (INFO, WARNING, ERROR)
+    logger.setLevel(LOG_LEVEL)  # Set the minimum log level (INFO, WARNING, ERROR)
 
-    # Define the format for log messages
+    # Define the format for console messages
     formatter = logging.Formatter(
         "%(asctime)s - %(name)s - %(levelname)s - %(message)s",
         datefmt="%Y-%m-%d %H:%M:%S"
     )
 
-    # Create a handler to write logs to a file
-    file_handler = logging.FileHandler("auditor.log")
-    file_handler.setFormatter(formatter)
-    logger.addHandler(file_handler)
+    # Create a handler to write structured logs to a rotating file
+    file_handler = RotatingFileHandler(LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8")
+    file_handler.setFormatter(JsonFormatter())
 
     # Create a handler to display logs in the console (terminal)
     stream_handler = logging.StreamHandler(sys.stdout)
     stream_handler.setFormatter(formatter)
-    logger.addHandler(stream_handler)
-    
+
+    # Only the queue handler runs in the caller's thread; the listener does the I/O
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(_StructuredQueueHandler(log_queue))
+    listener = QueueListener(log_queue, file_handler, stream_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
     logger.info("Logger initialized successfully.")
     return logger
 
+
 # Create a logger instance to be used throughout the project
-logger = setup_logger()
\ No newline at end of file
+logger = setup_logger()
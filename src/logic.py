@@ -1,13 +1,19 @@
 import os
 import re
+import time
 import streamlit as st
 from dotenv import load_dotenv
-from langchain_openai import OpenAIEmbeddings, OpenAI
 from langchain_community.vectorstores import FAISS
 from langchain.chains import RetrievalQA
 from langchain.prompts import PromptTemplate
+from langchain_core.prompts import format_document
 from src.parser import parse_solidity_code
+from src.embeddings import get_index_embeddings
+from src.lexical_index import BM25Index, HybridRetriever
+from src.fingerprints import format_known_patterns
+from src.openai_client import create_llm
 from src.logger_config import logger
+from src.tracing import current_span, record, span, traced, traced_generator
 
 # Load environment variables from the .env file
 load_dotenv()
@@ -20,26 +26,9 @@ def get_openai_api_key():
         raise ValueError("OPENAI_API_KEY not found.")
     return api_key
 
-@st.cache_resource
-def initialize_qa_chain(index_path="faiss_index"):
-    """
-    Initializes and returns the QA chain, loading the vector store from disk.
-    This function is cached to prevent reloading the model on every interaction.
-    """
-    logger.info("Attempting to initialize the QA chain...")
-    if not os.path.exists(index_path):
-        logger.error(f"FAISS index not found at '{index_path}'. Aborting initialization.")
-        return None
-    
-    try:
-        api_key = get_openai_api_key()
-        embeddings = OpenAIEmbeddings(openai_api_key=api_key)
-        vector_store = FAISS.load_local(index_path, embeddings, allow_dangerous_deserialization=True)
-        logger.info("FAISS index loaded successfully.")
-        
-        # Enhanced prompt template that ALWAYS requires code suggestions
-        # If context has examples, use them; otherwise generate secure code
-        prompt_template = """
+# Enhanced prompt template that ALWAYS requires code suggestions
+# If context has examples, use them; otherwise generate secure code
+ANALYSIS_PROMPT_TEMPLATE = """
         You are an expert smart contract security auditor. Your task is to analyze the given Solidity code snippet based on the provided context of known vulnerabilities and best practices.
         Focus ONLY on the provided code snippet.
 
@@ -61,29 +50,70 @@ def initialize_qa_chain(index_path="faiss_index"):
         
         If no vulnerabilities are found, state: "- **Severity:** None" and omit the other fields.
         """
+
+def build_qa_chain(vector_store, llm, lexical_index=None, index_path="faiss_index"):
+    """
+    Builds the auditing QA chain on top of an already loaded vector store.
+
+    Args:
+        vector_store: The FAISS vector store.
+        llm: The LangChain LLM used to answer.
+        lexical_index (BM25Index, optional): Enables hybrid and lexical-only retrieval.
+        index_path (str): The index directory, kept on the chain so the known-pattern
+                          matching of its audits uses the fingerprint index saved there.
+
+    Returns:
+        RetrievalQA: The configured "stuff" chain.
+    """
+    PROMPT = PromptTemplate(template=ANALYSIS_PROMPT_TEMPLATE, input_variables=["context", "question"])
+    
+    return RetrievalQA.from_chain_type(
+        llm=llm,
+        chain_type="stuff",
+        retriever=HybridRetriever(vector_store=vector_store, lexical_index=lexical_index, k=5),
+        return_source_documents=True,
+        chain_type_kwargs={"prompt": PROMPT},
+        metadata={"index_path": index_path},
+    )
+
+def get_index_path(qa_chain):
+    """Returns the index directory ``qa_chain`` was built from."""
+    return (getattr(qa_chain, "metadata", None) or {}).get("index_path", "faiss_index")
+
+@st.cache_resource
+def initialize_qa_chain(index_path="faiss_index"):
+    """
+    Initializes and returns the QA chain, loading the vector store from disk.
+    This function is cached to prevent reloading the model on every interaction.
+    """
+    logger.info("Attempting to initialize the QA chain...")
+    if not os.path.exists(index_path):
+        logger.error(f"FAISS index not found at '{index_path}'. Aborting initialization.")
+        return None
+    
+    try:
+        api_key = get_openai_api_key()
+        embeddings = get_index_embeddings(index_path)
+        vector_store = FAISS.load_local(index_path, embeddings, allow_dangerous_deserialization=True)
+        logger.info("FAISS index loaded successfully.")
         
-        PROMPT = PromptTemplate(template=prompt_template, input_variables=["context", "question"])
-        
-        qa_chain = RetrievalQA.from_chain_type(
-            llm=OpenAI(temperature=0, openai_api_key=api_key),
-            chain_type="stuff",
-            retriever=vector_store.as_retriever(search_kwargs={"k": 5}),
-            return_source_documents=True,
-            chain_type_kwargs={"prompt": PROMPT}
+        qa_chain = build_qa_chain(
+            vector_store, create_llm(api_key), lexical_index=BM25Index.load(index_path), index_path=index_path
         )
         logger.info("QA chain initialized successfully.")
         return qa_chain
     except Exception as e:
         logger.critical(f"A critical error occurred during QA chain initialization: {e}", exc_info=True)
-        st.error(f"Failed to initialize the QA chain. See auditor.log for details.")
+        st.error(f"Failed to initialize the QA chain: {e} See auditor.log for details.")
         return None
 
+@traced("llm.code_fix")
 def generate_code_fix_with_chatgpt(code_snippet, vulnerability_description, api_key):
     """
     Fallback function to generate secure code fix using ChatGPT when knowledge base
     doesn't provide good examples.
     """
-    llm = OpenAI(temperature=0, openai_api_key=api_key)
+    llm = create_llm(api_key)
     
     prompt = f"""You are an expert Solidity security developer. Generate a secure, complete code fix for the following vulnerability.
 
@@ -125,6 +155,96 @@ def has_valid_code_suggestion(result_text):
     
     return False
 
+def build_analysis_query(func):
+    """Builds the retrieval/LLM query used to analyze a single parsed function."""
+    return f"Analyze this Solidity code for security vulnerabilities and provide secure fixes: \n```solidity\n{func['code']}\n```"
+
+def apply_code_fix_fallback(func, result, api_key=None):
+    """
+    Ensures a result that reports a vulnerability carries a usable code suggestion.
+    The API key is only resolved when the ChatGPT fallback is actually needed.
+
+    Returns:
+        tuple: (result, generated_code). ``generated_code`` is None when the
+               knowledge base answer already contained a valid suggestion.
+    """
+    # Check if result contains vulnerabilities but lacks proper code suggestions
+    if "Vulnerability:" not in result and "**Severity:**" not in result:
+        return result, None
+
+    # Extract vulnerability description for fallback if needed
+    vulnerability_match = re.search(r'### Vulnerability:\s*(.+?)(?:\n|$)', result, re.IGNORECASE)
+    description_match = re.search(r'\*\*Description:\*\*\s*(.+?)(?:\*\*Recommendation|\*\*Suggested Code|$)', result, re.DOTALL)
+
+    vulnerability_name = vulnerability_match.group(1).strip() if vulnerability_match else "Security Issue"
+    vulnerability_desc = description_match.group(1).strip() if description_match else vulnerability_name
+
+    # Check if Suggested Code section is empty or invalid
+    suggested_code_match = re.search(r'\*\*Suggested Code:\*\*\s*(.+?)(?:\n\n|\n###|$)', result, re.DOTALL)
+
+    if suggested_code_match and has_valid_code_suggestion(result):
+        return result, None
+
+    logger.info(f"Generated code suggestion is weak/empty for {func['name']}. Using ChatGPT fallback.")
+    record(code_fix_fallbacks=1)
+    # Generate secure code using ChatGPT as fallback
+    generated_code = generate_code_fix_with_chatgpt(func['code'], vulnerability_desc, api_key or get_openai_api_key())
+
+    # Replace or append the Suggested Code section
+    if suggested_code_match:
+        # Replace existing weak suggestion
+        old_suggestion = suggested_code_match.group(0)
+        result = result.replace(old_suggestion, f"**Suggested Code:** {generated_code}")
+    else:
+        # Append if missing
+        result += f"\n\n**Suggested Code:** {generated_code}"
+    return result, generated_code
+
+def retrieve_for_functions(qa_chain, functions):
+    """
+    Retrieves the context of every function of an audit in one batched search.
+
+    Returns:
+        list: One document list per function, or None entries when the chain's
+              retriever has no batch API or the batched search failed (each
+              function then retrieves on its own).
+    """
+    retriever = qa_chain.retriever
+    if not hasattr(retriever, "batch_search"):
+        return [None] * len(functions)
+    try:
+        return retriever.batch_search([build_analysis_query(func) for func in functions])
+    except Exception as e:
+        logger.error(f"Batched retrieval failed, falling back to per-function retrieval: {e}", exc_info=True)
+        record(retrieval_fallbacks=1)
+        return [None] * len(functions)
+
+def analyze_function(qa_chain, func, docs=None):
+    """
+    Analyzes a single parsed function and returns its Markdown report section.
+    Errors are logged and reported inside the section instead of being raised.
+
+    Args:
+        qa_chain: The chain returned by ``initialize_qa_chain``.
+        func (dict): A parsed function with "name" and "code".
+        docs (list, optional): Pre-retrieved context; skips the chain's own retrieval.
+    """
+    query = build_analysis_query(func)
+    with span("audit.function", function=func['name']):
+        try:
+            with span("llm.answer"):
+                if docs is None:
+                    answer = qa_chain.invoke({"query": query})["result"]
+                else:
+                    answer = qa_chain.combine_documents_chain.invoke({"input_documents": docs, "question": query})["output_text"]
+            result, _ = apply_code_fix_fallback(func, answer)
+            return f"## Analysis for: `{func['name']}`\n\n{result}\n\n---\n\n"
+        except Exception as e:
+            logger.error(f"Error analyzing function {func['name']}: {e}", exc_info=True)
+            record(function_errors=1)
+            return f"## Analysis for: `{func['name']}`\n\n> An error occurred during the analysis of this function. Please check the logs.\n\n"
+
+@traced("audit", mode="batch")
 def analyze_code_with_ai(qa_chain, code):
     """
     Parses the code into functions and analyzes each function individually for vulnerabilities.
@@ -134,56 +254,120 @@ def analyze_code_with_ai(qa_chain, code):
     functions_to_analyze = parse_solidity_code(code)
     
     full_analysis = ""
-    api_key = get_openai_api_key()
 
     if not functions_to_analyze:
          logger.warning("Could not parse the Solidity code. Analyzing the full snippet as a fallback.")
          return "Could not parse the Solidity code. Please provide a valid contract or function."
 
-    for i, func in enumerate(functions_to_analyze):
+    # Known vulnerable patterns are matched locally before any LLM call
+    full_analysis += format_known_patterns(functions_to_analyze, get_index_path(qa_chain))
+
+    retrieved_docs = retrieve_for_functions(qa_chain, functions_to_analyze)
+    for i, (func, docs) in enumerate(zip(functions_to_analyze, retrieved_docs)):
         logger.info(f"Analyzing function {i+1}/{len(functions_to_analyze)}: {func['name']}")
-        query = f"Analyze this Solidity code for security vulnerabilities and provide secure fixes: \n```solidity\n{func['code']}\n```"
-        try:
-            response = qa_chain.invoke({"query": query})
-            result = response["result"]
-            
-            # Check if result contains vulnerabilities but lacks proper code suggestions
-            if "Vulnerability:" in result or "**Severity:**" in result:
-                # Extract vulnerability description for fallback if needed
-                vulnerability_match = re.search(r'### Vulnerability:\s*(.+?)(?:\n|$)', result, re.IGNORECASE)
-                description_match = re.search(r'\*\*Description:\*\*\s*(.+?)(?:\*\*Recommendation|\*\*Suggested Code|$)', result, re.DOTALL)
-                
-                vulnerability_name = vulnerability_match.group(1).strip() if vulnerability_match else "Security Issue"
-                vulnerability_desc = description_match.group(1).strip() if description_match else vulnerability_name
-                
-                # Check if Suggested Code section is empty or invalid
-                suggested_code_match = re.search(r'\*\*Suggested Code:\*\*\s*(.+?)(?:\n\n|\n###|$)', result, re.DOTALL)
-                
-                if not suggested_code_match or not has_valid_code_suggestion(result):
-                    logger.info(f"Generated code suggestion is weak/empty for {func['name']}. Using ChatGPT fallback.")
-                    # Generate secure code using ChatGPT as fallback
-                    generated_code = generate_code_fix_with_chatgpt(func['code'], vulnerability_desc, api_key)
-                    
-                    # Replace or append the Suggested Code section
-                    if suggested_code_match:
-                        # Replace existing weak suggestion
-                        old_suggestion = suggested_code_match.group(0)
-                        result = result.replace(old_suggestion, f"**Suggested Code:** {generated_code}")
-                    else:
-                        # Append if missing
-                        result += f"\n\n**Suggested Code:** {generated_code}"
-            
-            full_analysis += f"## Analysis for: `{func['name']}`\n\n"
-            full_analysis += result
-            full_analysis += "\n\n---\n\n"
-        except Exception as e:
-            logger.error(f"Error analyzing function {func['name']}: {e}", exc_info=True)
-            full_analysis += f"## Analysis for: `{func['name']}`\n\n> An error occurred during the analysis of this function. Please check the logs.\n\n"
+        full_analysis += analyze_function(qa_chain, func, docs)
 
     logger.info("AI analysis completed.")
     return full_analysis
 
+def stream_qa_chain(qa_chain, query, source_documents=None, docs=None):
+    """
+    Streams the answer of a RetrievalQA "stuff" chain token by token.
+
+    The retrieval step and prompt are taken from the chain itself, so the streamed
+    answer is built from exactly the same context and template as ``qa_chain.invoke``.
+
+    Args:
+        qa_chain: The chain returned by ``initialize_qa_chain``.
+        query (str): The question or code snippet to analyze.
+        source_documents (list, optional): If given, the retrieved documents are appended to it.
+        docs (list, optional): Pre-retrieved context; skips the chain's own retrieval.
+
+    Yields:
+        str: Answer tokens as they are produced by the LLM.
+    """
+    if docs is None:
+        docs = qa_chain.retriever.invoke(query)
+    if source_documents is not None:
+        source_documents.extend(docs)
+
+    stuff_chain = qa_chain.combine_documents_chain
+    context = stuff_chain.document_separator.join(
+        format_document(doc, stuff_chain.document_prompt) for doc in docs
+    )
+    prompt = stuff_chain.llm_chain.prompt.format(context=context, question=query)
+    yield from _stream_answer(stuff_chain.llm_chain.llm, prompt)
+
+@traced_generator("llm.answer", streamed=True)
+def _stream_answer(llm, prompt):
+    answer_length = 0
+    for chunk in llm.stream(prompt):
+        token = chunk.content if hasattr(chunk, 'content') else str(chunk)
+        answer_length += len(token)
+        yield token
+    # Streamed responses carry no usage block, so tokens are estimated at ~4 characters each
+    record(tokens_in=len(prompt) // 4, tokens_out=answer_length // 4)
+
+@traced_generator("audit", mode="stream")
+def stream_analysis_with_ai(qa_chain, code):
+    """
+    Streaming counterpart of ``analyze_code_with_ai``.
+
+    Yields the per-function section headers, the LLM tokens as they arrive and, when
+    needed, the ChatGPT-generated code suggestion once a function's answer is complete.
+    Time-to-first-finding (first LLM token) and total time are logged at the end.
+    """
+    logger.info(f"Starting streaming AI analysis for code snippet of length {len(code)}.")
+    start_time = time.perf_counter()
+    first_token_time = None
+    functions_to_analyze = parse_solidity_code(code)
+
+    if not functions_to_analyze:
+        logger.warning("Could not parse the Solidity code. Analyzing the full snippet as a fallback.")
+        yield "Could not parse the Solidity code. Please provide a valid contract or function."
+        return
+
+    # Known vulnerable patterns are matched locally and shown before any LLM call
+    known_patterns = format_known_patterns(functions_to_analyze, get_index_path(qa_chain))
+    if known_patterns:
+        first_token_time = time.perf_counter() - start_time
+        logger.info(f"Time to first finding: {first_token_time:.2f}s")
+        yield known_patterns
+
+    retrieved_docs = retrieve_for_functions(qa_chain, functions_to_analyze)
+    for i, (func, docs) in enumerate(zip(functions_to_analyze, retrieved_docs)):
+        logger.info(f"Analyzing function {i+1}/{len(functions_to_analyze)}: {func['name']}")
+        yield f"## Analysis for: `{func['name']}`\n\n"
+        query = build_analysis_query(func)
+        result = ""
+        with span("audit.function", function=func['name']):
+            try:
+                for token in stream_qa_chain(qa_chain, query, docs=docs):
+                    if first_token_time is None and token:
+                        first_token_time = time.perf_counter() - start_time
+                        logger.info(f"Time to first finding: {first_token_time:.2f}s")
+                    result += token
+                    yield token
+
+                # Tokens already shown cannot be rewritten, so a generated fix is appended.
+                _, generated_code = apply_code_fix_fallback(func, result)
+                if generated_code is not None:
+                    yield f"\n\n**Suggested Code (generated):** {generated_code}"
+                yield "\n\n---\n\n"
+            except Exception as e:
+                logger.error(f"Error analyzing function {func['name']}: {e}", exc_info=True)
+                record(function_errors=1)
+                yield "\n\n> An error occurred during the analysis of this function. Please check the logs.\n\n"
+
+    total_time = time.perf_counter() - start_time
+    current_span().attributes["time_to_first_finding"] = first_token_time
+    if first_token_time is None:
+        logger.info(f"Streaming AI analysis completed in {total_time:.2f}s with no model output.")
+    else:
+        logger.info(f"Streaming AI analysis completed. Time to first finding: {first_token_time:.2f}s, total time: {total_time:.2f}s.")
+
 
+@traced("heuristics")
 def run_heuristic_checks(code):
     """
     Runs simple, rule-based checks for common, low-hanging fruit vulnerabilities.
@@ -0,0 +1,524 @@
+import json
+import os
+import random
+import threading
+import time
+import httpx
+from dotenv import load_dotenv
+from src.logger_config import logger
+from src.tracing import record as record_trace
+
+# Load environment variables from the .env file
+load_dotenv()
+
+# Quota and resilience settings, sized to the account's OpenAI limits
+OPENAI_RPM = float(os.getenv("OPENAI_RPM", "500"))             # requests per minute
+OPENAI_TPM = float(os.getenv("OPENAI_TPM", "200000"))          # tokens per minute
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "16"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "6"))
+OPENAI_DEADLINE = float(os.getenv("OPENAI_DEADLINE", "120"))    # seconds per logical call, retries included
+
+# "live" calls OpenAI; "record" calls it and saves every exchange to OPENAI_CASSETTE;
+# "replay" answers from the cassette and "synthetic" from deterministic stubs, both
+# without network access (OPENAI_API_KEY can then be any value).
+OPENAI_PROVIDER_MODE = os.getenv("OPENAI_PROVIDER_MODE", "live").lower()
+OPENAI_CASSETTE = os.getenv("OPENAI_CASSETTE", "openai_cassette.jsonl")
+OPENAI_SYNTHETIC_LATENCY = float(os.getenv("OPENAI_SYNTHETIC_LATENCY", "0"))  # mean seconds per synthetic call
+OPENAI_SYNTHETIC_LATENCY_SIGMA = float(os.getenv("OPENAI_SYNTHETIC_LATENCY_SIGMA", "0"))  # lognormal spread, 0 = uniform jitter
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+RETRYABLE_ERRORS = (httpx.TimeoutException, httpx.ConnectError, httpx.RemoteProtocolError)
+# Errors that are not retried but still mean the upstream is unhealthy (e.g. ReadError, WriteError)
+UPSTREAM_ERRORS = (httpx.NetworkError, httpx.ProtocolError)
+
+
+class CircuitOpenError(httpx.TransportError):
+    """Raised without calling OpenAI while the circuit breaker is open."""
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at ``rate`` tokens per second."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, amount=1.0, deadline=None):
+        """
+        Blocks until ``amount`` tokens are available and takes them.
+
+        Returns:
+            bool: False if ``deadline`` (a time.monotonic() value) passed first.
+        """
+        amount = min(amount, self.capacity)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return True
+                wait = (amount - self.tokens) / self.rate
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class AIMDLimiter:
+    """
+    Concurrency limit with additive increase / multiplicative decrease.
+
+    Each success raises the limit by 1/limit (about +1 per round of calls); each
+    throttling response halves it. Server errors and transport failures leave it
+    unchanged, so a burst of 5xx never raises concurrency.
+    """
+
+    def __init__(self, initial=4, minimum=1, maximum=OPENAI_MAX_CONCURRENCY):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.in_flight = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, deadline=None):
+        """Waits for a free slot; returns False if ``deadline`` passed first."""
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                timeout = None if deadline is None else deadline - time.monotonic()
+                if timeout is not None and timeout <= 0:
+                    return False
+                self.condition.wait(timeout)
+            self.in_flight += 1
+            return True
+
+    def release(self, throttled=False, success=True):
+        with self.condition:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(self.minimum, self.limit / 2)
+            elif success:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+
+class CircuitBreaker:
+    """
+    Opens after ``failure_threshold`` consecutive failures and rejects calls for
+    ``reset_timeout`` seconds, then lets a single trial call through (half-open).
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if time.monotonic() - self.opened_at >= self.reset_timeout else "open"
+
+    def allow(self):
+        with self.lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+            return False
+
+    def cancel(self):
+        """Gives back a call allowed by ``allow`` that was never sent."""
+        with self.lock:
+            self.trial_in_flight = False
+
+    def record(self, success):
+        with self.lock:
+            self.trial_in_flight = False
+            if success:
+                self.failures = 0
+                self.opened_at = None
+                return
+            self.failures += 1
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.error(f"OpenAI circuit breaker opened after {self.failures} consecutive failures.")
+                self.opened_at = time.monotonic()
+
+
+class CallStats:
+    """Per-endpoint call, retry, latency and token accounting."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = {}
+
+    def record(self, endpoint, latency, status, attempts, prompt_tokens=0, completion_tokens=0):
+        with self.lock:
+            stats = self.endpoints.setdefault(endpoint, {
+                "calls": 0, "errors": 0, "retries": 0, "throttled": 0,
+                "latency_total": 0.0, "latency_max": 0.0, "prompt_tokens": 0, "completion_tokens": 0,
+            })
+            stats["calls"] += 1
+            stats["errors"] += status is None or status >= 400
+            stats["retries"] += attempts - 1
+            stats["latency_total"] += latency
+            stats["latency_max"] = max(stats["latency_max"], latency)
+            stats["prompt_tokens"] += prompt_tokens
+            stats["completion_tokens"] += completion_tokens
+        # The same accounting is attributed to the calling audit's active span
+        if endpoint == "/embeddings":
+            tokens = {"embedding_tokens": prompt_tokens}
+        else:
+            tokens = {"tokens_in": prompt_tokens, "tokens_out": completion_tokens}
+        record_trace(provider_calls=1, provider_retries=attempts - 1, provider_seconds=latency,
+                     provider_errors=int(status is None or status >= 400), **tokens)
+
+    def record_throttle(self, endpoint):
+        with self.lock:
+            if endpoint in self.endpoints:
+                self.endpoints[endpoint]["throttled"] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                endpoint: {**stats, "latency_avg": stats["latency_total"] / stats["calls"] if stats["calls"] else 0.0}
+                for endpoint, stats in self.endpoints.items()
+            }
+
+
+def _estimate_tokens(request):
+    """Rough token estimate of a request (about 4 characters per token plus the completion budget)."""
+    try:
+        content = request.content
+        body = json.loads(content or b"{}")
+    except (ValueError, httpx.RequestNotRead):
+        return 1
+    max_tokens = body.get("max_tokens") if isinstance(body, dict) else None
+    return max(1, len(content) // 4 + int(max_tokens or 0))
+
+
+def _usage(response):
+    """Extracts (prompt_tokens, completion_tokens) from a non-streaming JSON response."""
+    if "application/json" not in response.headers.get("content-type", ""):
+        return 0, 0
+    try:
+        usage = json.loads(response.read()).get("usage") or {}
+    except ValueError:
+        return 0, 0
+    return usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+
+
+class _SettleOnCloseStream(httpx.SyncByteStream):
+    """
+    Response body wrapper that calls ``on_close(error)`` exactly once, when the body
+    is read to the end, closed or abandoned, with the exception that interrupted
+    reading it, if any.
+    """
+
+    def __init__(self, stream, on_close):
+        self.stream = stream
+        self.on_close = on_close
+        self.error = None
+        self.settled = False
+        self.lock = threading.Lock()
+
+    def __iter__(self):
+        try:
+            yield from self.stream
+        except Exception as e:
+            self.error = e
+            raise
+        finally:
+            self._settle()
+
+    def close(self):
+        try:
+            self.stream.close()
+        finally:
+            self._settle()
+
+    def _settle(self):
+        with self.lock:
+            if self.settled:
+                return
+            self.settled = True
+        self.on_close(self.error)
+
+
+def _retry_delay(response, attempt, base=0.5, cap=30.0):
+    """Full-jitter exponential backoff, overridden by a server Retry-After header."""
+    if response is not None:
+        retry_after = response.headers.get("retry-after")
+        if retry_after:
+            try:
+                return float(retry_after) + random.uniform(0, base)
+            except ValueError:
+                pass
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class GuardedTransport(httpx.BaseTransport):
+    """
+    httpx transport that every OpenAI call goes through.
+
+    It applies request and token rate limiting, AIMD concurrency, jittered retries
+    bounded by a deadline and a circuit breaker, and records per-call accounting.
+    The OpenAI SDK's own retries are disabled so this is the only retry layer.
+
+    A response whose body is still unread when it is returned (a streamed
+    completion) keeps its concurrency slot, and its call is timed, until the
+    caller has read or closed the body (or it is garbage collected).
+    """
+
+    def __init__(self, transport=None, rpm=OPENAI_RPM, tpm=OPENAI_TPM, max_retries=OPENAI_MAX_RETRIES,
+                 deadline=OPENAI_DEADLINE, max_concurrency=OPENAI_MAX_CONCURRENCY):
+        self.transport = transport or httpx.HTTPTransport()
+        self.request_bucket = TokenBucket(rpm / 60.0, max(1.0, rpm / 60.0))
+        self.token_bucket = TokenBucket(tpm / 60.0, tpm / 60.0 * 10)
+        self.limiter = AIMDLimiter(initial=min(4, max_concurrency), maximum=max_concurrency)
+        self.breaker = CircuitBreaker()
+        self.stats = CallStats()
+        self.max_retries = max_retries
+        self.deadline = deadline
+
+    def handle_request(self, request):
+        endpoint = request.url.path.rsplit("/v1", 1)[-1]
+        deadline = time.monotonic() + self.deadline
+        start_time = time.perf_counter()
+        estimated_tokens = _estimate_tokens(request)
+        response = None
+
+        for attempt in range(self.max_retries + 1):
+            if not self.breaker.allow():
+                self.stats.record(endpoint, time.perf_counter() - start_time, None, attempt + 1)
+                raise CircuitOpenError("OpenAI circuit breaker is open; call rejected.", request=request)
+            wait_start = time.perf_counter()
+            acquired = (self.request_bucket.acquire(1, deadline) and self.token_bucket.acquire(estimated_tokens, deadline)
+                        and self.limiter.acquire(deadline))
+            # Time queued behind the rate limits and concurrency cap, attributed to the caller's span
+            record_trace(provider_wait_seconds=time.perf_counter() - wait_start)
+            if not acquired:
+                self.breaker.cancel()
+                self.stats.record(endpoint, time.perf_counter() - start_time, None, attempt + 1)
+                raise httpx.TimeoutException("Deadline exceeded while waiting for OpenAI rate limits.", request=request)
+
+            throttled, error = False, None
+            try:
+                response = self.transport.handle_request(request)
+                throttled = response.status_code == 429
+            except RETRYABLE_ERRORS as e:
+                error, response = e, None
+            except BaseException as e:
+                # Not retried, but the slot, the breaker's trial call and the accounting are still settled
+                self._abort(e, endpoint, start_time, attempt + 1)
+                raise
+
+            retryable = error is not None or response.status_code in RETRYABLE_STATUS
+            # 429 means "slow down", not "unhealthy", so it does not trip the breaker
+            self.breaker.record(success=not retryable or throttled)
+            if throttled:
+                self.stats.record_throttle(endpoint)
+
+            if not retryable:
+                try:
+                    prompt_tokens, completion_tokens = _usage(response) if response.status_code < 400 else (0, 0)
+                except BaseException as e:
+                    self._abort(e, endpoint, start_time, attempt + 1)
+                    raise
+                status, attempts = response.status_code, attempt + 1
+
+                def settle(stream_error=None):
+                    self.limiter.release(success=stream_error is None and status < 500)
+                    if isinstance(stream_error, UPSTREAM_ERRORS):
+                        self.breaker.record(success=False)
+                    self.stats.record(endpoint, time.perf_counter() - start_time,
+                                      None if stream_error is not None else status, attempts,
+                                      prompt_tokens, completion_tokens)
+
+                if response.is_closed:
+                    settle()
+                else:
+                    response.stream = _SettleOnCloseStream(response.stream, settle)
+                return response
+
+            self.limiter.release(throttled=throttled, success=False)
+
+            delay = _retry_delay(response, attempt)
+            reason = f"HTTP {response.status_code}" if response is not None else type(error).__name__
+            if attempt == self.max_retries or time.monotonic() + delay > deadline:
+                logger.error(f"OpenAI {endpoint} failed after {attempt + 1} attempt(s): {reason}.")
+                self.stats.record(endpoint, time.perf_counter() - start_time,
+                                  response.status_code if response is not None else None, attempt + 1)
+                if error is not None:
+                    raise error
+                return response
+            logger.warning(f"OpenAI {endpoint} returned {reason}; retrying in {delay:.2f}s (attempt {attempt + 1}).")
+            if response is not None:
+                response.close()
+            time.sleep(delay)
+
+    def _abort(self, error, endpoint, start_time, attempts):
+        """Settles a call ended by an error that is not retried."""
+        self.limiter.release(success=False)
+        if isinstance(error, UPSTREAM_ERRORS):
+            self.breaker.record(success=False)
+        else:
+            # Not the upstream's fault (e.g. a cassette miss): give back a half-open trial
+            self.breaker.cancel()
+        self.stats.record(endpoint, time.perf_counter() - start_time, None, attempts)
+
+    def close(self):
+        self.transport.close()
+
+
+_transport = None
+_transport_lock = threading.Lock()
+
+
+def get_transport():
+    """
+    Returns the process-wide GuardedTransport shared by every OpenAI client.
+
+    Outside "live" mode the guard wraps a CassetteTransport. Offline modes keep the
+    guard's accounting and concurrency control but lift the quotas, which only
+    apply to the real API.
+    """
+    global _transport
+    with _transport_lock:
+        if _transport is None:
+            if OPENAI_PROVIDER_MODE == "live":
+                _transport = GuardedTransport()
+            else:
+                from src.cassettes import CassetteTransport
+
+                cassette = CassetteTransport(OPENAI_PROVIDER_MODE, path=OPENAI_CASSETTE, latency=OPENAI_SYNTHETIC_LATENCY,
+                                             latency_sigma=OPENAI_SYNTHETIC_LATENCY_SIGMA)
+                quotas = {} if OPENAI_PROVIDER_MODE == "record" else {"rpm": 1e9, "tpm": 1e12}
+                _transport = GuardedTransport(transport=cassette, **quotas)
+                logger.info(f"OpenAI calls are served in '{OPENAI_PROVIDER_MODE}' mode"
+                            + ("." if OPENAI_PROVIDER_MODE == "synthetic" else f" with cassette '{OPENAI_CASSETTE}'."))
+        return _transport
+
+
+def get_http_client():
+    """Returns an httpx client routed through the shared GuardedTransport."""
+    return httpx.Client(transport=get_transport(), timeout=httpx.Timeout(60.0, connect=10.0))
+
+
+def create_llm(api_key, **kwargs):
+    """Creates the LangChain OpenAI completion LLM behind the shared guarded client."""
+    from langchain_openai import OpenAI
+
+    return OpenAI(temperature=0, openai_api_key=api_key, http_client=get_http_client(), max_retries=0, **kwargs)
+
+
+def create_embeddings(api_key, **kwargs):
+    """Creates the LangChain OpenAI embeddings behind the shared guarded client."""
+    from langchain_openai import OpenAIEmbeddings
+
+    if OPENAI_PROVIDER_MODE != "live":
+        # Send raw text rather than tiktoken ids: no tokenizer download, and the
+        # request bodies of a recording and its replay stay identical
+        kwargs.setdefault("check_embedding_ctx_length", False)
+    return OpenAIEmbeddings(openai_api_key=api_key, http_client=get_http_client(), max_retries=0, **kwargs)
+
+
+def run_fake_openai_server(port=8765, latency=0.05, throttle_rate=0.2, error_rate=0.0, embedding_size=64):
+    """
+    Runs a local stand-in for the OpenAI API that injects latency, 429s and 5xx errors.
+
+    Serves /v1/completions, /v1/chat/completions and /v1/embeddings with the same
+    deterministic payloads as the "synthetic" provider mode, streamed as server-sent
+    events when the request asks for ``stream``. Blocks until interrupted;
+    run it in a thread for in-process tests.
+    """
+    import asyncio
+    from aiohttp import web
+    from src.cassettes import as_event_stream, synthetic_payload
+
+    async def maybe_fail(request):
+        await asyncio.sleep(random.expovariate(1 / latency) if latency else 0)
+        roll = random.random()
+        if roll < throttle_rate:
+            return web.json_response({"error": {"message": "Rate limit reached", "type": "requests"}},
+                                     status=429, headers={"Retry-After": "0.1"})
+        if roll < throttle_rate + error_rate:
+            return web.json_response({"error": {"message": "Server error", "type": "server_error"}}, status=503)
+        return None
+
+    def endpoint_handler(endpoint):
+        async def handler(request):
+            failure = await maybe_fail(request)
+            if failure:
+                return failure
+            body = await request.json()
+            payload = synthetic_payload(endpoint, body, embedding_size)
+            if body.get("stream"):
+                return web.Response(body=as_event_stream(endpoint, payload), content_type="text/event-stream")
+            return web.json_response(payload)
+        return handler
+
+    app = web.Application()
+    for endpoint in ("/completions", "/chat/completions", "/embeddings"):
+        app.router.add_post(f"/v1{endpoint}", endpoint_handler(endpoint))
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    web.run_app(app, host="127.0.0.1", port=port, print=None, handle_signals=False)
+
+
+if __name__ == "__main__":
+    # Exercises the guarded client against the local fake server and prints the accounting.
+    import argparse
+    from concurrent.futures import ThreadPoolExecutor
+
+    arg_parser = argparse.ArgumentParser(description="Load the guarded OpenAI client against a local fake server.")
+    arg_parser.add_argument("--port", type=int, default=8765)
+    arg_parser.add_argument("--calls", type=int, default=100)
+    arg_parser.add_argument("--threads", type=int, default=16)
+    arg_parser.add_argument("--latency", type=float, default=0.05, help="Mean injected latency in seconds.")
+    arg_parser.add_argument("--throttle-rate", type=float, default=0.2, help="Share of calls answered with 429.")
+    arg_parser.add_argument("--error-rate", type=float, default=0.05, help="Share of calls answered with 503.")
+    args = arg_parser.parse_args()
+
+    threading.Thread(
+        target=run_fake_openai_server,
+        kwargs={"port": args.port, "latency": args.latency, "throttle_rate": args.throttle_rate, "error_rate": args.error_rate},
+        daemon=True,
+    ).start()
+    time.sleep(1)
+
+    base_url = f"http://127.0.0.1:{args.port}/v1"
+    llm = create_llm("sk-fake", openai_api_base=base_url)
+    embeddings = create_embeddings("sk-fake", openai_api_base=base_url, check_embedding_ctx_length=False)
+
+    def one_call(i):
+        try:
+            if i % 2:
+                embeddings.embed_query(f"query {i}")
+            else:
+                llm.invoke(f"prompt {i}")
+            return True
+        except Exception as e:
+            logger.error(f"Call {i} failed: {e}")
+            return False
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(args.threads) as pool:
+        succeeded = sum(pool.map(one_call, range(args.calls)))
+    elapsed = time.perf_counter() - start_time
+
+    transport = get_transport()
+    print(f"\n{succeeded}/{args.calls} calls succeeded in {elapsed:.2f}s "
+          f"(AIMD limit {transport.limiter.limit:.1f}, breaker {transport.breaker.state})")
+    for endpoint, stats in transport.stats.snapshot().items():
+        print(f"  {endpoint}: {stats['calls']} calls, {stats['retries']} retries, {stats['throttled']} throttled, "
+              f"{stats['errors']} errors, avg {stats['latency_avg'] * 1000:.0f} ms, max {stats['latency_max'] * 1000:.0f} ms, "
+              f"tokens in/out {stats['prompt_tokens']}/{stats['completion_tokens']}")
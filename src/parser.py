@@ -1,5 +1,19 @@
 from solidity_parser import parser
+from src.tracing import record, traced
 
+def _node_source(lines, loc):
+    """Returns the source text covered by an AST node location, or None if it is unknown."""
+    if not loc:
+        return None
+    start, end = loc['start'], loc['end']
+    if start['line'] == end['line']:
+        return lines[start['line'] - 1][start['column']:end['column'] + 1]
+    selected = lines[start['line'] - 1:end['line']]
+    selected[0] = selected[0][start['column']:]
+    selected[-1] = selected[-1][:end['column'] + 1]
+    return "\n".join(selected)
+
+@traced("parser.parse")
 def parse_solidity_code(code_snippet):
     """
     Parses a Solidity code snippet and extracts all function definitions.
@@ -8,13 +22,15 @@ def parse_solidity_code(code_snippet):
         code_snippet (str): The string containing the Solidity code.
 
     Returns:
-        list of dicts: A list where each dictionary contains the name and body of a function.
-                       Returns the full snippet as a single item if parsing fails.
+        list of dicts: A list where each dictionary contains the name of a function, the
+                       full snippet as "code" and, when available, the function's own
+                       source as "body". Returns the full snippet as a single item if parsing fails.
     """
     functions = []
     try:
         # Parse the code into an Abstract Syntax Tree (AST)
-        ast = parser.parse(code_snippet, loc=False)
+        ast = parser.parse(code_snippet, loc=True)
+        lines = code_snippet.splitlines()
         
         # Traverse the AST to find all function definitions
         for node in ast.get('children', []):
@@ -27,7 +43,8 @@ def parse_solidity_code(code_snippet):
                              # to provide complete context to the LLM.
                             functions.append({
                                 "name": function_name,
-                                "code": code_snippet 
+                                "code": code_snippet,
+                                "body": _node_source(lines, sub_node.get('loc'))
                             })
         
         # If no functions are found (e.g., user submitted a single line or a question)
@@ -35,9 +52,11 @@ def parse_solidity_code(code_snippet):
         if not functions:
             return [{"name": "Full Snippet Analysis", "code": code_snippet}]
             
+        record(functions_parsed=len(functions))
         return functions
     except Exception as e:
         print(f"Warning: Error parsing Solidity code: {e}")
+        record(parse_fallbacks=1)
         # If parsing fails for any reason, fall back to analyzing the full code snippet.
         return [{"name": "Full Snippet Analysis", "code": code_snippet}]
 
@@ -2,9 +2,12 @@ import os
 from dotenv import load_dotenv
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import FAISS
-from langchain_openai import OpenAIEmbeddings
+from src.embeddings import HashedTfidfEmbeddings, get_embeddings, get_index_embeddings, save_index_provider
+from src.lexical_index import BM25Index
+from src.fingerprints import build_fingerprint_index
 from src.knowledge_loader import load_knowledge_from_directory
 from src.logger_config import logger
+from src.tracing import record, span, traced
 
 # Load environment variables from the .env file
 load_dotenv()
@@ -17,16 +20,17 @@ def get_openai_api_key():
         raise ValueError("OPENAI_API_KEY not found in .env file or environment variables.")
     return api_key
 
-def build_and_save_vector_store(docs, index_path="faiss_index"):
+@traced("rag.chunk")
+def split_into_chunks(docs):
     """
-    Builds a FAISS vector store from the documents and saves it locally.
+    Converts (name, content) tuples into LangChain Documents and splits them into chunks.
 
     Args:
         docs (list): A list of document tuples (name, content).
-        index_path (str): The path to save the FAISS index.
+
+    Returns:
+        list: The chunked LangChain Documents, each tagged with its source filename.
     """
-    logger.info("Starting the vector store build process...")
-    
     # 1. Convert the list of tuples into LangChain's Document format.
     # We use the filename as metadata to track the source of each chunk.
     from langchain.schema import Document
@@ -40,21 +44,96 @@ def build_and_save_vector_store(docs, index_path="faiss_index"):
     )
     chunks = text_splitter.split_documents(langchain_docs)
     logger.info(f"Split {len(langchain_docs)} documents into {len(chunks)} chunks.")
+    record(chunks=len(chunks))
+    return chunks
+
+@traced("rag.build_index")
+def build_and_save_vector_store(docs, index_path="faiss_index", provider=None):
+    """
+    Builds a FAISS vector store from the documents and saves it locally.
+
+    Args:
+        docs (list): A list of document tuples (name, content).
+        index_path (str): The path to save the FAISS index.
+        provider (str, optional): Embeddings backend ("openai" or "local").
+                                  Defaults to the EMBEDDINGS_PROVIDER setting.
+    """
+    logger.info("Starting the vector store build process...")
+    
+    chunks = split_into_chunks(docs)
 
     # 3. Create embeddings for the chunks and build the FAISS vector store.
     logger.info("Creating embeddings and building the FAISS index. This may take a few moments...")
     try:
-        api_key = get_openai_api_key()
-        embeddings = OpenAIEmbeddings(openai_api_key=api_key)
-        vector_store = FAISS.from_documents(chunks, embeddings)
+        embeddings = get_embeddings(provider, index_path)
+        if isinstance(embeddings, HashedTfidfEmbeddings):
+            # The local backend learns its IDF weights from the chunks being indexed
+            embeddings.fit([chunk.page_content for chunk in chunks])
+        with span("rag.embed", chunks=len(chunks)):
+            vector_store = FAISS.from_documents(chunks, embeddings)
     except Exception as e:
         logger.critical(f"Failed to create embeddings or build FAISS index: {e}", exc_info=True)
         return
 
     # 4. Save the vector store locally for future use.
     vector_store.save_local(index_path)
+    save_index_provider(index_path, provider)
+    if isinstance(embeddings, HashedTfidfEmbeddings):
+        embeddings.save(index_path)
+    # The BM25 index shares the chunk order of the FAISS index
+    with span("rag.lexical_index"):
+        BM25Index.build([chunk.page_content for chunk in chunks]).save(index_path)
     logger.info(f"Vector store successfully built and saved to '{index_path}'")
 
+@traced("rag.update_index")
+def update_vector_store(docs, removed_sources=(), index_path="faiss_index", provider=None):
+    """
+    Incrementally updates a saved vector store instead of rebuilding it.
+
+    The chunks of every source in ``docs`` or ``removed_sources`` are deleted, and only
+    the chunks of ``docs`` are embedded and added. The local backend keeps its fitted
+    IDF weights; a full rebuild refits them.
+
+    Args:
+        docs (list): Document tuples (name, content) that were added or changed.
+        removed_sources (iterable): Names of documents that no longer exist.
+        index_path (str): The path of the saved FAISS index.
+        provider (str, optional): Embeddings backend ("openai" or "local"); must be the one
+                                  the index was built with.
+
+    Returns:
+        bool: False if there is no saved index to update (a full build is needed).
+    """
+    if not os.path.exists(os.path.join(index_path, "index.faiss")):
+        logger.warning(f"No FAISS index found at '{index_path}'; it cannot be updated incrementally.")
+        return False
+
+    # Raises rather than mixing vectors of two backends in one index
+    vector_store = FAISS.load_local(index_path, get_index_embeddings(index_path, provider), allow_dangerous_deserialization=True)
+    stale_sources = {name for name, _ in docs} | set(removed_sources)
+    stale_ids = [
+        docstore_id for docstore_id in vector_store.index_to_docstore_id.values()
+        if vector_store.docstore.search(docstore_id).metadata.get("source") in stale_sources
+    ]
+    if stale_ids:
+        vector_store.delete(stale_ids)
+
+    chunks = split_into_chunks(docs) if docs else []
+    if chunks:
+        with span("rag.embed", chunks=len(chunks)):
+            vector_store.add_documents(chunks)
+    vector_store.save_local(index_path)
+
+    # BM25 positions must follow the FAISS order, so it is rebuilt from the docstore (no embedding calls)
+    with span("rag.lexical_index"):
+        texts = [
+            vector_store.docstore.search(vector_store.index_to_docstore_id[i]).page_content
+            for i in range(len(vector_store.index_to_docstore_id))
+        ]
+        BM25Index.build(texts).save(index_path)
+    logger.info(f"Vector store updated at '{index_path}': {len(stale_ids)} stale chunks removed, {len(chunks)} chunks added.")
+    return True
+
 if __name__ == "__main__":
     # This script is the main entry point for building the knowledge base index.
     
@@ -64,6 +143,8 @@ if __name__ == "__main__":
     if documents:
         # Step 2: Build and save the vector store.
         build_and_save_vector_store(documents)
+        # Step 3: Fingerprint the vulnerable snippets quoted in the audit reports.
+        build_fingerprint_index()
     else:
         logger.warning("No documents were loaded. The vector store was not built.")
 
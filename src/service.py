@@ -0,0 +1,323 @@
+import argparse
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from aiohttp import web
+from src.benchmark import use_synthetic_provider
+from src.logic import build_qa_chain, analyze_code_with_ai, run_heuristic_checks
+from src.fingerprints import find_known_vulnerabilities
+from src.parser import parse_solidity_code
+from src.openai_client import get_transport
+from src.tracing import metrics_snapshot
+from src.logger_config import logger
+
+# Most knowledge base chunks /retrieve returns for one query
+MAX_RETRIEVE_K = 50
+
+class QueueFullError(Exception):
+    """Raised when the request queue is already at capacity."""
+
+
+class ConcurrencyLimiter:
+    """
+    Enforces a global and a per-client limit on in-flight requests.
+
+    Requests over either limit wait in a bounded queue. A request is rejected
+    immediately when the queue is full, and gives up after ``queue_timeout`` seconds.
+    """
+
+    def __init__(self, max_concurrent=4, max_per_client=2, max_queue=32, queue_timeout=30.0):
+        self.max_per_client = max_per_client
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._global = asyncio.Semaphore(max_concurrent)
+        self._clients = {}
+        self._client_refs = {}
+        self.waiting = 0
+        self.active = 0
+
+    def _client_semaphore(self, client_id):
+        if client_id not in self._clients:
+            self._clients[client_id] = asyncio.Semaphore(self.max_per_client)
+            self._client_refs[client_id] = 0
+        self._client_refs[client_id] += 1
+        return self._clients[client_id]
+
+    def _release_client(self, client_id):
+        self._client_refs[client_id] -= 1
+        if self._client_refs[client_id] == 0:
+            del self._clients[client_id]
+            del self._client_refs[client_id]
+
+    async def acquire(self, client_id):
+        """
+        Waits for a slot for ``client_id``.
+
+        Returns:
+            float: The time in seconds the request spent queued.
+        """
+        if self.waiting >= self.max_queue:
+            raise QueueFullError(f"Request queue is full ({self.max_queue} waiting).")
+
+        client_semaphore = self._client_semaphore(client_id)
+        start_time = time.perf_counter()
+        self.waiting += 1
+        client_acquired = False
+        try:
+            async with asyncio.timeout(self.queue_timeout):
+                await client_semaphore.acquire()
+                client_acquired = True
+                await self._global.acquire()
+        except BaseException:
+            if client_acquired:
+                client_semaphore.release()
+            self._release_client(client_id)
+            raise
+        finally:
+            self.waiting -= 1
+
+        self.active += 1
+        return time.perf_counter() - start_time
+
+    def release(self, client_id):
+        """Frees the slot previously acquired for ``client_id``."""
+        self.active -= 1
+        self._global.release()
+        self._clients[client_id].release()
+        self._release_client(client_id)
+
+
+def load_indexes(index_path="faiss_index", stub=False):
+    """
+    Loads the shared vector store and BM25 index used by every request.
+
+    With ``stub=True`` no network is used: the knowledge base is chunked and indexed
+    in memory with the local hashed TF-IDF embeddings.
+
+    Returns:
+        tuple: (vector_store, lexical_index); lexical_index is None for indexes built without one.
+    """
+    from langchain_community.vectorstores import FAISS
+    from src.embeddings import HashedTfidfEmbeddings, get_index_embeddings
+    from src.lexical_index import BM25Index
+
+    if stub:
+        from src.knowledge_loader import load_knowledge_from_directory
+        from src.rag_core import split_into_chunks
+
+        documents = load_knowledge_from_directory() or [("empty.md", "No knowledge loaded.")]
+        chunks = split_into_chunks(documents)
+        texts = [chunk.page_content for chunk in chunks]
+        embeddings = HashedTfidfEmbeddings().fit(texts)
+        return FAISS.from_documents(chunks, embeddings), BM25Index.build(texts)
+
+    if not os.path.exists(index_path):
+        raise FileNotFoundError(f"FAISS index not found at '{index_path}'. Please run 'python -m src.rag_core' first to build it.")
+    vector_store = FAISS.load_local(index_path, get_index_embeddings(index_path), allow_dangerous_deserialization=True)
+    return vector_store, BM25Index.load(index_path)
+
+
+def load_llm():
+    """Returns the LLM shared by every request, served by the configured provider mode."""
+    from src.logic import get_openai_api_key
+    from src.openai_client import create_llm
+    return create_llm(get_openai_api_key())
+
+
+def _client_id(request):
+    return request.headers.get("X-Client-Id") or request.remote or "unknown"
+
+
+async def _run_limited(request, func, *args):
+    """Runs a blocking ``func`` in the worker pool under the concurrency limits."""
+    limiter = request.app["limiter"]
+    client_id = _client_id(request)
+    try:
+        queue_time = await limiter.acquire(client_id)
+    except QueueFullError as e:
+        raise web.HTTPTooManyRequests(text=str(e))
+    except TimeoutError:
+        raise web.HTTPServiceUnavailable(text="Timed out waiting in the request queue.")
+
+    try:
+        loop = asyncio.get_running_loop()
+        start_time = time.perf_counter()
+        result = await loop.run_in_executor(request.app["executor"], func, *args)
+        return result, queue_time, time.perf_counter() - start_time
+    finally:
+        limiter.release(client_id)
+
+
+def _json_response(payload, queue_time, run_time):
+    response = web.json_response(payload)
+    response.headers["X-Queue-Time"] = f"{queue_time:.4f}"
+    response.headers["X-Run-Time"] = f"{run_time:.4f}"
+    return response
+
+
+async def _read_field(request, field):
+    try:
+        body = await request.json()
+    except ValueError:
+        raise web.HTTPBadRequest(text="Request body must be JSON.")
+    value = body.get(field) if isinstance(body, dict) else None
+    if not isinstance(value, str) or not value.strip():
+        raise web.HTTPBadRequest(text=f"Field '{field}' is required.")
+    return body, value
+
+
+def _require_ready(request):
+    if request.app["qa_chain"] is None:
+        raise web.HTTPServiceUnavailable(text="The index is still loading.")
+    return request.app["qa_chain"]
+
+
+async def health(request):
+    """Liveness probe: the process is up and serving."""
+    return web.json_response({"status": "ok"})
+
+
+async def ready(request):
+    """Readiness probe: the shared index is loaded and requests can be served."""
+    limiter = request.app["limiter"]
+    if request.app["qa_chain"] is None:
+        return web.json_response({"status": "loading", "error": request.app["load_error"]}, status=503)
+    return web.json_response({"status": "ready", "active": limiter.active, "waiting": limiter.waiting})
+
+
+async def metrics(request):
+    """
+    Per-stage timings, token/cost and fallback counters, recent audit traces,
+    OpenAI call accounting and the current request queue.
+    """
+    limiter = request.app.get("limiter")
+    return web.json_response({
+        **metrics_snapshot(),
+        "openai": get_transport().stats.snapshot(),
+        "service": {"active": limiter.active, "waiting": limiter.waiting} if limiter else {},
+    })
+
+
+def _heuristics_and_patterns(code, index_path):
+    return {"alerts": run_heuristic_checks(code),
+            "known_patterns": find_known_vulnerabilities(parse_solidity_code(code), index_path)}
+
+
+async def heuristics(request):
+    """Runs the rule-based checks and known-vulnerable pattern matching on ``code``."""
+    _, code = await _read_field(request, "code")
+    payload, queue_time, run_time = await _run_limited(request, _heuristics_and_patterns, code, request.app["index_path"])
+    return _json_response(payload, queue_time, run_time)
+
+
+async def retrieve(request):
+    """
+    Returns the top ``k`` (1 to ``MAX_RETRIEVE_K``) knowledge base chunks for ``query``.
+    ``mode`` may be "auto" (default), "hybrid", "vector" or "lexical".
+    """
+    qa_chain = _require_ready(request)
+    body, query = await _read_field(request, "query")
+    try:
+        k = int(body.get("k", 5))
+    except (TypeError, ValueError):
+        raise web.HTTPBadRequest(text="Field 'k' must be an integer.")
+    if not 1 <= k <= MAX_RETRIEVE_K:
+        raise web.HTTPBadRequest(text=f"Field 'k' must be between 1 and {MAX_RETRIEVE_K}.")
+    mode = body.get("mode", "auto")
+    if mode not in ("auto", "hybrid", "vector", "lexical"):
+        raise web.HTTPBadRequest(text="Field 'mode' must be one of auto, hybrid, vector or lexical.")
+
+    retriever = qa_chain.retriever
+    docs, queue_time, run_time = await _run_limited(request, retriever.search, query, k, mode)
+    results = [{"source": doc.metadata.get("source", "Unknown"), "content": doc.page_content} for doc in docs]
+    return _json_response({"mode": retriever.resolve_mode(query, mode), "results": results}, queue_time, run_time)
+
+
+async def analyze(request):
+    """Runs the full per-function AI analysis on ``code``."""
+    qa_chain = _require_ready(request)
+    _, code = await _read_field(request, "code")
+    analysis, queue_time, run_time = await _run_limited(request, analyze_code_with_ai, qa_chain, code)
+    return _json_response({"analysis": analysis}, queue_time, run_time)
+
+
+def create_app(index_path="faiss_index", max_concurrent=4, max_per_client=2, max_queue=32,
+               queue_timeout=30.0, stub=False, stub_latency=0.0, stub_sigma=0.0):
+    """
+    Creates the analysis service.
+
+    The index and LLM are loaded once in the background on startup and shared by
+    every request; ``/ready`` reports 503 until that load has finished. With
+    ``stub`` every model call is answered by the synthetic provider, with the same
+    lognormal latency model (``stub_latency`` median, ``stub_sigma`` spread) as
+    ``src.loadtest``.
+    """
+    if stub:
+        use_synthetic_provider(stub_latency, stub_sigma)
+    app = web.Application()
+    app["qa_chain"] = None
+    app["load_error"] = None
+    app["index_path"] = index_path
+    app["executor"] = ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix="analysis")
+
+    def load_chain():
+        logger.info("Loading the shared index for the analysis service...")
+        try:
+            vector_store, lexical_index = load_indexes(index_path, stub=stub)
+            app["qa_chain"] = build_qa_chain(
+                vector_store, load_llm(), lexical_index=lexical_index,
+                index_path=index_path,
+            )
+            logger.info("Analysis service is ready.")
+        except Exception as e:
+            app["load_error"] = str(e)
+            logger.critical(f"Failed to load the shared index: {e}", exc_info=True)
+
+    async def on_startup(app):
+        # The limiter must be created inside the running event loop
+        app["limiter"] = ConcurrencyLimiter(max_concurrent, max_per_client, max_queue, queue_timeout)
+        app["load_task"] = asyncio.get_running_loop().run_in_executor(app["executor"], load_chain)
+
+    async def on_cleanup(app):
+        app["executor"].shutdown(wait=False, cancel_futures=True)
+
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    app.router.add_get("/health", health)
+    app.router.add_get("/ready", ready)
+    app.router.add_get("/metrics", metrics)
+    app.router.add_post("/heuristics", heuristics)
+    app.router.add_post("/retrieve", retrieve)
+    app.router.add_post("/analyze", analyze)
+    return app
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Smart Contract Guardian HTTP analysis service.")
+    arg_parser.add_argument("--host", default="127.0.0.1")
+    arg_parser.add_argument("--port", type=int, default=8080)
+    arg_parser.add_argument("--index-path", default="faiss_index")
+    arg_parser.add_argument("--max-concurrent", type=int, default=4, help="Global limit on in-flight requests.")
+    arg_parser.add_argument("--max-per-client", type=int, default=2, help="Limit on in-flight requests per client.")
+    arg_parser.add_argument("--max-queue", type=int, default=32, help="Requests allowed to wait before returning 429.")
+    arg_parser.add_argument("--queue-timeout", type=float, default=30.0, help="Seconds a request may wait before returning 503.")
+    arg_parser.add_argument("--stub", action="store_true", help="Use local embeddings and the synthetic LLM provider (no network).")
+    arg_parser.add_argument("--stub-latency", type=float, default=0.0, help="Median seconds per synthetic completion call.")
+    arg_parser.add_argument("--stub-sigma", type=float, default=0.0, help="Lognormal spread of the synthetic latency.")
+    args = arg_parser.parse_args()
+
+    web.run_app(
+        create_app(
+            index_path=args.index_path,
+            max_concurrent=args.max_concurrent,
+            max_per_client=args.max_per_client,
+            max_queue=args.max_queue,
+            queue_timeout=args.queue_timeout,
+            stub=args.stub,
+            stub_latency=args.stub_latency,
+            stub_sigma=args.stub_sigma,
+        ),
+        host=args.host,
+        port=args.port,
+    )
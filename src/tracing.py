@@ -0,0 +1,246 @@
+import contextvars
+import functools
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+import numpy as np
+from dotenv import load_dotenv
+from src.logger_config import logger
+
+# Load environment variables from the .env file
+load_dotenv()
+
+# USD per 1K tokens, used to estimate the cost of an audit from its token counters
+PRICE_INPUT_PER_1K = float(os.getenv("OPENAI_PRICE_INPUT_PER_1K", "0.0015"))
+PRICE_OUTPUT_PER_1K = float(os.getenv("OPENAI_PRICE_OUTPUT_PER_1K", "0.002"))
+PRICE_EMBEDDING_PER_1K = float(os.getenv("OPENAI_PRICE_EMBEDDING_PER_1K", "0.0001"))
+
+# Durations kept per span name for percentiles, and completed audits kept for inspection
+DURATION_SAMPLES = 1000
+RECENT_TRACES = 20
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+# Spans can be shared by threads (e.g. the audit span of a background job)
+_span_lock = threading.Lock()
+
+
+def estimate_cost(counters):
+    """Estimated USD cost of the token counters of a span."""
+    return (counters.get("tokens_in", 0) * PRICE_INPUT_PER_1K
+            + counters.get("tokens_out", 0) * PRICE_OUTPUT_PER_1K
+            + counters.get("embedding_tokens", 0) * PRICE_EMBEDDING_PER_1K) / 1000
+
+
+class Span:
+    """
+    One timed stage of the pipeline.
+
+    Counters recorded while a span is current (tokens, cache hits, fallbacks) are
+    added to it and to every enclosing span, so an audit span holds the totals of
+    its functions and each function span the totals of its own stages.
+    """
+
+    def __init__(self, name, parent=None, attributes=None):
+        self.name = name
+        self.parent = parent
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex[:16]
+        self.attributes = attributes or {}
+        self.counters = {}
+        self.children = []
+        self.error = None
+        self.start = time.perf_counter()
+        self.duration = None
+
+    def to_dict(self, children=True):
+        span = {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "duration": self.duration,
+            **self.attributes,
+            "counters": dict(self.counters),
+            "cost_usd": estimate_cost(self.counters),
+        }
+        if self.error:
+            span["error"] = self.error
+        if children and self.children:
+            span["children"] = [child.to_dict() for child in self.children]
+        return span
+
+
+class MetricsRegistry:
+    """Process-wide aggregates of completed spans and recorded counters."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.spans = {}
+            self.totals = {}
+            self.recent = deque(maxlen=RECENT_TRACES)
+
+    def record(self, counters):
+        with self.lock:
+            for key, value in counters.items():
+                self.totals[key] = self.totals.get(key, 0) + value
+
+    def observe(self, span):
+        with self.lock:
+            stats = self.spans.get(span.name)
+            if stats is None:
+                stats = self.spans[span.name] = {
+                    "count": 0, "errors": 0, "total": 0.0, "max": 0.0,
+                    "durations": deque(maxlen=DURATION_SAMPLES), "counters": {},
+                }
+            stats["count"] += 1
+            stats["errors"] += span.error is not None
+            stats["total"] += span.duration
+            stats["max"] = max(stats["max"], span.duration)
+            stats["durations"].append(span.duration)
+            for key, value in span.counters.items():
+                stats["counters"][key] = stats["counters"].get(key, 0) + value
+            if span.parent is None:
+                self.recent.append(span.to_dict())
+
+    def snapshot(self):
+        """
+        Returns per-span-name statistics (count, errors, mean/p50/p95/p99/max seconds and
+        summed counters), the overall counters with their estimated cost, and the most
+        recent completed root spans with their per-function breakdown.
+        """
+        with self.lock:
+            spans = {}
+            for name, stats in self.spans.items():
+                durations = np.asarray(stats["durations"])
+                p50, p95, p99 = np.percentile(durations, [50, 95, 99])
+                spans[name] = {
+                    "count": stats["count"], "errors": stats["errors"],
+                    "mean": stats["total"] / stats["count"], "p50": float(p50), "p95": float(p95),
+                    "p99": float(p99), "max": stats["max"], "counters": dict(stats["counters"]),
+                }
+            return {
+                "spans": spans,
+                "totals": {**self.totals, "cost_usd": estimate_cost(self.totals)},
+                "recent": list(self.recent),
+            }
+
+
+registry = MetricsRegistry()
+
+
+def finish_span(current):
+    """
+    Completes a span: sets its duration, attaches it to its parent and records it.
+
+    Root spans are logged at INFO and nested spans at DEBUG, with the span itself
+    attached to the log record for the structured log file.
+    """
+    current.duration = time.perf_counter() - current.start
+    if current.parent is not None:
+        with _span_lock:
+            current.parent.children.append(current)
+    registry.observe(current)
+    level = logging.INFO if current.parent is None else logging.DEBUG
+    if logger.isEnabledFor(level):
+        logger.log(level, f"Span {current.name} finished in {current.duration * 1000:.1f} ms",
+                   extra={"span": current.to_dict(children=False)})
+
+
+@contextmanager
+def use_span(current):
+    """Makes a started span current for the enclosed block without finishing it."""
+    token = _current_span.set(current)
+    try:
+        yield current
+    finally:
+        _current_span.reset(token)
+
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Times the enclosed block as a child of the current span (or as a new trace).
+
+    A generator that is closed before it is exhausted marks its open spans
+    "closed_early" rather than failed.
+    """
+    current = Span(name, _current_span.get(), attributes)
+    try:
+        with use_span(current):
+            yield current
+    except GeneratorExit:
+        current.attributes["closed_early"] = True
+        raise
+    except BaseException as e:
+        current.error = type(e).__name__
+        raise
+    finally:
+        finish_span(current)
+
+
+def traced(name, **attributes):
+    """Decorator form of ``span`` for whole (non-generator) functions."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name, **attributes):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _run_in_context(generator, context):
+    try:
+        while True:
+            try:
+                item = context.run(next, generator)
+            except StopIteration:
+                return
+            yield item
+    finally:
+        context.run(generator.close)
+
+
+def traced_generator(name, **attributes):
+    """
+    Decorator form of ``span`` for generator functions.
+
+    The generator runs in its own copy of the caller's context, taken when it is
+    created, so its span and the spans opened inside it are current only while it
+    runs: code consuming the items in between is not attributed to them.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            def generate():
+                with span(name, **attributes):
+                    yield from func(*args, **kwargs)
+            return _run_in_context(generate(), contextvars.copy_context())
+        return wrapper
+    return decorator
+
+
+def record(**counters):
+    """Adds counters to the current span, its ancestors and the process totals."""
+    current = _current_span.get()
+    with _span_lock:
+        while current is not None:
+            for key, value in counters.items():
+                current.counters[key] = current.counters.get(key, 0) + value
+            current = current.parent
+    registry.record(counters)
+
+
+def current_span():
+    """Returns the innermost active span, or None outside any span."""
+    return _current_span.get()
+
+
+def metrics_snapshot():
+    """Returns the process-wide aggregates; see ``MetricsRegistry.snapshot``."""
+    return registry.snapshot()
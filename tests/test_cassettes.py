@@ -0,0 +1,56 @@
+import httpx
+import pytest
+from src.cassettes import CassetteMissError, CassetteTransport
+from src.openai_client import CircuitBreaker, GuardedTransport
+
+BASE_URL = "https://api.openai.test/v1"
+
+REQUESTS = [
+    ("/completions", {"model": "test", "prompt": "Audit withdraw()"}),
+    ("/completions", {"model": "test", "prompt": "Audit withdraw()", "stream": True}),
+    ("/chat/completions", {"model": "test", "messages": [{"role": "user", "content": "Audit deposit()"}]}),
+    ("/embeddings", {"model": "test", "input": ["reentrancy", "tx.origin"]}),
+]
+
+
+class CountingTransport(httpx.BaseTransport):
+    """Stands in for the API with synthetic answers, counting the calls."""
+
+    def __init__(self):
+        self.inner = CassetteTransport("synthetic", embedding_size=8)
+        self.calls = 0
+
+    def handle_request(self, request):
+        self.calls += 1
+        return self.inner.handle_request(request)
+
+
+def post_all(transport):
+    with httpx.Client(transport=transport) as client:
+        return [client.post(BASE_URL + endpoint, json=body).content for endpoint, body in REQUESTS]
+
+
+def test_replay_returns_the_recorded_bodies(tmp_path):
+    path = str(tmp_path / "cassette.jsonl")
+    upstream = CountingTransport()
+    recorded = post_all(CassetteTransport("record", path=path, inner=upstream))
+    assert upstream.calls == len(REQUESTS)
+
+    replay = CassetteTransport("replay", path=path)
+    assert post_all(replay) == recorded
+    assert (replay.calls, replay.misses) == (len(REQUESTS), 0)
+
+
+def test_replay_miss_raises_without_tripping_the_breaker(tmp_path):
+    path = str(tmp_path / "cassette.jsonl")
+    post_all(CassetteTransport("record", path=path, inner=CountingTransport()))
+
+    transport = GuardedTransport(transport=CassetteTransport("replay", path=path), rpm=1e9, tpm=1e12, max_retries=0)
+    transport.breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60.0)
+    with httpx.Client(transport=transport) as client:
+        for _ in range(3):
+            with pytest.raises(CassetteMissError):
+                client.post(BASE_URL + "/completions", json={"model": "test", "prompt": "Not recorded"})
+        assert transport.breaker.state == "closed" and transport.breaker.failures == 0
+        assert client.post(BASE_URL + REQUESTS[0][0], json=REQUESTS[0][1]).status_code == 200
+    assert transport.limiter.in_flight == 0
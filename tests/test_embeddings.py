@@ -0,0 +1,39 @@
+import pytest
+from langchain_community.vectorstores import FAISS
+import src.embeddings as embeddings
+from src.embeddings import HashedTfidfEmbeddings, get_index_embeddings, get_index_provider
+from src.rag_core import build_and_save_vector_store, update_vector_store
+
+DOCS = [
+    ("reentrancy.md", "Reentrancy: the external call happens before the balance update in withdraw."),
+    ("origin.md", "Authorization with tx.origin lets a phishing contract act for the owner (SWC-115)."),
+]
+
+
+@pytest.fixture
+def local_index(tmp_path, monkeypatch):
+    monkeypatch.setattr(embeddings, "CONFIGURED_PROVIDER", None)
+    index_path = str(tmp_path / "index")
+    build_and_save_vector_store(DOCS, index_path=index_path, provider="local")
+    return index_path
+
+
+def test_index_is_loaded_with_the_backend_that_built_it(local_index):
+    assert get_index_provider(local_index) == "local"
+    vector_store = FAISS.load_local(local_index, get_index_embeddings(local_index), allow_dangerous_deserialization=True)
+    assert isinstance(vector_store.embeddings, HashedTfidfEmbeddings)
+    assert vector_store.similarity_search("tx.origin authorization", k=1)[0].metadata["source"] == "origin.md"
+
+
+def test_configured_backend_that_differs_from_the_index_is_rejected(local_index, monkeypatch):
+    monkeypatch.setattr(embeddings, "CONFIGURED_PROVIDER", "openai")
+    with pytest.raises(ValueError, match="built with 'local'"):
+        get_index_embeddings(local_index)
+
+
+def test_update_does_not_mix_backends(local_index):
+    with pytest.raises(ValueError, match="built with 'local'"):
+        update_vector_store([("new.md", "Unchecked return value of a low-level call.")], index_path=local_index,
+                            provider="openai")
+    assert update_vector_store([("new.md", "Unchecked return value of a low-level call.")], index_path=local_index,
+                               provider="local")
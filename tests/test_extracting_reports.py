@@ -0,0 +1,117 @@
+import pytest
+import requests
+from extracting_reports import run_fake_github_server, sync_reports, update_index
+
+
+class RecordingSession(requests.Session):
+    """Records the URL and If-None-Match header of every GET."""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+
+    def get(self, url, **kwargs):
+        self.calls.append((url, (kwargs.get("headers") or {}).get("If-None-Match")))
+        return super().get(url, **kwargs)
+
+
+class TamperingSession(RecordingSession):
+    """Corrupts the downloaded content of one file."""
+
+    def __init__(self, name):
+        super().__init__()
+        self.name = name
+
+    def get(self, url, **kwargs):
+        response = super().get(url, **kwargs)
+        if url.endswith("/raw/" + self.name) and response.status_code == 200:
+            response._content = b"tampered"
+        return response
+
+
+@pytest.fixture
+def upstream(tmp_path):
+    directory = tmp_path / "upstream"
+    directory.mkdir()
+    for i in range(5):
+        (directory / f"report-{i}.md").write_text(f"# [H-01] Finding {i}\n", encoding="utf-8")
+    # Two entries per page, so the listing spans three pages
+    server, api_url = run_fake_github_server(str(directory), port=0, page_size=2)
+    yield directory, api_url
+    server.shutdown()
+
+
+def sync(api_url, output_dir, session=None, **kwargs):
+    session = session or RecordingSession()
+    return sync_reports(api_url, str(output_dir), workers=2, session=session, **kwargs), session
+
+
+def test_change_on_a_later_listing_page_is_picked_up(upstream, tmp_path):
+    directory, api_url = upstream
+    output_dir = tmp_path / "reports"
+    sync(api_url, output_dir)
+
+    (directory / "report-4.md").write_text("# [H-01] Finding 4, revised\n", encoding="utf-8")
+    result, _ = sync(api_url, output_dir)
+    assert result["updated"] == ["report-4.md"]
+    assert (output_dir / "report-4.md").read_text(encoding="utf-8") == "# [H-01] Finding 4, revised\n"
+
+
+def test_first_sync_adds_every_file(upstream, tmp_path):
+    _, api_url = upstream
+    result, _ = sync(api_url, tmp_path / "reports")
+    assert sorted(result["added"]) == [f"report-{i}.md" for i in range(5)]
+    assert not result["updated"] and not result["unchanged"] and not result["failed"]
+    assert (tmp_path / "reports" / "report-0.md").read_text(encoding="utf-8") == "# [H-01] Finding 0\n"
+
+
+def test_rerun_sends_conditional_requests_and_reports_every_file_unchanged(upstream, tmp_path):
+    _, api_url = upstream
+    sync(api_url, tmp_path / "reports")
+    result, session = sync(api_url, tmp_path / "reports")
+    assert sorted(result["unchanged"]) == [f"report-{i}.md" for i in range(5)]
+    assert not result["added"] and not result["updated"]
+    # One conditional request per listing page and no downloads
+    assert len(session.calls) == 3
+    assert all(etag for _, etag in session.calls)
+
+
+def test_changed_file_is_updated(upstream, tmp_path):
+    directory, api_url = upstream
+    sync(api_url, tmp_path / "reports")
+    (directory / "report-1.md").write_text("# [H-01] Finding 1, revised\n", encoding="utf-8")
+    result, session = sync(api_url, tmp_path / "reports")
+    assert result["updated"] == ["report-1.md"]
+    assert sorted(result["unchanged"]) == ["report-0.md", "report-2.md", "report-3.md", "report-4.md"]
+    assert [url for url, _ in session.calls if "/raw/" in url] == [api_url.replace("/contents", "/raw/report-1.md")]
+
+
+def test_checksum_mismatch_is_reported_as_failed(upstream, tmp_path):
+    _, api_url = upstream
+    result, _ = sync(api_url, tmp_path / "reports", session=TamperingSession("report-2.md"))
+    assert result["failed"] == ["report-2.md"]
+    assert not (tmp_path / "reports" / "report-2.md").exists()
+
+    # The next run lists again and fetches the file
+    result, _ = sync(api_url, tmp_path / "reports")
+    assert result["added"] == ["report-2.md"]
+
+
+def test_prune_removes_files_deleted_upstream(upstream, tmp_path):
+    directory, api_url = upstream
+    sync(api_url, tmp_path / "reports")
+    (directory / "report-3.md").unlink()
+
+    result, _ = sync(api_url, tmp_path / "reports")
+    assert result["removed"] == ["report-3.md"]
+    assert (tmp_path / "reports" / "report-3.md").exists()
+
+    result, _ = sync(api_url, tmp_path / "reports", prune=True)
+    assert result["removed"] == ["report-3.md"]
+    assert not (tmp_path / "reports" / "report-3.md").exists()
+
+
+def test_update_index_rejects_output_dir_outside_knowledge_dir(tmp_path):
+    result = {"added": ["report-0.md"], "updated": [], "unchanged": [], "removed": [], "failed": []}
+    with pytest.raises(ValueError, match="not inside the knowledge directory"):
+        update_index(result, str(tmp_path / "reports"), str(tmp_path / "knowledge_base"), str(tmp_path / "index"))
@@ -0,0 +1,83 @@
+import textwrap
+from src.fingerprints import (
+    FINGERPRINT_INDEX_FILE, FingerprintIndex, clear_fingerprint_cache, extract_vulnerable_snippets,
+    format_known_patterns, get_fingerprint_index,
+)
+from src.tracing import span
+
+SOURCE = textwrap.dedent("""\
+    function withdraw(uint256 amount) external {
+        require(balances[msg.sender] >= amount, "insufficient");
+        (bool success, ) = msg.sender.call{value: amount}("");
+        require(success, "transfer failed");
+        balances[msg.sender] -= amount;
+        emit Withdrawn(msg.sender, amount);
+    }
+""")
+
+REPORT = """\
+# [H-01] Reentrancy in withdraw
+
+```solidity
+File: Vault.sol
+{numbered}
+```
+
+# Recommendations
+
+Update the balance before the external call.
+"""
+
+
+def numbered(code, first_line=490):
+    lines = code.splitlines()
+    quoted = [f"{first_line + i}:     {line}" for i, line in enumerate(lines[:3])]
+    quoted += ["..."] + [f"{first_line + 10 + i}:     {line}" for i, line in enumerate(lines[3:])]
+    return "\n".join(quoted)
+
+
+def test_numbered_report_snippet_matches_its_unnumbered_source(tmp_path):
+    (tmp_path / "Vault-security-review.md").write_text(REPORT.format(numbered=numbered(SOURCE)), encoding="utf-8")
+    snippets = extract_vulnerable_snippets(str(tmp_path))
+    assert "490:" not in snippets[0]["code"] and "..." not in snippets[0]["code"]
+
+    matches = FingerprintIndex.build(snippets).match(SOURCE)
+    assert [(m["report"], m["finding"]) for m in matches] == [("Vault-security-review.md", "H-01")]
+    assert matches[0]["similarity"] > 0.8
+
+
+def build_index(tmp_path):
+    reports = tmp_path / "reports"
+    reports.mkdir()
+    (reports / "Vault-security-review.md").write_text(REPORT.format(numbered=numbered(SOURCE)), encoding="utf-8")
+    return FingerprintIndex.build(extract_vulnerable_snippets(str(reports)))
+
+
+def test_index_is_saved_as_a_single_file(tmp_path):
+    index_path = tmp_path / "index"
+    build_index(tmp_path).save(str(index_path))
+    assert sorted(p.name for p in index_path.iterdir()) == [FINGERPRINT_INDEX_FILE]
+    clear_fingerprint_cache(str(index_path))
+    loaded = get_fingerprint_index(str(index_path))
+    assert loaded.snippets[0]["finding"] == "H-01"
+    assert "Known Vulnerable Patterns" in format_known_patterns([{"name": "withdraw", "code": SOURCE}], str(index_path))
+
+
+def test_unreadable_index_yields_no_known_patterns(tmp_path):
+    index_path = tmp_path / "index"
+    index_path.mkdir()
+    (index_path / FINGERPRINT_INDEX_FILE).write_bytes(b"not an npz file")
+    clear_fingerprint_cache(str(index_path))
+    assert format_known_patterns([{"name": "withdraw", "code": SOURCE}], str(index_path)) == ""
+
+
+def test_reused_index_is_recorded_as_a_cache_hit(tmp_path):
+    index_path = str(tmp_path / "index")
+    build_index(tmp_path).save(index_path)
+    clear_fingerprint_cache(index_path)
+    with span("audit") as first:
+        get_fingerprint_index(index_path)
+    with span("audit") as second:
+        get_fingerprint_index(index_path)
+    assert first.counters == {"fingerprint_cache_misses": 1}
+    assert second.counters == {"fingerprint_cache_hits": 1}
@@ -0,0 +1,111 @@
+import sqlite3
+import threading
+import time
+from src.jobs import COMPLETED, RUNNING, JobStore, WorkerPool
+
+CONTRACT = """
+pragma solidity ^0.8.0;
+
+contract Vault {
+    mapping(address => uint256) public balances;
+
+    function deposit() external payable {
+        balances[msg.sender] += msg.value;
+    }
+
+    function withdraw(uint256 amount) external {
+        balances[msg.sender] -= amount;
+        payable(msg.sender).transfer(amount);
+    }
+}
+"""
+
+
+class StubChain:
+    """Answers every function without a finding, counting the calls."""
+
+    def __init__(self):
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def invoke(self, inputs):
+        with self.lock:
+            self.calls += 1
+        return {"result": "No vulnerabilities found."}
+
+
+def make_store(tmp_path, lease_timeout=60.0):
+    store = JobStore(str(tmp_path / "jobs.db"), lease_timeout=lease_timeout)
+    return store, store.submit(CONTRACT, index_path=str(tmp_path / "index"))
+
+
+def test_expired_lease_is_reclaimed(tmp_path):
+    store, job_id = make_store(tmp_path, lease_timeout=0.05)
+    first = store.claim_next("pool-a")
+    store.claim_next("pool-a")
+    time.sleep(0.1)
+    reclaimed = store.claim_next("pool-b")
+    assert (reclaimed["job_id"], reclaimed["func_index"]) == (job_id, first["func_index"])
+
+
+def test_live_lease_of_another_pool_is_not_reclaimed(tmp_path):
+    store, _ = make_store(tmp_path)
+    assert store.claim_next("pool-a") and store.claim_next("pool-a")
+    assert store.claim_next("pool-b") is None
+
+
+def test_complete_finishes_the_job_on_its_last_function(tmp_path):
+    store, job_id = make_store(tmp_path)
+    tasks = [store.claim_next("pool-a"), store.claim_next("pool-a")]
+    assert not store.complete(job_id, tasks[0]["func_index"], "first\n", "pool-a")
+    assert store.get_job(job_id)["status"] == RUNNING
+    assert store.complete(job_id, tasks[1]["func_index"], "second\n", "pool-a")
+    job = store.get_job(job_id)
+    assert job["status"] == COMPLETED and job["report"].endswith("first\nsecond\n")
+
+
+def test_result_of_an_expired_lease_is_ignored(tmp_path):
+    store, job_id = make_store(tmp_path, lease_timeout=0.05)
+    task = store.claim_next("pool-a")
+    time.sleep(0.1)
+    assert store.claim_next("pool-b")["func_index"] == task["func_index"]
+    assert not store.complete(job_id, task["func_index"], "stale\n", "pool-a")
+    store.complete(job_id, task["func_index"], "fresh\n", "pool-b")
+    assert store.get_results(job_id) == ["fresh\n"]
+
+
+def test_worker_pool_analyzes_every_function_once(tmp_path):
+    store, job_id = make_store(tmp_path)
+    chain = StubChain()
+    pool = WorkerPool(store, chain, workers=2, poll_interval=0.01).start()
+    try:
+        deadline = time.monotonic() + 10
+        while store.get_job(job_id)["status"] != COMPLETED:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+    finally:
+        pool.stop()
+    assert chain.calls == 2
+    assert store.get_job(job_id)["completed_functions"] == 2
+
+
+def test_store_created_by_an_earlier_version_is_migrated(tmp_path):
+    db_path = str(tmp_path / "jobs.db")
+    with sqlite3.connect(db_path) as conn:
+        conn.executescript("""
+            CREATE TABLE jobs (id TEXT PRIMARY KEY, status TEXT NOT NULL, code TEXT NOT NULL,
+                               total_functions INTEGER NOT NULL, created_at REAL NOT NULL, updated_at REAL NOT NULL);
+            CREATE TABLE job_functions (job_id TEXT NOT NULL REFERENCES jobs(id), func_index INTEGER NOT NULL,
+                                        func_name TEXT NOT NULL, code TEXT NOT NULL, status TEXT NOT NULL,
+                                        result TEXT, updated_at REAL NOT NULL, PRIMARY KEY (job_id, func_index));
+        """)
+        conn.execute("INSERT INTO jobs VALUES ('old', ?, 'code', 1, 0, 0)", (RUNNING,))
+        conn.execute("INSERT INTO job_functions VALUES ('old', 0, 'withdraw', 'code', ?, NULL, 0)", (RUNNING,))
+    conn.close()
+
+    store = JobStore(db_path)
+    assert store.get_job("old")["known_patterns"] == ""
+    # A task left running by an old pool has no lease, so it is claimable right away
+    assert store.claim_next("pool-a")["job_id"] == "old"
+    assert store.complete("old", 0, "done\n", "pool-a")
+    assert store.get_job("old")["status"] == COMPLETED
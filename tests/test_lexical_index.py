@@ -0,0 +1,117 @@
+import numpy as np
+import pytest
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from src.embeddings import HashedTfidfEmbeddings
+from src.lexical_index import BM25Index, HybridRetriever, RRF_K, is_identifier_query, tokenize
+
+TEXTS = [
+    "Authorization with tx.origin lets a phishing contract act as the owner.",
+    "SWC-107 reentrancy: the external call happens before the state update in withdraw.",
+    "Miners can shift block.timestamp slightly, so do not use it for randomness.",
+    "An unchecked return value of a low-level call can hide a failed transfer.",
+    "Reentrancy guards such as nonReentrant protect the withdraw function.",
+]
+
+
+class CountingEmbeddings(Embeddings):
+    """Counts embedding calls and embedded texts made through the wrapped backend."""
+
+    def __init__(self, inner):
+        self.inner = inner
+        self.calls = 0
+        self.texts = 0
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        self.texts += len(texts)
+        return self.inner.embed_documents(texts)
+
+    def embed_query(self, text):
+        self.calls += 1
+        self.texts += 1
+        return self.inner.embed_query(text)
+
+
+@pytest.fixture
+def retriever():
+    embeddings = CountingEmbeddings(HashedTfidfEmbeddings().fit(TEXTS))
+    vector_store = FAISS.from_documents([Document(page_content=text) for text in TEXTS], embeddings)
+    embeddings.calls = embeddings.texts = 0
+    return HybridRetriever(vector_store=vector_store, lexical_index=BM25Index.build(TEXTS), k=2)
+
+
+def test_identifiers_stay_single_tokens():
+    assert tokenize("Check tx.origin, SWC-107 and abi.encodePacked") == [
+        "check", "tx.origin", "swc-107", "and", "abi.encodepacked"
+    ]
+
+
+def test_postings_match_the_documents_containing_each_term():
+    index = BM25Index.build(TEXTS)
+    for term_id, term in enumerate(index.terms):
+        postings = index.doc_ids[index.offsets[term_id]:index.offsets[term_id + 1]]
+        assert list(postings) == [i for i, text in enumerate(TEXTS) if term in tokenize(text)]
+        assert all(index.term_freqs[index.offsets[term_id]:index.offsets[term_id + 1]] > 0)
+
+
+def test_identifier_queries_find_their_chunk():
+    index = BM25Index.build(TEXTS)
+    assert index.search("tx.origin", k=1)[0][0] == 0
+    assert index.search("SWC-107", k=1)[0][0] == 1
+    assert {doc_id for doc_id, _ in index.search("withdraw reentrancy", k=5)} == {1, 4}
+    assert index.search("zzz qqq", k=5) == []
+
+
+def test_index_round_trips_through_save_and_load(tmp_path):
+    index = BM25Index.build(TEXTS)
+    index.save(str(tmp_path))
+    loaded = BM25Index.load(str(tmp_path))
+    for name in ("terms", "offsets", "doc_ids", "term_freqs", "doc_lengths"):
+        assert np.array_equal(getattr(loaded, name), getattr(index, name))
+    assert loaded.search("reentrancy withdraw", k=3) == index.search("reentrancy withdraw", k=3)
+
+
+def test_identifier_query_detection():
+    assert is_identifier_query("tx.origin")
+    assert is_identifier_query("SWC-107")
+    assert is_identifier_query("delegatecall selfdestruct")
+    assert not is_identifier_query("reentrancy attack on withdraw function")
+    assert not is_identifier_query("")
+
+
+def test_rrf_ranks_documents_found_by_both_retrievers_first(retriever):
+    lexical = [doc_id for doc_id, _ in retriever.lexical_index.search("withdraw", retriever.fetch_k)]
+    vector = [(2, 0.1), (lexical[0], 0.2)]
+    expected = {}
+    for ranking in ([doc_id for doc_id, _ in vector], lexical):
+        for rank, doc_id in enumerate(ranking):
+            expected[doc_id] = expected.get(doc_id, 0.0) + 1 / (RRF_K + rank + 1)
+    fused = retriever._fuse(vector, "withdraw", k=3)
+    assert fused[0] == lexical[0]
+    assert fused == sorted(expected, key=expected.get, reverse=True)[:3]
+
+
+def test_auto_mode_answers_identifier_queries_without_embedding(retriever):
+    assert retriever.search("tx.origin")[0].page_content == TEXTS[0]
+    assert retriever.vector_store.embeddings.calls == 0
+    retriever.search("how can a phishing contract act as the owner")
+    assert retriever.vector_store.embeddings.calls == 1
+
+
+@pytest.mark.parametrize("mode", [None, "hybrid", "vector", "lexical"])
+def test_batch_search_embeds_each_distinct_query_once_and_matches_search(retriever, mode):
+    queries = [
+        "external call before the state update",
+        "tx.origin",
+        "external call before the state update",
+        "randomness from the block timestamp",
+    ]
+    batched = retriever.batch_search(queries, mode=mode)
+    embeddings = retriever.vector_store.embeddings
+    embedded = {None: 2, "hybrid": 3, "vector": 3, "lexical": 0}[mode]
+    assert (embeddings.calls, embeddings.texts) == ((1 if embedded else 0), embedded)
+
+    for query, documents in zip(queries, batched):
+        assert [doc.page_content for doc in documents] == [doc.page_content for doc in retriever.search(query, mode=mode)]
@@ -0,0 +1,120 @@
+import socket
+import threading
+import time
+import httpx
+import pytest
+from src.openai_client import CircuitBreaker, CircuitOpenError, GuardedTransport, TokenBucket, run_fake_openai_server
+
+
+class ScriptedTransport(httpx.BaseTransport):
+    """Forwards to the fake server, except for the scripted failures of the first calls."""
+
+    def __init__(self, script):
+        self.inner = httpx.HTTPTransport()
+        self.script = list(script)
+
+    def handle_request(self, request):
+        outcome = self.script.pop(0) if self.script else None
+        if isinstance(outcome, int):
+            return httpx.Response(outcome, json={"error": {"message": "Scripted error"}}, request=request)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return self.inner.handle_request(request)
+
+
+@pytest.fixture(scope="module")
+def base_url():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    threading.Thread(
+        target=run_fake_openai_server,
+        kwargs={"port": port, "latency": 0.0, "throttle_rate": 0.0, "error_rate": 0.0},
+        daemon=True,
+    ).start()
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            break
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+    return f"http://127.0.0.1:{port}/v1"
+
+
+def guarded_client(script):
+    transport = GuardedTransport(transport=ScriptedTransport(script), rpm=1e9, tpm=1e12, max_retries=0)
+    transport.breaker = CircuitBreaker(failure_threshold=5, reset_timeout=0.05)
+    return transport, httpx.Client(transport=transport)
+
+
+def complete(client, base_url, **body):
+    return client.post(f"{base_url}/completions", json={"model": "test", "prompt": "ping", **body})
+
+
+@pytest.mark.parametrize("trial_error", [httpx.ReadError("connection reset"), RuntimeError("not an HTTP failure")])
+def test_breaker_recovers_after_unretried_error_on_trial_call(base_url, trial_error):
+    transport, client = guarded_client([503] * 5 + [trial_error])
+    for _ in range(5):
+        assert complete(client, base_url).status_code == 503
+    assert transport.breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        complete(client, base_url)
+
+    time.sleep(0.06)
+    with pytest.raises(type(trial_error)):
+        complete(client, base_url)
+    assert transport.limiter.in_flight == 0
+
+    # A ReadError counts as a failed trial and reopens the breaker; any other error gives the trial back
+    time.sleep(0.06)
+    assert complete(client, base_url).status_code == 200
+    assert complete(client, base_url).status_code == 200
+    assert transport.breaker.state == "closed"
+    assert transport.stats.snapshot()["/completions"]["errors"] == 7
+
+
+def test_token_bucket_waits_for_refill_and_respects_deadline():
+    bucket = TokenBucket(rate=100.0, capacity=5)
+    assert bucket.acquire(5)
+    assert not bucket.acquire(5, deadline=time.monotonic() + 0.01)
+    start = time.monotonic()
+    assert bucket.acquire(2, deadline=time.monotonic() + 1.0)
+    assert 0.01 <= time.monotonic() - start < 0.5
+
+
+def test_limiter_halves_on_throttling_and_never_grows_on_server_errors(base_url):
+    transport, client = guarded_client([429, 429, 503, 503, 503])
+    initial = transport.limiter.limit
+    for _ in range(2):
+        assert complete(client, base_url).status_code == 429
+    assert transport.limiter.limit == max(transport.limiter.minimum, initial / 4)
+
+    throttled = transport.limiter.limit
+    for _ in range(3):
+        assert complete(client, base_url).status_code == 503
+    assert transport.limiter.limit == throttled
+
+    assert complete(client, base_url).status_code == 200
+    assert transport.limiter.limit == throttled + 1 / throttled
+
+
+def test_streamed_response_holds_its_slot_until_closed(base_url):
+    transport, client = guarded_client([])
+    with client.stream("POST", f"{base_url}/completions", json={"model": "test", "prompt": "ping", "stream": True}) as response:
+        assert response.headers["content-type"].startswith("text/event-stream")
+        assert transport.limiter.in_flight == 1
+        assert "/completions" not in transport.stats.snapshot()
+        body = response.read()
+    assert body.endswith(b"data: [DONE]\n\n")
+    assert transport.limiter.in_flight == 0
+    assert transport.stats.snapshot()["/completions"]["calls"] == 1
+
+
+def test_abandoned_stream_releases_its_slot(base_url):
+    transport, client = guarded_client([])
+    with client.stream("POST", f"{base_url}/completions", json={"model": "test", "prompt": "ping", "stream": True}) as response:
+        next(response.iter_raw(16))
+    assert transport.limiter.in_flight == 0
@@ -0,0 +1,31 @@
+from src.tracing import current_span, span, traced_generator
+
+
+@traced_generator("outer")
+def outer():
+    with span("inner"):
+        yield current_span().name
+        yield current_span().name
+
+
+def test_generator_span_is_current_only_while_the_generator_runs():
+    with span("caller") as caller:
+        items = []
+        for item in outer():
+            items.append(item)
+            assert current_span() is caller
+    assert items == ["inner", "inner"]
+    (outer_span,) = caller.children
+    assert outer_span.name == "outer" and outer_span.error is None
+    assert [child.name for child in outer_span.children] == ["inner"]
+
+
+def test_generator_closed_early_is_not_an_error():
+    with span("caller") as caller:
+        generator = outer()
+        next(generator)
+        generator.close()
+        assert current_span() is caller
+    (outer_span,) = caller.children
+    assert outer_span.error is None and outer_span.attributes["closed_early"]
+    assert outer_span.children[0].attributes["closed_early"]